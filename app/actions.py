@@ -23,10 +23,9 @@ except NameError:
     unichr = chr
 
 import bisect
+import codecs
 import curses.ascii
-import difflib
 import binascii
-import io
 import os
 import re
 import sys
@@ -35,15 +34,58 @@ import traceback
 import warnings
 
 import app.bookmark
+import app.columns
 import app.config
 from app.curses_util import columnWidth
 import app.history
+import app.journal
+import app.line_diff
+import app.line_store
 import app.log
 import app.mutator
 import app.parser
 import app.selectable
 
 
+# White space other than tab, ending a row.
+kReEndSpacesNotTab = re.compile(u'[^\\S\t]+$')
+
+# A progressive load (see loadMore()) first reads this many bytes, then
+# doubles the amount read each time up to the limit.
+kLoadFirstChunkSize = 64 * 1024
+kLoadChunkSizeLimit = 16 * 1024 * 1024
+# While reading a stream (see fileStream()), loadMore() waits at most this many
+# seconds for more input.
+kStreamWaitSeconds = 0.02
+
+# A save encodes and writes this many rows at a time.
+kSaveChunkRows = 16 * 1024
+
+# A filter of at least this many selected rows runs in the background (see
+# filterStart()).
+kBackgroundFilterRows = 64 * 1024
+
+# The recovery journal is compacted once it's this many times the size of the
+# document (though never while smaller than the minimum, in bytes).
+kJournalCompactRatio = 4
+kJournalCompactMinSize = 256 * 1024
+
+# Performance tiers for large files (see the editor "performanceTiers" pref).
+# Each tier also keeps the savings of the tiers below it.
+kTierNormal = 0
+# No spelling or overlays (brackets, numbers, trailing space).
+kTierNoOverlays = 1
+# No file history, so no checksum of the file on open or save. The lines are
+# held compactly (see app.line_store.PackedLines).
+kTierNoHistory = 2
+# Undo groups many edits into each step (see Mutator.coarseUndo).
+kTierCoarseUndo = 3
+# The file is mapped rather than read, and may only be viewed (see fileMap()).
+kTierMapped = 4
+kTierNames = (u'', u'large file', u'no history', u'coarse undo',
+              u'read only view')
+
+
 class Actions(app.mutator.Mutator):
     """This base class to TextBuffer handles the text manipulation (without
     handling the drawing/rendering of the text)."""
@@ -53,6 +95,12 @@ class Actions(app.mutator.Mutator):
         self.program = program
         self.view = None
         self.bookmarks = []
+        # The fields of the rows in column mode (an app.columns.ColumnIndex),
+        # or None.
+        self.columnIndex = None
+        # The column starts and the set of rows that were last drawn lined up
+        # in columns (see TextBuffer.drawColumns()), or None.
+        self.columnsDrawn = None
         self.fileExtension = None
         self.nextBookmarkColorPos = 0
         self.fileEncoding = None
@@ -60,9 +108,30 @@ class Actions(app.mutator.Mutator):
         self.isBinary = False
         self.lastChecksum = None
         self.lastFileSize = 0
+        self.performanceTier = kTierNormal
+        # The recovery journal of unsaved changes (see journalFlush()).
+        self.journal = None
+        # The filter of the selected lines that is running (see
+        # filterStart()), and the changeVersion and selection it started with.
+        self.lineFilter = None
+        self.__filterSelection = None
+        # The file being read by a progressive load, see loadMore().
+        self.__loadReader = None
+        self.__loadChunkSize = kLoadFirstChunkSize
+        # The "decodeErrors" pref the progressive load started with.
+        self.__loadDecodeErrors = None
+        # Where some rows start in the file, as (row, byte offset) pairs, if
+        # the file is as the lines were when loaded or saved (see
+        # partialWriteIndex()).
+        self.__rowOffsets = None
+        self.redoChainLimit = self.program.prefs.editor.get(u'undoLimit')
         self.rootGrammar = self.program.prefs.getGrammar(None)
         self.debugUpperChangedRow = -1
         self.parser = app.parser.Parser()
+        # The |lines| list that the parser last parsed (see updateParser()).
+        self.__parsedLines = None
+        # The changeVersion of the lines the parser last parsed.
+        self.__parsedVersion = None
         self.fileFilter(u'')
 
     def getMatchingBracketRowCol(self):
@@ -324,7 +393,10 @@ class Actions(app.mutator.Mutator):
 
     def backspace(self):
         #app.log.info('backspace', self.penRow > self.markerRow)
-        if self.selectionMode != app.selectable.kSelectionNone:
+        if self.cursorsActive():
+            self.cursorsEdit(lambda line, col: (col - 1, line[col - 1:col], u'')
+                             if col else None)
+        elif self.selectionMode != app.selectable.kSelectionNone:
             self.performDelete()
         elif self.penCol == 0:
             if self.penRow > 0:
@@ -556,6 +628,23 @@ class Actions(app.mutator.Mutator):
         penRow = min(max(row, 0), len(self.lines) - 1)
         self.cursorMove(penRow - self.penRow, col - self.penCol)
 
+    def cursorMoveToField(self, index):
+        """Move the cursor to the start of field |index| of its row, in column
+        mode (see setColumnMode()).
+
+        Returns:
+            False if the row has no such field.
+        """
+        starts = self.columnIndex.fields(self, self.penRow)[0]
+        if index >= len(starts):
+            return False
+        line = self.lines[self.penRow]
+        self.selectionNone()
+        self.cursorMoveTo(self.penRow,
+                          app.curses_util.columnWidth(line[:starts[index]]))
+        self.updateBasicScrollPosition()
+        return True
+
     def cursorMoveWordLeft(self):
         self.selectionNone()
         self.doCursorMoveLeftTo(app.regex.kReWordBoundary)
@@ -826,6 +915,114 @@ class Actions(app.mutator.Mutator):
         self.selectionNone()
         self.scrollUp()
 
+    def cursorsActive(self):
+        """Whether typing, backspace and delete are also done at the extra
+        cursors (see Mutator.extraCursors). The extra cursors are dropped once
+        there's a selection, or once the document is changed other than at the
+        cursors (their places would be out of date).
+        """
+        if self.extraCursors and (
+                self.extraCursorsVersion != self.changeVersion or
+                self.selectionMode != app.selectable.kSelectionNone):
+            self.cursorsClear()
+        return bool(self.extraCursors)
+
+    def cursorsClear(self):
+        self.extraCursors = []
+
+    def cursorsEdit(self, edit):
+        """Make an edit at the pen and at each of the extra cursors, as one
+        change. So the edit is undone as one, and the rows are parsed again
+        once, however many cursors there are.
+
+        Args:
+          edit (function): Given a line and a column in it, returns the
+              (column, removed text, added text) of the edit to make there,
+              or None to leave that line as it is.
+        """
+        pen = (self.penRow, self.penCol)
+        cursors = sorted(set(self.extraCursors + [pen]))
+        edits = []
+        moved = []
+        # How far the edits so far on the |row| have moved the text after
+        # them.
+        row = None
+        shift = 0
+        for cursorRow, col in cursors:
+            if cursorRow != row:
+                row = cursorRow
+                shift = 0
+            found = edit(self.lines[row], col)
+            if found is None:
+                moved.append((row, col + shift))
+                continue
+            col, removed, added = found
+            edits.append((row, col, removed, added))
+            moved.append((row, col + shift + len(added)))
+            shift += len(added) - len(removed)
+        if not edits:
+            return
+        penRow, penCol = moved[cursors.index(pen)]
+        extraCursors = sorted(set(moved) - set([(penRow, penCol)]))
+        version = self.changeVersion
+        self.redoAddChange((u'mc', (tuple(edits), tuple(self.extraCursors),
+                                    tuple(extraCursors))))
+        self.redo()
+        if self.changeVersion == version:
+            # The edit was refused.
+            return
+        if penCol != self.penCol:
+            self.cursorMoveAndMark(0, penCol - self.penCol, 0, 0, 0)
+        self.goalCol = self.penCol
+        self.updateBasicScrollPosition()
+
+    def cursorsOnFinds(self):
+        """Put a cursor at the start of each match of the find pattern. The
+        pen moves to the first match.
+
+        Returns:
+            The number of cursors (including the pen), or 0 if there are no
+            matches.
+        """
+        if self.findRe is None or self.isViewOnly:
+            return 0
+        cursors = []
+        for row, line in enumerate(self.lines):
+            for found in self.findRe.finditer(line):
+                cursors.append((row, found.start()))
+        if not cursors:
+            return 0
+        self.selectionNone()
+        self.cursorMoveTo(*cursors[0])
+        return self.__setExtraCursors(cursors)
+
+    def cursorsOnSelectedRows(self):
+        """Put a cursor on each of the selected rows, in the pen's column (or
+        at the end of shorter rows).
+
+        Returns:
+            The number of cursors (including the pen), or 0 if there is no
+            selection.
+        """
+        if self.selectionMode == app.selectable.kSelectionNone:
+            return 0
+        upperRow = min(self.penRow, self.markerRow)
+        lowerRow = max(self.penRow, self.markerRow)
+        col = self.penCol
+        self.selectionNone()
+        return self.__setExtraCursors([
+            (row, min(col, len(self.lines[row])))
+            for row in range(upperRow, lowerRow + 1)
+        ])
+
+    def __setExtraCursors(self, cursors):
+        """Set the extra cursors to the (sorted) |cursors|, other than the
+        pen. Returns the number of cursors, including the pen."""
+        pen = (self.penRow, self.penCol)
+        self.extraCursors = [cursor for cursor in cursors if cursor != pen]
+        self.extraCursorsVersion = self.changeVersion
+        return len(self.extraCursors) + 1
+
     def delCh(self):
         line = self.lines[self.penRow]
         change = (u'd', line[self.penCol:self.penCol + 1])
@@ -834,7 +1031,10 @@ class Actions(app.mutator.Mutator):
 
     def delete(self):
         """Delete character to right of pen i.e. Del key."""
-        if self.selectionMode != app.selectable.kSelectionNone:
+        if self.cursorsActive():
+            self.cursorsEdit(lambda line, col: (col, line[col:col + 1], u'')
+                             if col < len(line) else None)
+        elif self.selectionMode != app.selectable.kSelectionNone:
             self.performDelete()
         elif self.penCol == len(self.lines[self.penRow]):
             if self.penRow + 1 < len(self.lines):
@@ -879,6 +1079,9 @@ class Actions(app.mutator.Mutator):
         self.editPasteLines(tuple(self.doDataToLines(data)))
 
     def editPasteLines(self, clip):
+        if len(clip) == 1 and self.cursorsActive():
+            self.insert(clip[0])
+            return
         if self.selectionMode != app.selectable.kSelectionNone:
             self.performDelete()
         self.redoAddChange((u'v', clip))
@@ -896,112 +1099,810 @@ class Actions(app.mutator.Mutator):
         if not self.isSelectionInView():
             self.scrollToOptimalScrollPosition()
 
+    def editRevertToSaved(self):
+        """Undo (or redo) all the changes since the file was saved.
+
+        Returns:
+            False if the saved state is no longer in the undo history.
+        """
+        if not 0 <= self.savedAtRedoIndex <= len(self.redoChain):
+            return False
+        self.undoToIndex(self.savedAtRedoIndex)
+        if not self.isSelectionInView():
+            self.scrollToOptimalScrollPosition()
+        return True
+
     def editUndo(self):
         """Undo a set of redo nodes."""
         self.undo()
         if not self.isSelectionInView():
             self.scrollToOptimalScrollPosition()
 
-    def doLinesToBinaryData(self, lines):
-        # TODO(dschuyler): convert lines to binary data.
-        return ''
-
     def doLinesToData(self, lines):
-
-        def encode(line):
-            return chr(int(line.groups()[0], 16))
-
-        return re.sub(u'\x01([0-9a-fA-F][0-9a-fA-F])', encode, "\n".join(lines))
-
-    def doBinaryDataToLines(self, data):
-        long_hex = binascii.hexlify(data)
-        hex_list = []
-        i = 0
-        width = 32
-        while i < len(long_hex):
-            hex_list.append(long_hex[i:i + width] + '\n')
-            i += width
-        return hex_list
+        return app.line_store.unescapeControlCharacters(u"\n".join(lines))
 
     def doDataToLines(self, data):
         if app.config.strict_debug:
             assert isinstance(data, unicode)
-        # Performance: in a 1000 line test it appears fastest to do some simple
-        # .replace() calls to minimize the number of calls to parse().
-        data = data.replace(u'\r\n', u'\n')
-        data = data.replace(u'\r', u'\n')
-        tabSize = self.program.prefs.editor.get(u"tabSize", 8)
-        data = data.expandtabs(tabSize)
-
-        def parse(sre):
-            return u"\x01%02x" % ord(sre.groups()[0])
-
-        #data = re.sub(u'([\0-\x09\x0b-\x1f\x7f-\xff])', parse, data)
-        data = re.sub(u'([\0-\x09\x0b-\x1f])', parse, data)
-        return data.split(u'\n')
+        return app.line_store.textToLines(data, self.rowTabSize())
 
-    def dataToLines(self):
-        if self.isBinary:
-            self.lines = self.doDataToLines(self.data)
-            #self.lines = self.doBinaryDataToLines(self.data)
-        else:
-            self.lines = self.doDataToLines(self.data)
+    def dataToLines(self, data):
+        lines = self.doDataToLines(data)
+        if isinstance(self.lines, app.line_store.PackedLines):
+            # Keep the compact store chosen by setPerformanceTier().
+            lines = app.line_store.PackedLines(lines)
+        self.lines = lines
 
     def fileFilter(self, data):
-        self.data = data
-        self.dataToLines()
+        self.dataToLines(data)
+        self.noteLinesReplaced()
         self.upperChangedRow = 0
         self.savedAtRedoIndex = self.redoIndex
 
+    def fileFilterLines(self, lines):
+        """Like fileFilter(), for a document that is already split into
+        |lines| (see doDataToLines())."""
+        self.lines = lines
+        self.noteLinesReplaced()
+        self.upperChangedRow = 0
+        self.savedAtRedoIndex = self.redoIndex
+
+    def fileRefresh(self):
+        """Bring the document up to date with its file, after the file was
+        changed by another program (see app.file_watcher). Without unsaved
+        changes, the document is changed to match the file with a line diff,
+        as one undo step, and the pen, selection, and bookmarks move with
+        their rows. A document with unsaved changes is left as it is, with a
+        message that the file changed.
+
+        Returns:
+            True if the document was changed.
+        """
+        if (self.fileStat is None or self.isFileUnchanged() or
+                self.isLoading or self.isViewOnly or self.isBinary):
+            return False
+        color = self.program.prefs.color.get(u'status_line_error')
+        if not os.path.isfile(self.fullPath):
+            self.setMessage(u'The file was removed by another program',
+                            color=color)
+            return False
+        if self.isDirty():
+            self.setMessage(u'The file was changed by another program',
+                            color=color)
+            return False
+        reader = None
+        try:
+            reader = app.line_store.LineReader(
+                self.fullPath, self.fileEncoding,
+                self.rowTabSize())
+            lines = [u'']
+            while not reader.isDone:
+                lines[-1:] = reader.read(kLoadChunkSizeLimit)
+            fileStat = reader.stat()
+        except (IOError, OSError, ValueError) as e:
+            app.log.info(u'error refreshing file', self.fullPath, e)
+            self.setMessage(u'The file was changed by another program',
+                            color=color)
+            return False
+        finally:
+            if reader is not None:
+                reader.close()
+        changed = self.__changeLinesTo(lines)
+        if changed:
+            self.setMessage(u'Updated to the file changed by another program')
+        # The document matches the file again.
+        self.fileStat = fileStat
+        if self.performanceTier < kTierNoHistory:
+            self.lastChecksum = reader.checksum()
+        self.lastFileSize = reader.bytesRead
+        self.__rowOffsets = reader.rowOffsets
+        self.savedAtRedoIndex = self.redoIndex
+        self.savedVersion = self.changeVersion
+        return changed
+
+    def __changeLinesTo(self, lines):
+        """Change the document to |lines| with a line diff, as one undo
+        step. The pen, selection, and bookmarks move with their rows.
+
+        Returns:
+            True if the document was changed.
+        """
+        diff = app.line_diff.diffLines(self.lines, lines)
+        if len(diff) <= 1 and (not diff or type(diff[0]) is int):
+            return False
+        mapRow = app.line_diff.mapRow
+        penRow = min(mapRow(diff, self.penRow), len(lines) - 1)
+        markerRow = min(mapRow(diff, self.markerRow), len(lines) - 1)
+        penCol = min(self.penCol, len(lines[penRow]))
+        markerCol = min(self.markerCol, len(lines[markerRow]))
+        for bookmark in self.bookmarks:
+            bookmark.range = (min(mapRow(diff, bookmark.begin),
+                                  len(lines) - 1),
+                              min(mapRow(diff, bookmark.end), len(lines) - 1))
+        self.bookmarks.sort()
+        self.compoundChangePush()
+        self.redoAddChange((u'ld', tuple(diff)))
+        self.redo()
+        self.cursorMoveAndMark(penRow - self.penRow, penCol - self.penCol,
+                               markerRow - self.markerRow,
+                               markerCol - self.markerCol, 0)
+        self.compoundChangePush()
+        return True
+
+    def __journalBase(self):
+        """Identify the file on disk, for the recovery journal (see
+        app.journal)."""
+        if self.fileStat is None:
+            return None
+        return (self.fileStat.st_size, self.fileStat.st_mtime)
+
+    def journalDiscard(self):
+        """Stop journaling the document, and delete its recovery journal (the
+        unsaved changes are not wanted)."""
+        if self.journal is not None:
+            self.journal.remove()
+        self.journal = None
+        self.journalRecords = None
+
+    def journalFlush(self):
+        """Write the changes made since the last flush to the recovery journal
+        (see app.journal). Called while the program is idle. The journal is
+        removed once there are no unsaved changes, and compacted (rewritten
+        as a snapshot of the document) once it has grown to several times the
+        size of the document."""
+        journal = self.journal
+        if journal is None or self.isLoading:
+            return
+        if journal.path != self.fullPath:
+            # The file was saved under a new name.
+            journal.remove()
+            journal = self.journal = app.journal.Journal(
+                self.program.dirBackups, self.fullPath)
+        records = self.journalRecords
+        if not self.isDirty():
+            del records[:]
+            if journal.version is not None:
+                journal.remove()
+            return
+        if (journal.version == self.changeVersion and
+                journal.baseVersion == self.savedVersion):
+            del records[:]
+            return
+        try:
+            if journal.baseVersion != self.savedVersion:
+                # The changes are made to a newly loaded or saved file.
+                journal.start(self.__journalBase())
+                journal.baseVersion = self.savedVersion
+                journal.version = self.savedVersion
+            journal.append([
+                record[1:] for record in records if record[0] > journal.version
+            ])
+            journal.version = self.changeVersion
+            documentSize = max(self.lastFileSize, journal.snapshotSize,
+                               kJournalCompactMinSize)
+            if journal.size > kJournalCompactRatio * documentSize:
+                journal.start(self.__journalBase(), self.lines)
+        except (IOError, OSError) as e:
+            app.log.info(u'error writing the recovery journal', e)
+            self.journal = None
+            self.journalRecords = None
+            return
+        del records[:]
+
+    def __journalOpen(self):
+        """Start keeping a recovery journal for the newly loaded document."""
+        self.journal = None
+        self.journalRecords = None
+        directory = self.program.dirBackups
+        if (directory is None or not self.fullPath or self.isBinary or
+                self.isViewOnly or
+                not self.program.prefs.editor.get(u'recoveryJournal')):
+            return
+        self.journal = app.journal.Journal(directory, self.fullPath)
+        self.journalRecords = []
+
+    def journalRecover(self):
+        """Replay the recovery journal left for the file (e.g. by a crash),
+        if any, as one undo step. A journal that doesn't apply to the file as
+        it is now is kept under another name rather than replayed.
+
+        Returns:
+            True if unsaved changes were recovered.
+        """
+        journal = self.journal
+        if journal is None:
+            return False
+        saved = journal.read()
+        if saved is None:
+            return False
+        base, records = saved
+        lines = list(self.lines)
+        try:
+            if base != self.__journalBase() or self.isDirty():
+                raise ValueError(u'the file has changed')
+            app.journal.replay(lines, records)
+        except ValueError as e:
+            app.log.info(u'recovery journal not replayed', e)
+            try:
+                oldPath = journal.setAside()
+            except OSError as e:
+                app.log.info(u'error keeping the recovery journal', e)
+                self.journalDiscard()
+                return False
+            self.setMessage(u'The unsaved changes found for the file are '
+                            u'out of date, see ' + oldPath)
+            return False
+        if not self.__changeLinesTo(lines):
+            journal.remove()
+            return False
+        # The journal file already holds the recovered changes.
+        journal.baseVersion = self.savedVersion
+        journal.version = self.changeVersion
+        self.setMessage(u'Recovered unsaved changes, undo to discard them')
+        return True
+
+    def fileStream(self, inputFd, isPager=False):
+        """Read the document from the file descriptor |inputFd| (e.g. a
+        pipe), which is closed once the input ends. With the background thread
+        the rows are added as they arrive (see loadMore()), otherwise all of
+        the input is read now.
+
+        A pager is a read only view of the input, without undo.
+        """
+        app.log.info(u'fileStream', inputFd)
+        reader = app.line_store.LineReader(
+            inputFd, None, self.rowTabSize())
+        if isPager:
+            self.isReadOnly = True
+            self.isViewOnly = True
+            self.coarseUndo = True
+        lines = [u'']
+        if self.program.prefs.editor[u'useBgThread']:
+            self.__loadReader = reader
+            self.__loadChunkSize = kLoadFirstChunkSize
+            self.isLoading = True
+        else:
+            try:
+                while not reader.isDone:
+                    lines[-1:] = reader.read(kLoadChunkSizeLimit)
+            finally:
+                reader.close()
+        self.fileEncoding = reader.encoding
+        self.isBinary = False
+        self.fileFilterLines(lines)
+
     def fileLoad(self):
         app.log.info(u'fileLoad', self.fullPath)
-        inputFile = None
+        lines = None
+        self.lastChecksum = None
+        self.__rowOffsets = None
+        if isinstance(self.parser, app.parser.LinesParser):
+            self.parser = app.parser.Parser()
         self.isReadOnly = (os.path.isfile(self.fullPath) and
                            not os.access(self.fullPath, os.W_OK))
         if not os.path.exists(self.fullPath):
             data = u''
             self.setMessage(u'Creating new file')
         else:
+            mappedFileSize = self.program.prefs.editor.get(u'mappedFileSize')
+            progressiveLoadSize = self.program.prefs.editor.get(
+                u'progressiveLoadSize')
+            decodeErrors = self.program.prefs.editor.get(u'decodeErrors')
+            reader = None
             try:
-                inputFile = io.open(self.fullPath)
-                data = unicode(inputFile.read())
-                self.fileEncoding = inputFile.encoding
-                self.setMessage(u'Opened existing file')
-                self.isBinary = False
-            except Exception as e:
-                #app.log.info(unicode(e))
-                try:
-                    inputFile = io.open(self.fullPath, 'rb')
-                    if 1:
-                        binary_data = inputFile.read()
-                        long_hex = binascii.hexlify(binary_data).decode('utf-8')
-                        hex_list = []
-                        i = 0
-                        width = 32
-                        while i < len(long_hex):
-                            hex_list.append(long_hex[i:i + width] + u'\n')
-                            i += width
-                        data = u''.join(hex_list)
+                # The encoding is judged from the start of the file, so a
+                # binary file is not read as text first.
+                encoding = app.line_store.sniffEncoding(self.fullPath)
+                if (encoding is not None and mappedFileSize is not None and
+                        os.path.getsize(self.fullPath) >= mappedFileSize and
+                        app.line_store.isRowSafeEncoding(encoding)):
+                    # A binary file is opened as hex rows (below), which are
+                    # mapped too. The rows of other encodings (e.g. UTF-16)
+                    # can't be found in the mapped bytes, so they're read.
+                    self.fileMap(encoding)
+                    return
+                if encoding is not None:
+                    # The file is hashed (for the history) as it's read, so
+                    # it isn't read a second time by restoreUserHistory().
+                    reader = app.line_store.LineReader(
+                        self.fullPath, encoding,
+                        self.rowTabSize(),
+                        errors=(u'replace' if decodeErrors == u'replace' else
+                                u'strict'))
+                    lines = [u'']
+                    if (progressiveLoadSize is not None and
+                            self.program.prefs.editor[u'useBgThread'] and
+                            reader.size >= progressiveLoadSize):
+                        # Read the start of the file now and the rest in the
+                        # background (see loadMore()). The start may be edited
+                        # before the rest is decoded, so bytes that can't be
+                        # decoded are replaced rather than raising.
+                        reader.errors = u'replace'
+                        lines[-1:] = reader.read(kLoadFirstChunkSize)
+                        if (reader.hasDecodeErrors and
+                                decodeErrors != u'replace'):
+                            raise ValueError(u'bytes could not be decoded')
+                        self.__loadReader = reader
+                        self.__loadChunkSize = 2 * kLoadFirstChunkSize
+                        self.__loadDecodeErrors = decodeErrors
+                        self.isLoading = True
+                        self.loadingEditWarning = (
+                            u'The file is still loading, if some of it can'
+                            u' not be decoded the file will be read only')
                     else:
-                        data = inputFile.read()
-                    self.isBinary = True
-                    self.fileEncoding = None
-                    app.log.info(u'Opened file as a binary file')
-                    self.setMessage(u'Opened file as a binary file')
-                except Exception as e:
-                    app.log.info(unicode(e))
-                    app.log.info(u'error opening file', self.fullPath)
-                    self.setMessage(u'error opening file', self.fullPath)
+                        while not reader.isDone:
+                            lines[-1:] = reader.read(kLoadChunkSizeLimit)
+                        reader.close()
+                        self.lastChecksum = reader.checksum()
+                        self.lastFileSize = reader.bytesRead
+                        self.__rowOffsets = reader.rowOffsets
+                    self.fileEncoding = reader.encoding
+                    self.setMessage(u'Opened existing file')
+                    self.isBinary = False
+                    if reader.hasDecodeErrors:
+                        self.__noteDecodeErrors()
+            except Exception as e:
+                app.log.info(u'error reading file as text', self.fullPath, e)
+                lines = None
+                if reader is not None:
+                    reader.close()
+            if lines is None:
+                lines = self.__openBinary()
+                if lines is None:
                     return
             self.fileStat = os.stat(self.fullPath)
         self.relativePath = os.path.relpath(self.fullPath, os.getcwd())
         app.log.info(u'fullPath', self.fullPath)
         app.log.info(u'cwd', os.getcwd())
         app.log.info(u'relativePath', self.relativePath)
-        self.fileFilter(data)
-        if inputFile:
-            inputFile.close()
+        if lines is not None:
+            self.fileFilterLines(lines)
+        else:
+            self.fileFilter(data)
+        self.setPerformanceTier()
         self.determineFileType()
+        self.__journalOpen()
+        if not self.isLoading:
+            self.journalRecover()
+
+    def __openBinary(self):
+        """Open the file as a binary file, as hex rows.
+
+        Returns:
+            The rows (see app.line_store.HexLines), or None if the file can't
+            be opened.
+        """
+        try:
+            # The hex rows are formatted as they're shown.
+            lines = app.line_store.HexLines(self.fullPath)
+        except Exception as e:
+            app.log.info(unicode(e))
+            app.log.info(u'error opening file', self.fullPath)
+            self.setMessage(u'error opening file', self.fullPath)
+            return None
+        self.parser = app.parser.LinesParser(lines)
+        self.isBinary = True
+        self.fileEncoding = None
+        app.log.info(u'Opened file as a binary file')
+        self.setMessage(u'Opened file as a binary file')
+        return lines
+
+    def partialWriteIndex(self):
+        """Find whether a save can rewrite just the end of the file, for a
+        large file that has only changed from some row on (see the
+        "partialWriteSize" pref).
+
+        Returns:
+            An index into the (row, byte offset) pairs of the file where the
+            rewrite may start, or None to write the whole file.
+        """
+        partialWriteSize = self.program.prefs.editor.get(u'partialWriteSize')
+        rowOffsets = self.__rowOffsets
+        if (partialWriteSize is None or rowOffsets is None or
+                self.fileStat is None or
+                self.fileStat.st_size < partialWriteSize):
+            return None
+        changes = self.changesSince(self.savedVersion)
+        if changes is None:
+            return None
+        firstRow = min([change[0] for change in changes] or [len(self.lines)])
+        index = bisect.bisect_right(rowOffsets, (firstRow, float('inf'))) - 1
+        if index <= 0 or rowOffsets[index][0] >= len(self.lines):
+            # Nearly all of the file is written, so do it atomically.
+            return None
+        # The start of the file is kept, so it must be unchanged on disk.
+        if not self.isFileUnchanged():
+            return None
+        return index
+
+    def isFileUnchanged(self):
+        """Whether the file is as it was when last loaded or saved."""
+        if self.fileStat is None:
+            return False
+        try:
+            fileStat = os.stat(self.fullPath)
+        except OSError:
+            return False
+        return ((fileStat.st_ino, fileStat.st_size, fileStat.st_mtime) == (
+            self.fileStat.st_ino, self.fileStat.st_size,
+            self.fileStat.st_mtime))
+
+    def fileMap(self, encoding):
+        """Open the file as a read only view. The file is mapped into memory
+        rather than read, and only the rows that are shown or searched are
+        decoded, as |encoding| (see app.line_store.sniffEncoding() and
+        app.line_store.MappedLines)."""
+        app.log.info(u'fileMap', self.fullPath, encoding)
+        homePath = self.program.prefs.userData.get(u'homePath')
+        try:
+            lines = app.line_store.MappedLines(
+                self.fullPath, encoding, self.rowTabSize(),
+                homePath and os.path.join(homePath, u'lineIndex'))
+        except (IOError, OSError, ValueError) as e:
+            app.log.info(unicode(e))
+            self.setMessage(u'error opening file', self.fullPath)
+            return
+        self.fileStat = os.stat(self.fullPath)
+        self.relativePath = os.path.relpath(self.fullPath, os.getcwd())
+        self.isReadOnly = True
+        self.isViewOnly = True
+        self.fileEncoding = encoding
+        self.lines = lines
+        self.parser = app.parser.LinesParser(lines)
+        self.upperChangedRow = 0
+        self.savedAtRedoIndex = self.redoIndex
+        self.performanceTier = kTierMapped
+        self.coarseUndo = True
+        self.setMessage(u'Opened read only view')
+        self.determineFileType()
+
+    def filterCancel(self):
+        """Stop the running filter of the selected lines (see filterStart()),
+        leaving the document as it is.
+
+        Returns:
+            False if no filter was running.
+        """
+        if self.lineFilter is None:
+            return False
+        self.lineFilter.close()
+        self.lineFilter = None
+        self.__filterSelection = None
+        return True
+
+    def filterMore(self):
+        """Continue the running filter of the selected lines (see
+        filterStart()). The filter is cancelled if the document has changed
+        since it started.
+
+        Returns:
+            True if no filter is running (any more).
+        """
+        if self.lineFilter is None:
+            return True
+        if self.changeVersion != self.__filterSelection[0]:
+            self.filterCancel()
+            self.setMessage(u'The document changed, so the filter was '
+                            u'cancelled')
+            return True
+        if not self.lineFilter.step():
+            return False
+        self.__filterFinish()
+        return True
+
+    def filterProgress(self):
+        """The portion of the running filter that is done (0 to 1.0), or None
+        if no filter is running."""
+        if self.lineFilter is None:
+            return None
+        return self.lineFilter.progress()
+
+    def filterStart(self, lineFilter):
+        """Replace the selected lines with the output of |lineFilter| (see
+        app.line_filter), as one change. A filter of many rows (see
+        kBackgroundFilterRows) is run a step at a time by filterMore(), with
+        the background thread. Others are run now."""
+        self.lineFilter = lineFilter
+        self.__filterSelection = (self.changeVersion, self.penRow, self.penCol,
+                                  self.markerRow, self.markerCol,
+                                  self.selectionMode)
+        if (len(lineFilter.lines) < kBackgroundFilterRows or
+                not self.program.prefs.editor[u'useBgThread']):
+            lineFilter.run()
+            self.__filterFinish()
+        else:
+            self.setMessage(u'Filtering %d lines (cancel to stop)' %
+                            (len(lineFilter.lines),))
+
+    def __filterFinish(self):
+        """Replace the selection the filter started with by its output."""
+        lines = self.lineFilter.output or [u'']
+        selection = self.__filterSelection[1:]
+        self.filterCancel()
+        self.compoundChangePush()
+        if selection != (self.penRow, self.penCol, self.markerRow,
+                         self.markerCol, self.selectionMode):
+            # The cursor moved while the filter ran.
+            penRow, penCol, markerRow, markerCol, selectionMode = selection
+            self.cursorMoveAndMark(penRow - self.penRow, penCol - self.penCol,
+                                   markerRow - self.markerRow,
+                                   markerCol - self.markerCol,
+                                   selectionMode - self.selectionMode)
+        self.editPasteLines(tuple(lines))
+        self.compoundChangePush()
+        self.setMessage(u'Changed %d lines' % (len(lines),))
+
+    def loadMore(self):
+        """Continue loading the document: read more of the file (or stream)
+        for a progressive load, or index more of a mapped file.
+
+        Returns:
+            True if the document is fully loaded.
+        """
+        if isinstance(self.lines, app.line_store.MappedLines):
+            return self.lines.indexMore()
+        if not self.isLoading:
+            return True
+        reader = self.__loadReader
+        try:
+            lines = reader.read(self.__loadChunkSize, kStreamWaitSeconds)
+        except (IOError, OSError, ValueError) as e:
+            app.log.info(u'error loading file', self.fullPath, e)
+            # Saving the part that was read would lose the rest of the file.
+            self.setMessage(u'Error reading file, only part of it was loaded')
+            self.isViewOnly = True
+            lines = None
+        if (lines and reader.hasDecodeErrors and
+                self.__loadDecodeErrors != u'replace' and not self.isDirty()):
+            # Open it as a binary file after all (see the "decodeErrors"
+            # pref). With edits, it's a read only view instead.
+            reader.close()
+            self.__loadReader = None
+            self.isLoading = False
+            self.loadingEditWarning = None
+            lines = self.__openBinary()
+            if lines is None:
+                self.isViewOnly = True
+                return True
+            self.fileStat = os.stat(self.fullPath)
+            self.__resetHistory()
+            self.fileFilterLines(lines)
+            self.setPerformanceTier()
+            self.determineFileType()
+            self.restoreUserHistory()
+            self.journalRecover()
+            return True
+        if lines is not None:
+            if lines:
+                self.__appendLoadedLines(lines)
+            if not reader.isDone:
+                if self.isFollowing and not lines and reader.isReplaced():
+                    self.__followReplacedFile()
+                return False
+            self.lastChecksum = reader.checksum()
+            self.lastFileSize = reader.bytesRead
+            self.__rowOffsets = reader.rowOffsets
+        reader.close()
+        self.__loadReader = None
+        self.isLoading = False
+        self.loadingEditWarning = None
+        if reader.hasDecodeErrors:
+            self.__noteDecodeErrors()
+        if reader.isStream:
+            # There's no file, so no file history.
+            self.lastChecksum = None
+            self.__rowOffsets = None
+            if not self.isViewOnly:
+                self.setPerformanceTier()
+            return True
+        self.setPerformanceTier()
+        if (self.redoChain or self.tempChange or
+                (self.penRow, self.penCol) != (0, 0)):
+            # Keep what the user has done rather than restoring the history.
+            if self.performanceTier < kTierNoHistory:
+                self.fileHistory = self.program.history.getFileHistory(
+                    self.fullPath, fileInfo=(self.lastChecksum,
+                                             self.lastFileSize))
+        else:
+            # The rows loaded in the background are not changes to be saved.
+            self.savedVersion = self.changeVersion
+            self.restoreUserHistory()
+        self.journalRecover()
+        return True
+
+    def __resetHistory(self):
+        """Forget the undo history and go to the top, for a document whose
+        rows are being replaced (and that has no edits)."""
+        self.redoChain = []
+        self.redoIndex = 0
+        self.oldRedoIndex = 0
+        self.spilledToIndex = 0
+        self.tempChange = None
+        self.checkpoints = {}
+        self.penRow = self.penCol = self.goalCol = 0
+        self.markerRow = self.markerCol = 0
+        self.selectionMode = app.selectable.kSelectionNone
+        if self.view is not None:
+            self.view.scrollRow = self.view.scrollCol = 0
+
+    def __noteDecodeErrors(self):
+        """Some of the file's bytes were read as u'\ufffd' (see the
+        "decodeErrors" pref). Saving would write that in place of the original
+        bytes, so the document is a read only view."""
+        app.log.info(u'bytes replaced reading', self.fullPath)
+        self.isViewOnly = True
+        self.setMessage(u'Some bytes could not be decoded and were replaced,'
+                        u' the file is read only')
+
+    def __appendLoadedLines(self, lines):
+        """Add the |lines| read by loadMore() to the end of the document."""
+        self.__loadChunkSize = min(2 * self.__loadChunkSize,
+                                   kLoadChunkSizeLimit)
+        # Redo the last row, it may have been partial.
+        row = len(self.lines) - 1
+        self.lines[row:] = lines
+        self.noteLinesLoaded(row, 1, len(lines))
+        if ((row or self.isFollowing) and self.penRow == row and
+                self.selectionMode == app.selectable.kSelectionNone):
+            # Follow the end of the document as it grows.
+            self.cursorMoveTo(len(self.lines) - 1, 0)
+            if self.view is not None:
+                self.view.scrollRow = max(self.view.scrollRow,
+                                          self.penRow - self.view.rows + 1)
+
+    def fileFollow(self, follow=True):
+        """Start (or stop) following the file as it grows, like 'tail -f'. Only
+        the bytes appended to the file are read, and their rows are added to
+        the end of the document by loadMore(), which also extends the parse
+        from there. If the file is truncated or replaced (e.g. by log
+        rotation), the new file is read from the start.
+
+        The document is a read only view while the file is followed.
+
+        Returns:
+            Whether the file is being followed.
+        """
+        if not follow:
+            if self.isFollowing:
+                reader = self.__loadReader
+                self.__loadReader = None
+                # The document matches the file as far as it was read.
+                self.fileStat = reader.stat()
+                self.lastFileSize = reader.offset + reader.bytesRead
+                reader.close()
+                self.isFollowing = False
+                self.isLoading = False
+                self.isViewOnly = False
+            return False
+        if self.isFollowing:
+            return True
+        if (self.isLoading or self.isViewOnly or self.isBinary or
+                self.fileStat is None or self.lastFileSize is None or
+                self.isDirty() or
+                not self.program.prefs.editor[u'useBgThread'] or
+                not app.line_store.isRowSafeEncoding(self.fileEncoding or
+                                                     u'utf-8')):
+            return False
+        try:
+            fileStat = os.stat(self.fullPath)
+            isReplaced = (fileStat.st_ino != self.fileStat.st_ino or
+                          fileStat.st_size < self.lastFileSize)
+            reader = None
+            if not isReplaced:
+                # Read the last row again, it may be partial.
+                reader = app.line_store.LineReader(
+                    self.fullPath, self.fileEncoding,
+                    self.rowTabSize(),
+                    app.line_store.rowStartOffset(self.fullPath,
+                                                  self.lastFileSize), True)
+        except (IOError, OSError) as e:
+            app.log.info(u'error following file', self.fullPath, e)
+            return False
+        self.__loadReader = reader
+        self.__loadChunkSize = kLoadFirstChunkSize
+        self.isLoading = True
+        self.isFollowing = True
+        self.isViewOnly = True
+        # The file will change, so there is no file history to keep.
+        self.lastChecksum = None
+        if isReplaced and not self.__followReplacedFile():
+            self.isLoading = False
+            self.isFollowing = False
+            self.isViewOnly = False
+            return False
+        return True
+
+    def __followReplacedFile(self):
+        """Start over, reading the file that replaced the followed one.
+
+        Returns:
+            False if the file can't be opened (it's tried again later).
+        """
+        app.log.info(u'followed file replaced', self.fullPath)
+        try:
+            reader = app.line_store.LineReader(
+                self.fullPath, self.fileEncoding,
+                self.rowTabSize(), 0, True)
+        except (IOError, OSError) as e:
+            app.log.info(u'error following file', self.fullPath, e)
+            return False
+        if self.__loadReader is not None:
+            self.__loadReader.close()
+        self.__loadReader = reader
+        self.__loadChunkSize = kLoadFirstChunkSize
+        self.__rowOffsets = None
+        # The document is a read only view, so there are no edits to keep.
+        self.__resetHistory()
+        self.fileFilterLines([u''])
+        self.setMessage(u'The file was replaced, reading it again')
+        return True
+
+    def hasMappedDecodeErrors(self):
+        """Whether some bytes of a mapped file (see fileMap()) could not be
+        decoded, and are shown as u'\ufffd'. That's found as the rows are
+        decoded, so it's shown on the status line rather than as a
+        message."""
+        return (isinstance(self.lines, app.line_store.MappedLines) and
+                self.lines.hasDecodeErrors)
+
+    def loadProgress(self):
+        """The portion of the document that is loaded (0 to 1.0), or None if
+        loading is done (or the size of a stream being read isn't known)."""
+        if isinstance(self.lines, app.line_store.MappedLines):
+            return None if self.lines.isComplete() else self.lines.progress()
+        if not self.isLoading:
+            return None
+        return self.__loadReader.progress()
+
+    def rowTabSize(self):
+        """The size that tabs are expanded to in the rows (see
+        app.line_store.textToLines()). A file of tab separated values (with
+        the "\\t" delimiter in "columnDelimiters") keeps its tabs, so it's
+        None for that."""
+        editorPrefs = self.program.prefs.editor
+        delimiter = editorPrefs.get(u'columnDelimiters', {}).get(
+            os.path.splitext(self.fullPath)[1].lower())
+        return None if delimiter == u'\t' else editorPrefs.get(u'tabSize', 8)
+
+    def setColumnMode(self, delimiter):
+        """Show the rows as fields separated by |delimiter|, lined up in
+        columns (see app.columns). None to show the rows as they are."""
+        if delimiter is None:
+            self.columnIndex = None
+        elif (self.columnIndex is None or
+              self.columnIndex.delimiter != delimiter):
+            self.columnIndex = app.columns.ColumnIndex(delimiter)
+
+    def setPerformanceTier(self):
+        """Pick the performance tier for the document from its size and its
+        longest line (see kTierNames)."""
+        tier = kTierNormal
+        if isinstance(self.lines, app.line_store.HexLines):
+            # Don't format every row just to measure it.
+            fileSize = len(self.lines) * (2 * app.line_store.kHexRowBytes + 1)
+            lineLength = 2 * app.line_store.kHexRowBytes
+        else:
+            # The size of the data (without building it).
+            fileSize = sum(map(len, self.lines)) + len(self.lines) - 1
+            lineLength = max(map(len, self.lines)) if self.lines else 0
+        for limits in self.program.prefs.editor.get(u'performanceTiers', ()):
+            if (fileSize <= limits[u'fileSize'] and
+                    lineLength <= limits[u'lineLength']):
+                break
+            tier += 1
+        self.performanceTier = min(tier, kTierCoarseUndo)
+        self.coarseUndo = self.performanceTier >= kTierCoarseUndo
+        if self.performanceTier >= kTierNoHistory:
+            # There is no file history to look up or save.
+            self.lastChecksum = None
+            if type(self.lines) is list:
+                self.lines = app.line_store.PackedLines(self.lines)
+        if self.performanceTier != kTierNormal:
+            app.log.info(u'performanceTier', self.performanceTier, fileSize,
+                         lineLength)
+            self.setMessage(u'Opened %s (%s)' % (
+                u'binary file' if self.isBinary else u'existing file',
+                kTierNames[self.performanceTier]))
 
     def _determineRootGrammar(self, name, extension):
         if extension == u"" and len(self.lines) > 0:
@@ -1024,10 +1925,13 @@ class Actions(app.mutator.Mutator):
         self.rootGrammar = self._determineRootGrammar(
             *os.path.splitext(self.fullPath))
         self.parseGrammars()
-        self.dataToLines()
+        delimiter = self.program.prefs.editor.get(u'columnDelimiters', {}).get(
+            os.path.splitext(self.fullPath)[1].lower())
+        self.setColumnMode(None if self.isBinary else delimiter)
 
-        # Restore all user history.
-        self.restoreUserHistory()
+        # Restore all user history (once the whole file is read).
+        if not self.isLoading:
+            self.restoreUserHistory()
 
     def replaceLines(self, clip):
         self.selectionAll()
@@ -1045,8 +1949,16 @@ class Actions(app.mutator.Mutator):
           None.
         """
         # Restore the file history.
-        self.fileHistory = self.program.history.getFileHistory(
-            self.fullPath, self.data)
+        if self.performanceTier >= kTierNoHistory:
+            self.fileHistory = {}
+        else:
+            if self.lastChecksum is None:
+                # The file wasn't hashed as it was read (e.g. a binary file).
+                self.lastChecksum, self.lastFileSize = (
+                    app.history.getFileInfo(self.fullPath))
+            self.fileHistory = self.program.history.getFileHistory(
+                self.fullPath, fileInfo=(self.lastChecksum,
+                                         self.lastFileSize))
 
         # Restore all positions and values of variables.
         self.penRow, self.penCol = self.fileHistory.setdefault(u'pen', (0, 0))
@@ -1064,13 +1976,18 @@ class Actions(app.mutator.Mutator):
         self.markerRow, self.markerCol = self.fileHistory.setdefault(
             u'marker', (0, 0))
         if self.program.prefs.editor[u'saveUndo']:
-            self.redoChain = self.fileHistory.setdefault(
-                u'redoChainCompound', [])
+            # The redoChain is edited in place, so copy it to keep the
+            # history unchanged until the file is saved.
+            self.redoChain = list(
+                self.fileHistory.setdefault(u'redoChainCompound', []))
+            self.spilledToIndex = 0
             self.savedAtRedoIndex = self.fileHistory.setdefault(
                 u'savedAtRedoIndexCompound', 0)
             self.tempChange = self.fileHistory.setdefault(u'tempChange', None)
             self.redoIndex = self.savedAtRedoIndex
             self.oldRedoIndex = self.savedAtRedoIndex
+        self.checkpoints = {}
+        self.addCheckpoint()
         if app.config.strict_debug:
             assert self.penRow < len(self.lines), self.penRow
             assert self.markerRow < len(self.lines), self.markerRow
@@ -1078,10 +1995,6 @@ class Actions(app.mutator.Mutator):
         # Restore file bookmarks
         self.bookmarks = self.fileHistory.setdefault(u'bookmarks', [])
 
-        # Store the file's info.
-        self.lastChecksum, self.lastFileSize = app.history.getFileInfo(
-            self.fullPath)
-
     def updateBasicScrollPosition(self):
         """Sets scrollRow, scrollCol to the closest values that the view's
         position must be in order to see the cursor.
@@ -1177,19 +2090,37 @@ class Actions(app.mutator.Mutator):
                       bottom < self.view.scrollRow + self.view.rows)
         return horizontally and vertically
 
-    def linesToData(self):
-        if self.isBinary:
-            self.data = self.doLinesToData(self.lines)
-            # TODO(dschuyler): convert binary data.
-            #self.data = self.doLinesToBinaryData(self.lines)
+    def updateParser(self):
+        """Tell the parser which rows changed since it last parsed the lines,
+        so that it parses those rows again (and not the whole document)."""
+        if isinstance(self.parser, app.parser.LinesParser):
+            # The lines are not parsed for grammars (see fileMap() and
+            # app.line_store.HexLines).
+            return
+        if self.__parsedLines is self.lines:
+            if self.__parsedVersion == self.changeVersion:
+                return
+            changes = self.changesSince(self.__parsedVersion)
         else:
-            self.data = self.doLinesToData(self.lines)
+            changes = None
+        if changes is None:
+            self.parser.noteLinesReplaced()
+        else:
+            for begin, end, oldBegin, oldEnd in reversed(
+                    app.mutator.composeChanges(changes)):
+                self.parser.noteLinesChanged(oldBegin, oldEnd - oldBegin,
+                                             end - begin)
+        self.__parsedLines = self.lines
+        self.__parsedVersion = self.changeVersion
 
     def fenceRedoChain(self):
         self.redoAddChange((u'f'))
         self.redo()
 
     def fileWrite(self):
+        if self.isViewOnly:
+            self.setMessage(u'A read only view of a file can not be saved')
+            return
         # Preload the message with an error that should be overwritten.
         self.setMessage(u'Error saving file')
         self.isReadOnly = not os.access(self.fullPath, os.W_OK)
@@ -1208,47 +2139,70 @@ class Actions(app.mutator.Mutator):
                 self.fileHistory[u'marker'] = (self.markerRow, self.markerCol)
                 self.fileHistory[u'selectionMode'] = self.selectionMode
                 self.fileHistory[u'bookmarks'] = self.bookmarks
-                self.linesToData()
-                if self.isBinary:
-                    removeWhitespace = {
-                        ord(u' '): None,
-                        ord(u'\n'): None,
-                        ord(u'\r'): None,
-                        ord(u'\t'): None,
-                    }
-                    outputData = binascii.unhexlify(
-                        self.data.translate(removeWhitespace))
-                    outputFile = io.open(self.fullPath, u'wb+')
-                elif self.fileEncoding is None:
-                    outputData = self.data
-                    outputFile = io.open(
-                        self.fullPath, u'w+', encoding=u'UTF-8')
+                sync = self.program.prefs.editor.get(u'saveSync', u'file')
+                index = self.partialWriteIndex()
+                # Until the save is done, the file is in an unknown state.
+                rowOffsets = self.__rowOffsets
+                self.__rowOffsets = None
+                patches = None
+                if (isinstance(self.lines, app.line_store.HexLines) and
+                        self.isFileUnchanged()):
+                    patches = self.lines.patches()
+                if patches is not None:
+                    # Only the changed bytes are written. The checkpoints read
+                    # unchanged rows from the (now changed) file, so they're
+                    # dropped.
+                    fileInfo = app.line_store.patchFile(
+                        self.fullPath, patches, sync,
+                        self.performanceTier < kTierNoHistory)
+                    self.checkpoints = {}
+                    rowOffsets = None
+                elif index is None:
+                    if (self.isBinary or not app.line_store.isRowSafeEncoding(
+                            self.fileEncoding or u'utf-8')):
+                        rowOffsets = None
+                    else:
+                        rowOffsets = []
+                    fileInfo = app.line_store.writeFile(
+                        self.fullPath, self.fileChunks(0, 0, rowOffsets), sync)
                 else:
-                    outputData = self.data
-                    outputFile = io.open(
-                        self.fullPath, 'w+', encoding=self.fileEncoding)
-                outputFile.seek(0)
-                outputFile.truncate()
-                outputFile.write(outputData)
-                outputFile.close()
+                    row, offset = rowOffsets[index]
+                    rowOffsets = rowOffsets[:index]
+                    fileInfo = app.line_store.rewriteFile(
+                        self.fullPath, offset,
+                        self.fileChunks(row, offset, rowOffsets), sync,
+                        self.performanceTier < kTierNoHistory)
+                self.__rowOffsets = rowOffsets
                 # Save user data that applies to writable files.
                 self.savedAtRedoIndex = self.redoIndex
+                self.savedVersion = self.changeVersion
+                self.addCheckpoint()
                 if self.program.prefs.editor[u'saveUndo']:
-                    self.fileHistory[u'redoChainCompound'] = self.redoChain
+                    # The redoChain is edited in place, so save a copy.
+                    self.fileHistory[u'redoChainCompound'] = list(
+                        self.redoChain)
                     self.fileHistory[
                         u'savedAtRedoIndexCompound'] = self.savedAtRedoIndex
                     self.fileHistory[u'tempChange'] = self.tempChange
-                self.program.history.saveUserHistory(
-                    (self.fullPath, self.lastChecksum, self.lastFileSize),
-                    self.fileHistory)
-                # Store the file's new info
-                self.lastChecksum, self.lastFileSize = app.history.getFileInfo(
-                    self.fullPath)
+                if self.performanceTier < kTierNoHistory:
+                    self.program.history.saveUserHistory(
+                        (self.fullPath, self.lastChecksum, self.lastFileSize),
+                        self.fileHistory, fileInfo)
+                    # Store the file's new info
+                    self.lastChecksum = fileInfo[0]
+                self.lastFileSize = fileInfo[1]
                 self.fileStat = os.stat(self.fullPath)
                 # If we're writing this file for the first time, self.isReadOnly
                 # will still be True (from when it didn't exist).
                 self.isReadOnly = False
                 self.setMessage(u'File saved')
+                if (patches is None and index is None and
+                        isinstance(self.lines, app.line_store.HexLines)):
+                    try:
+                        self.lines.rebase(self.fullPath)
+                    except Exception as e:
+                        # The file is saved, the rows are just kept in memory.
+                        app.log.info(u'hex rows not remapped', e)
             except Exception as e:
                 color = self.program.prefs.color.get(u'status_line_error')
                 if self.isReadOnly:
@@ -1263,7 +2217,50 @@ class Actions(app.mutator.Mutator):
                 app.log.exception(e)
         except Exception:
             app.log.info(u'except had exception')
-        self.determineFileType()
+        # Saving doesn't change the lines, but a new file name may change the
+        # file type.
+        self.rootGrammar = self._determineRootGrammar(
+            *os.path.splitext(self.fullPath))
+
+    def fileChunks(self, startRow=0, offset=0, rowOffsets=None):
+        """Yield the file data (as encoded bytes) a block of rows at a time,
+        for app.line_store.writeFile().
+
+        Args:
+            startRow (int): The first row to write.
+            offset (int): The byte offset in the file of |startRow|.
+            rowOffsets (list): If not None, a (row, byte offset) pair is
+                appended for each block written (see partialWriteIndex()).
+        """
+        lines = self.lines
+        if isinstance(lines, app.line_store.HexLines):
+            for chunk in lines.byteChunks():
+                yield chunk
+            return
+        if self.isBinary:
+            # A block may end part way through a byte (an odd hex digit).
+            text = u''
+            for i in range(0, len(lines), kSaveChunkRows):
+                text += u''.join(lines[i:i + kSaveChunkRows]).translate(
+                    app.line_store.kRemoveWhiteSpace)
+                end = len(text) - len(text) % 2
+                yield binascii.unhexlify(text[:end])
+                text = text[end:]
+            if text:
+                yield binascii.unhexlify(text)
+            return
+        encoder = codecs.getincrementalencoder(self.fileEncoding or
+                                               u'utf-8')()
+        for i in range(startRow, len(lines), kSaveChunkRows):
+            data = self.doLinesToData(lines[i:i + kSaveChunkRows])
+            isFinal = i + kSaveChunkRows >= len(lines)
+            if not isFinal:
+                data += u'\n'
+            data = encoder.encode(data, isFinal)
+            if rowOffsets is not None:
+                rowOffsets.append((i, offset))
+                offset += len(data)
+            yield data
 
     def selectText(self, row, col, length, mode):
         row = max(0, min(row, len(self.lines) - 1))
@@ -1377,30 +2374,69 @@ class Actions(app.mutator.Mutator):
                             u' separators')
             return
         _, find, replace, flags = splitCmd
-        self.linesToData()
-        data = self.findReplaceText(find, replace, flags, self.data)
-        self.applyDocumentUpdate(data)
+        try:
+            findRe = re.compile(find, self.findReplaceFlags(flags))
+        except re.error as e:
+            self.setMessage(u'Invalid regex: ' + unicode(e))
+            return
+        data = self.doLinesToData(self.lines)
+        # Rather than substituting over the whole document and comparing the
+        # result, visit the matches and change only the rows they touch. Each
+        # entry of |rowGroups| is [firstRow, lastRow, offset of the end of the
+        # last match, list of new text pieces].
+        rowGroups = []
+        count = 0
+        row = 0
+        offset = 0
+        for found in findRe.finditer(data):
+            count += 1
+            row += data.count(u'\n', offset, found.start())
+            offset = found.start()
+            lastRow = row + data.count(u'\n', found.start(), found.end())
+            if rowGroups and rowGroups[-1][1] >= row:
+                group = rowGroups[-1]
+                group[1] = lastRow
+            else:
+                rowBegin = data.rfind(u'\n', 0, found.start()) + 1
+                group = [row, lastRow, rowBegin, []]
+                rowGroups.append(group)
+            group[3].append(data[group[2]:found.start()])
+            group[3].append(found.expand(replace))
+            group[2] = found.end()
+        if not count:
+            self.setMessage(u'No matches found')
+            return
+        self.setMessage(u'Replaced %d matches' % (count,))
+        diff = []
+        index = 0
+        for firstRow, lastRow, end, pieces in rowGroups:
+            rowEnd = data.find(u'\n', end)
+            if rowEnd < 0:
+                rowEnd = len(data)
+            pieces.append(data[end:rowEnd])
+            oldLines = self.lines[firstRow:lastRow + 1]
+            newLines = self.doDataToLines(u''.join(pieces))
+            if newLines == oldLines:
+                continue
+            if firstRow > index:
+                diff.append(firstRow - index)
+            diff += [u'- ' + line for line in oldLines]
+            diff += [u'+ ' + line for line in newLines]
+            index = lastRow + 1
+        if not diff:
+            return
+        if index < len(self.lines):
+            diff.append(len(self.lines) - index)
+        self.redoAddChange((u'ld', tuple(diff)))
+        self.redo()
 
     def findReplaceText(self, find, replace, flags, text):
         flags = self.findReplaceFlags(flags)
         return re.sub(find, replace, text, flags=flags)
 
     def applyDocumentUpdate(self, data):
-        diff = difflib.ndiff(self.lines, self.doDataToLines(data))
-        ndiff = []
-        counter = 0
-        for i in diff:
-            if i[0] != u' ':
-                if counter:
-                    ndiff.append(counter)
-                    counter = 0
-                if i[0] in [u'+', u'-']:
-                    ndiff.append(i)
-            else:
-                counter += 1
-        if counter:
-            ndiff.append(counter)
-        if len(ndiff) == 1 and type(ndiff[0]) is type(0):
+        ndiff = app.line_diff.diffLines(self.lines, self.doDataToLines(data))
+        if not ndiff or (len(ndiff) == 1 and type(ndiff[0]) is type(0)):
             # Nothing was changed. The only entry is a 'skip these lines'
             self.setMessage(u'No matches found')
             return
@@ -1496,6 +2532,10 @@ class Actions(app.mutator.Mutator):
         grammar = self.parser.grammarAt(self.penRow, self.penCol)
         indentation = (grammar.get(u'indent') or
                        self.program.prefs.editor[u'indentation'])
+        if (self.columnIndex is not None and
+                self.columnIndex.delimiter == u'\t'):
+            # Tab separates the fields.
+            indentation = u'\t'
         indentationLength = len(indentation)
         if self.selectionMode == app.selectable.kSelectionNone:
             self.verticalInsert(self.penRow, self.penRow, self.penCol,
@@ -1532,6 +2572,9 @@ class Actions(app.mutator.Mutator):
     def insert(self, text):
         if app.config.strict_debug:
             assert isinstance(text, unicode)
+        if self.cursorsActive():
+            self.cursorsEdit(lambda line, col: (col, u'', text))
+            return
         self.performDelete()
         self.redoAddChange((u'i', text))
         self.redo()
@@ -1549,7 +2592,8 @@ class Actions(app.mutator.Mutator):
     def insertPrintableWithPairing(self, ch, meta):
         #app.log.info(ch, meta)
         if type(ch) is int and curses.ascii.isprint(ch):
-            if self.program.prefs.editor['autoInsertClosingCharacter']:
+            if (self.program.prefs.editor['autoInsertClosingCharacter'] and
+                    not self.cursorsActive()):
                 pairs = {
                     ord(u"'"): u"'",
                     ord(u'"'): u'"',
@@ -1605,7 +2649,19 @@ class Actions(app.mutator.Mutator):
         app.log.info(u'double click', paneRow, paneCol)
         row = self.view.scrollRow + paneRow
         if row < len(self.lines) and len(self.lines[row]):
-            self.selectWordAt(row, self.view.scrollCol + paneCol)
+            self.selectWordAt(
+                row, self.__columnAt(row, self.view.scrollCol + paneCol))
+
+    def __columnAt(self, row, col):
+        """Find the column of |row| that is shown at |col|, which differs if
+        the row is lined up in columns (see TextBuffer.drawColumns())."""
+        if self.columnIndex is None or self.columnsDrawn is None:
+            return col
+        columnStarts, rows = self.columnsDrawn
+        if row not in rows:
+            return col
+        return self.columnIndex.unalignedColumn(
+            self.columnIndex.fields(self, row), columnStarts, col)
 
     def mouseMoved(self, paneRow, paneCol, shift, ctrl, alt):
         app.log.info(u' mouseMoved', paneRow, paneCol, shift, ctrl, alt)
@@ -1623,7 +2679,7 @@ class Actions(app.mutator.Mutator):
                             len(self.lines[lastLine]) - self.penCol)
             return
         row = max(0, min(virtualRow, len(self.lines)))
-        col = max(0, self.view.scrollCol + paneCol)
+        col = max(0, self.__columnAt(row, self.view.scrollCol + paneCol))
         if self.selectionMode == app.selectable.kSelectionBlock:
             self.cursorMoveAndMark(0, 0, row - self.markerRow,
                                    col - self.markerCol, 0)
@@ -1737,14 +2793,15 @@ class Actions(app.mutator.Mutator):
         pass
 
     def normalize(self):
+        self.cursorsClear()
         self.selectionNone()
         self.findRe = None
         self.view.normalize()
 
     def doParse(self, begin, end):
         start = time.time()
-        self.linesToData()
-        self.parser.parse(self.program.bg, self.program.prefs, self.data,
+        self.updateParser()
+        self.parser.parse(self.program.bg, self.program.prefs, self.lines,
                           self.rootGrammar, begin, end)
         self.debugUpperChangedRow = self.upperChangedRow
         self.upperChangedRow = self.parser.fullyParsedToLine
@@ -1859,8 +2916,13 @@ class Actions(app.mutator.Mutator):
         self.insertPrintable(0x00, None)
 
     def stripTrailingWhiteSpace(self):
-        for i in range(len(self.lines)):
-            for found in app.regex.kReEndSpaces.finditer(self.lines[i]):
+        """Remove trailing white space from the rows that have changed since
+        the file was last loaded or saved."""
+        # A tab at the end of a row of tab separated values ends a field.
+        reEndSpaces = (app.regex.kReEndSpaces if self.rowTabSize() is not None
+                       else kReEndSpacesNotTab)
+        for i in self.modifiedRows():
+            for found in reEndSpaces.finditer(self.lines[i]):
                 self._performDeleteRange(i, found.regs[0][0], i,
                                          found.regs[0][1])
 
@@ -28,9 +28,15 @@ import threading
 import time
 import traceback
 
+import app.curses_util
 import app.profile
 import app.render
 
+# While background work continues (e.g. reading a stream, see
+# app.actions.Actions.loadMore()), the screen is updated at this interval (in
+# seconds).
+kWorkingFrameInterval = 0.1
+
 
 class BackgroundThread(threading.Thread):
 
@@ -59,6 +65,7 @@ class BackgroundThread(threading.Thread):
 def background(inputQueue, outputQueue):
     cmdCount = 0
     block = True
+    nextFrameTime = 0
     pid = os.getpid()
     signalNumber = signal.SIGUSR1
     while True:
@@ -73,7 +80,7 @@ def background(inputQueue, outputQueue):
                 program.shortTimeSlice()
                 program.render()
                 # debugging only: program.showWindowHierarchy()
-                cmdCount += len(message)
+                cmdCount += app.curses_util.countUserCommands(message)
                 outputQueue.put(program.program.frame.grabFrame() + (cmdCount,))
                 os.kill(pid, signalNumber)
                 #app.profile.endPythonProfile(profile)
@@ -83,7 +90,8 @@ def background(inputQueue, outputQueue):
             except queue.Empty:
                 pass
             block = program.longTimeSlice()
-            if block:
+            if block or time.time() >= nextFrameTime:
+                nextFrameTime = time.time() + kWorkingFrameInterval
                 program.render()
                 outputQueue.put(program.program.frame.grabFrame() + (cmdCount,))
                 os.kill(pid, signalNumber)
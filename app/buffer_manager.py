@@ -54,6 +54,25 @@ class BufferManager:
             assert issubclass(textBuffer.__class__, app.text_buffer.TextBuffer)
         self.untrackBuffer_(textBuffer)
 
+    def discardJournals(self):
+        """Delete the recovery journals of all of the buffers (the unsaved
+        changes are not wanted)."""
+        for textBuffer in self.buffers:
+            textBuffer.journalDiscard()
+
+    def filesChanged(self, paths):
+        """Update the buffers for the files at |paths|, which may have been
+        changed by other programs (see app.file_watcher)."""
+        for textBuffer in self.buffers:
+            if textBuffer.fullPath in paths:
+                textBuffer.fileRefresh()
+
+    def flushJournals(self):
+        """Write any new changes to the recovery journals (see
+        Actions.journalFlush())."""
+        for textBuffer in self.buffers:
+            textBuffer.journalFlush()
+
     def getUnsavedBuffer(self):
         for fileBuffer in self.buffers:
             if fileBuffer.isDirty():
@@ -140,19 +159,27 @@ class BufferManager:
         newFd = os.dup(stdinFd)
         newStdin = io.open(u"/dev/tty")
         os.dup2(newStdin.fileno(), stdinFd)
-        # Create a text buffer to read from alternate stream.
+        # Create a text buffer to read from alternate stream. The text buffer
+        # reads it as it arrives (see Actions.fileStream()).
         textBuffer = self.newTextBuffer()
         try:
-            with io.open(newFd, u"r") as fileInput:
-                textBuffer.fileFilter(fileInput.read())
+            textBuffer.fileStream(newFd,
+                                  self.program.prefs.startup.get('pager'))
         except Exception as e:
             app.log.exception(e)
-        app.log.info(u'finished reading from stdin')
         return textBuffer
 
+    def updateWatchedFiles(self):
+        """Have the program's file watcher watch the files of the buffers."""
+        if self.program.fileWatcher is not None:
+            self.program.fileWatcher.setPaths(
+                tb.fullPath for tb in self.buffers if tb.fullPath)
+
     def untrackBuffer_(self, fileBuffer):
         app.log.debug(fileBuffer.fullPath)
         self.buffers.remove(fileBuffer)
+        fileBuffer.filterCancel()
+        fileBuffer.journalDiscard()
 
     def fileClose(self, path):
         pass
@@ -39,7 +39,6 @@ import curses
 import locale
 import io
 import os
-import struct
 import sys
 import time
 import traceback
@@ -50,6 +49,7 @@ import app.buffer_manager
 import app.clipboard
 import app.color
 import app.curses_util
+import app.file_watcher
 import app.help
 import app.history
 import app.log
@@ -92,6 +92,10 @@ class CiProgram:
         self.exiting = False
         self.ch = 0
         self.bg = None
+        # Notices changes to open files (see app.file_watcher).
+        self.fileWatcher = None
+        # Where the recovery journals are kept (see makeHomeDirs()).
+        self.dirBackups = None
 
     def setUpCurses(self, cursesScreen):
         self.cursesScreen = cursesScreen
@@ -205,28 +209,24 @@ class CiProgram:
                         # callback functions) the sequence is converted into
                         # tuple.
                         keySequence = []
+                        paste_begin = app.curses_util.BRACKETED_PASTE_BEGIN
                         n = cursesWindow.getch()
                         while n != curses.ERR:
                             keySequence.append(n)
+                            if tuple(keySequence) == paste_begin:
+                                # The paste itself is read in bulk, below.
+                                break
                             n = cursesWindow.getch()
                         #app.log.info('sequence\n', keySequence)
                         # Check for Bracketed Paste Mode begin.
-                        paste_begin = app.curses_util.BRACKETED_PASTE_BEGIN
-                        if tuple(keySequence[:len(paste_begin)]) == paste_begin:
+                        if tuple(keySequence) == paste_begin:
                             ch = app.curses_util.BRACKETED_PASTE
-                            keySequence = keySequence[len(paste_begin):]
-                            paste_end = (curses.ascii.ESC,
-                                        ) + app.curses_util.BRACKETED_PASTE_END
-                            while tuple(
-                                    keySequence[-len(paste_end):]) != paste_end:
-                                #app.log.info('waiting in paste mode')
-                                n = cursesWindow.getch()
-                                if n != curses.ERR:
-                                    keySequence.append(n)
-                            keySequence = keySequence[:-(len(paste_end))]
-                            eventInfo = struct.pack(
-                                'B' * len(keySequence),
-                                *keySequence).decode(u"utf-8")
+                            eventInfo, rest = (
+                                app.curses_util.readBracketedPaste(
+                                    cursesWindow, sys.stdin.fileno()))
+                            # Return any input after the paste to curses.
+                            for byte in reversed(bytearray(rest)):
+                                curses.ungetch(byte)
                         else:
                             ch = tuple(keySequence)
                         if not ch:
@@ -280,6 +280,15 @@ class CiProgram:
                             self.debugMouseEvent = curses.getmouse()
                             eventInfo = (self.debugMouseEvent, time.time())
                         cmdList.append((ch, eventInfo))
+                if self.fileWatcher is not None:
+                    changedPaths = self.fileWatcher.changedPaths()
+                    if changedPaths:
+                        cmdList.append(
+                            (app.curses_util.FILES_CHANGED, changedPaths))
+                if not cmdList and not useBgThread:
+                    # Idle (see ProgramWindow.longTimeSlice() for the
+                    # background thread).
+                    self.bufferManager.flushJournals()
             start = time.time()
             if len(cmdList):
                 if useBgThread:
@@ -288,7 +297,7 @@ class CiProgram:
                     self.programWindow.executeCommandList(cmdList)
                     self.programWindow.shortTimeSlice()
                     self.programWindow.render()
-                    cmdCount += len(cmdList)
+                    cmdCount += app.curses_util.countUserCommands(cmdList)
 
     def startup(self):
         """A second init-like function. Called after command line arguments are
@@ -309,6 +318,7 @@ class CiProgram:
         showLogWindow = False
         cliFiles = []
         openToLine = None
+        pager = False
         profile = False
         readStdin = not sys.stdin.isatty()
         takeAll = False  # Take all args as file paths.
@@ -336,6 +346,8 @@ class CiProgram:
                     app.log.channelEnable('debug', True)
                     app.log.channelEnable('detail', True)
                     app.log.channelEnable('error', True)
+                elif i == '--pager':
+                    pager = True
                 elif i == '--parser':
                     app.log.channelEnable('parser', True)
                 elif i == '--singleThread':
@@ -382,6 +394,7 @@ class CiProgram:
             'showLogWindow': showLogWindow,
             'cliFiles': cliFiles,
             'openToLine': openToLine,
+            'pager': pager,
             'profile': profile,
             'readStdin': readStdin,
             'timeStartup': timeStartup,
@@ -429,7 +442,9 @@ class CiProgram:
                 os.makedirs(homePath)
             self.dirBackups = os.path.join(homePath, 'backups')
             if not os.path.isdir(self.dirBackups):
-                os.makedirs(self.dirBackups)
+                # The backups hold the unsaved changes to files (see
+                # app.journal), only for this user to read.
+                os.makedirs(self.dirBackups, 0o700)
             self.dirPrefs = os.path.join(homePath, 'prefs')
             if not os.path.isdir(self.dirPrefs):
                 os.makedirs(self.dirPrefs)
@@ -445,7 +460,10 @@ class CiProgram:
         app.curses_util.hackCursesFixes()
         if self.prefs.editor['useBgThread']:
             self.bg = app.background.startupBackground()
+        if self.prefs.editor.get('watchFiles'):
+            self.fileWatcher = app.file_watcher.FileWatcher()
         self.startup()
+        self.bufferManager.updateWatchedFiles()
         if self.prefs.startup.get('profile'):
             profile = cProfile.Profile()
             profile.enable()
@@ -461,6 +479,8 @@ class CiProgram:
         if self.prefs.editor['useBgThread']:
             self.bg.put((self.programWindow, 'quit'))
             self.bg.join()
+        if self.fileWatcher is not None:
+            self.fileWatcher.close()
 
     def setUpPalette(self):
 
@@ -0,0 +1,312 @@
+# Copyright 2019 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+  Column mode, for documents of delimiter separated values (e.g. CSV). The
+  fields of a row are found when the row is shown (or used), and remembered
+  until the row changes, so a large file is never indexed as a whole.
+
+  A field may be quoted with '"' (a doubled '"' within the quotes is a literal
+  '"'), in which case it may hold the delimiter. A quoted field does not
+  continue onto the next row.
+"""
+
+# For Python 2to3 support.
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import bisect
+import re
+
+import app.curses_util
+
+# The fields of at most this many rows are remembered, more than are ever
+# shown at once.
+kCachedRows = 4096
+
+# A field that is sorted as a number.
+kReNumber = re.compile(
+    u'\\s*[-+]?(?:\\d+\\.?\\d*|\\.\\d+)(?:[eE][-+]?\\d+)?\\s*$')
+
+
+def _width(text):
+    """The rendered width of |text| (see app.curses_util.columnWidth())."""
+    if not text or max(text) <= app.curses_util.MIN_DOUBLE_WIDE_CHARACTER:
+        return len(text)
+    return app.curses_util.columnWidth(text)
+
+
+def fieldStarts(line, delimiter, limit=None):
+    """Find where each field of |line| starts (only the first |limit| fields,
+    if |limit| is not None).
+
+    Returns:
+        A list of indexes into |line|. A field ends just before the delimiter
+        that precedes the next start (or at the end of the line).
+    """
+    starts = [0]
+    if u'"' not in line:
+        # The common case, without a loop in Python.
+        pieces = line.split(delimiter, -1 if limit is None else limit - 1)
+        for field in pieces[:-1]:
+            starts.append(starts[-1] + len(field) + 1)
+        return starts
+    pos = 0
+    while len(starts) != limit:
+        if line.startswith(u'"', pos):
+            # Find the closing quote (skipping doubled quotes).
+            pos += 1
+            while True:
+                pos = line.find(u'"', pos)
+                if pos < 0 or not line.startswith(u'"', pos + 1):
+                    break
+                pos += 2
+            if pos < 0:
+                return starts
+        pos = line.find(delimiter, pos)
+        if pos < 0:
+            return starts
+        pos += 1
+        starts.append(pos)
+    return starts
+
+
+def fieldText(line, starts, index):
+    """Get the text of field |index| of |line| (with the |starts| of its
+    fields, see fieldStarts()), or None if there's no such field."""
+    if index >= len(starts):
+        return None
+    if index + 1 < len(starts):
+        return line[starts[index]:starts[index + 1] - 1]
+    return line[starts[index]:]
+
+
+def fieldValue(field):
+    """The value of the |field| text, without its quotes."""
+    if len(field) >= 2 and field[0] == u'"' and field[-1] == u'"':
+        return field[1:-1].replace(u'""', u'"')
+    return field
+
+
+def fieldSortKey(delimiter, index):
+    """Get a function of a line that is its sort key (see sortKey()) by the
+    value of field |index|. Only that field is taken from the line. Lines
+    without the field sort last."""
+
+    def key(line):
+        # The start of the next field marks the end of this one.
+        text = fieldText(line, fieldStarts(line, delimiter, index + 2), index)
+        return (2, 0.0, u'') if text is None else sortKey(fieldValue(text))
+
+    return key
+
+
+def sortKey(value):
+    """A key that sorts numbers (by value) before other text."""
+    if kReNumber.match(value):
+        try:
+            return (0, float(value), u'')
+        except ValueError:
+            pass
+    return (1, 0.0, value)
+
+
+def fieldColumns(widths):
+    """Get the column where each field starts in its row (as it's not lined
+    up), from the field |widths| (see ColumnIndex.fields())."""
+    cols = []
+    col = 0
+    for width in widths:
+        cols.append(col)
+        # Each field is followed by the delimiter.
+        col += width + 1
+    return cols
+
+
+class AlignedWindow:
+    """Draws to a |window| (see app.window.Window.addStr()) with some of its
+    rows lined up in columns. The text for those rows is drawn at its columns
+    in the row, as for any row, and moved to where its field is shown. Only
+    the columns from |left| up to |right| are drawn."""
+
+    def __init__(self, window, left, right, scrollCol):
+        self.window = window
+        self.left = left
+        self.right = right
+        self.scrollCol = scrollCol
+        # Map of window row to (ColumnIndex, fields, column starts).
+        self.__rows = {}
+
+    def addStr(self, row, col, text, color):
+        aligned = self.__rows.get(row)
+        if aligned is None:
+            self.__addClipped(row, col, text, color)
+            return
+        index, fields, columnStarts = aligned
+        widths = fields[1]
+        fieldCols = fieldColumns(widths)
+        textWidth = _width(text)
+        textCol = 0
+        while textCol < textWidth:
+            # Draw the text up to the end of a field (or a delimiter) at a
+            # time.
+            docCol = self.scrollCol + col + textCol
+            i = max(bisect.bisect_right(fieldCols, docCol, 0, len(widths)) - 1,
+                    0)
+            offset = docCol - fieldCols[i]
+            if i + 1 == len(widths):
+                span = textWidth - textCol
+            elif offset >= widths[i]:
+                span = 1
+            else:
+                span = min(widths[i] - offset, textWidth - textCol)
+            self.__addClipped(
+                row,
+                index.alignedColumn(fields, columnStarts, docCol) -
+                self.scrollCol,
+                app.curses_util.renderedSubStr(text, textCol, textCol + span),
+                color)
+            textCol += span
+
+    def alignRow(self, row, index, fields, columnStarts):
+        """Draw the window |row| with the |fields| (see ColumnIndex.fields())
+        of its document row starting at |columnStarts| (see
+        ColumnIndex.layout())."""
+        self.__rows[row] = (index, fields, columnStarts)
+
+    def __addClipped(self, row, col, text, color):
+        if col < self.left:
+            text = app.curses_util.renderedSubStr(text, self.left - col)
+            col = self.left
+        if col + _width(text) > self.right:
+            text = app.curses_util.renderedSubStr(text, 0,
+                                                  max(self.right - col, 0))
+        if text:
+            self.window.addStr(row, col, text, color)
+
+
+class ColumnIndex:
+    """The fields of the rows of a document (see the module doc), found as the
+    rows are asked for."""
+
+    def __init__(self, delimiter):
+        self.delimiter = delimiter
+        # Map of row to (field starts, field widths).
+        self.__rows = {}
+        # The Mutator.changeVersion the rows were found at.
+        self.__version = None
+
+    def alignedColumn(self, fields, columnStarts, col):
+        """Find where the (unaligned) column |col| of a row with |fields| (see
+        fields()) is shown, with its fields starting at |columnStarts| (see
+        layout())."""
+        widths = fields[1]
+        fieldCols = fieldColumns(widths)
+        i = max(bisect.bisect_right(fieldCols, col, 0, len(widths)) - 1, 0)
+        offset = col - fieldCols[i]
+        if i + 1 < len(widths) and offset >= widths[i]:
+            # The delimiter is just before the next column.
+            return columnStarts[i + 1] - 1
+        return columnStarts[i] + offset
+
+    def unalignedColumn(self, fields, columnStarts, col):
+        """The inverse of alignedColumn(). A |col| in the space that pads a
+        field is at the end of the field."""
+        widths = fields[1]
+        fieldCols = fieldColumns(widths)
+        i = max(bisect.bisect_right(columnStarts, col, 0, len(widths)) - 1, 0)
+        offset = col - columnStarts[i]
+        if i + 1 < len(widths) and offset >= widths[i]:
+            return fieldCols[i] + widths[i]
+        return fieldCols[i] + offset
+
+    def fieldAtColumn(self, textBuffer, row, col):
+        """Find which field of |row| the (unaligned) column |col| is in."""
+        line = textBuffer.lines[row]
+        index = app.curses_util.columnToIndex(col, line)
+        return max(0, bisect.bisect_right(self.fields(textBuffer, row)[0],
+                                          index) - 1)
+
+    def fieldIndex(self, textBuffer, name):
+        """Find the field named |name| in the first row (the header).
+
+        Returns:
+            The index of the field, or None if there is no such field.
+        """
+        line = textBuffer.lines[0]
+        starts = self.fields(textBuffer, 0)[0]
+        for i in range(len(starts)):
+            if fieldValue(fieldText(line, starts, i)) == name:
+                return i
+        return None
+
+    def fields(self, textBuffer, row):
+        """Get the fields of |row| of the |textBuffer|.
+
+        Returns:
+            A (field starts, field widths) tuple of lists, see fieldStarts().
+        """
+        self.__update(textBuffer)
+        fields = self.__rows.get(row)
+        if fields is None:
+            line = textBuffer.lines[row]
+            starts = fieldStarts(line, self.delimiter)
+            ends = [i - 1 for i in starts[1:]] + [len(line)]
+            widths = [_width(line[i:j]) for i, j in zip(starts, ends)]
+            fields = (starts, widths)
+            if len(self.__rows) >= kCachedRows:
+                self.__rows.clear()
+            self.__rows[row] = fields
+        return fields
+
+    def layout(self, textBuffer, rows):
+        """Size the columns to fit the fields of |rows| (e.g. the rows in
+        view).
+
+        Returns:
+            A list of the columns where each field starts, and one past the
+            end of the last.
+        """
+        widths = []
+        for row in rows:
+            rowWidths = self.fields(textBuffer, row)[1]
+            for i, width in enumerate(rowWidths[:len(widths)]):
+                if width > widths[i]:
+                    widths[i] = width
+            widths.extend(rowWidths[len(widths):])
+        columnStarts = [0]
+        for width in widths:
+            # Each field is followed by the delimiter.
+            columnStarts.append(columnStarts[-1] + width + 1)
+        return columnStarts
+
+    def __update(self, textBuffer):
+        """Forget the rows that have changed since the last update."""
+        version = textBuffer.changeVersion
+        if version == self.__version:
+            return
+        changes = (None if self.__version is None else
+                   textBuffer.changesSince(self.__version))
+        if changes is None:
+            self.__rows.clear()
+        else:
+            for row, removedCount, addedCount in changes:
+                if removedCount == addedCount:
+                    for i in range(row, row + removedCount):
+                        self.__rows.pop(i, None)
+                else:
+                    # The rows after a change have moved.
+                    self.__rows = dict(
+                        i for i in self.__rows.items() if i[0] < row)
+        self.__version = version
@@ -425,14 +425,19 @@ class InteractiveQuit(app.controller.Controller):
         commandSet = initCommandSet(self, textBuffer)
         commandSet.update({
             #KEY_F1: self.info,
-            ord('n'): self.view.quitNow,
-            ord('N'): self.view.quitNow,
+            ord('n'): self.quitWithoutSaving,
+            ord('N'): self.quitWithoutSaving,
             ord('y'): self.saveOrChangeToSaveAs,
             ord('Y'): self.saveOrChangeToSaveAs,
         })
         self.commandSet = commandSet
         self.commandDefault = self.confirmationPromptFinish
 
+    def quitWithoutSaving(self):
+        # The unsaved changes are not to be recovered later.
+        self.view.program.bufferManager.discardJournals()
+        self.view.quitNow()
+
 
 class CuaEdit(app.controller.Controller):
     """Keyboard mappings for CUA. CUA is the Cut/Copy/Paste paradigm."""
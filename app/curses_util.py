@@ -25,6 +25,7 @@ import curses
 import curses.ascii
 import fcntl
 import os
+import select
 import signal
 import struct
 import sys
@@ -44,6 +45,14 @@ BRACKETED_PASTE = (b'terminal_paste',)  # Pseudo event type.
 
 UNICODE_INPUT = (b'unicode_input',)  # Pseudo event type.
 
+# The rest of a bracketed paste is read from the terminal this many bytes at a
+# time (see readBracketedPaste()), waiting at most this many seconds for more.
+kPasteReadSize = 64 * 1024
+kPasteWaitSeconds = 0.01
+
+# The event info is a set of paths (see app.file_watcher).
+FILES_CHANGED = (b'files_changed',)  # Pseudo event type.
+
 CTRL_AT = b'^@'  # 0x00
 CTRL_SPACE = b'^@'  # 0x00
 CTRL_A = b'^A'  # 0x01
@@ -231,6 +240,13 @@ def cursesKeyName(keyCode):
     return None
 
 
+def countUserCommands(cmdList):
+    """Count the (ch, eventInfo) commands in |cmdList| that are user input,
+    rather than events from the program itself (e.g. FILES_CHANGED). The
+    count of rendered commands tells tests which input has been drawn."""
+    return len([i for i in cmdList if i[0] != FILES_CHANGED])
+
+
 def columnToIndex(column, string):
     """If the visual cursor is on |column|, which index of the string is the
     cursor on?"""
@@ -472,6 +488,47 @@ def terminalSize():
     return h, w
 
 
+def readBracketedPaste(cursesWindow, fd, data=b''):
+    """Read the rest of a bracketed paste, after BRACKETED_PASTE_BEGIN.
+
+    Curses returns the input a byte at a time, which is far too slow for a
+    large paste. So whenever curses has none of the input buffered, the paste
+    is read straight from the terminal in bulk.
+
+    Args:
+        cursesWindow: Where curses input is read (with getch()).
+        fd (int): The terminal input file descriptor.
+        data (bytes): The start of the paste, if any has been read.
+
+    Returns:
+        A (text, rest) tuple of the pasted (unicode) text and the bytes read
+        after the end of the paste (which should be returned to curses).
+    """
+    pasteEnd = struct.pack(b'6B', curses.ascii.ESC, *BRACKETED_PASTE_END)
+    data = bytearray(data)
+    end = data.find(pasteEnd)
+    while end < 0:
+        n = cursesWindow.getch()
+        if n == curses.ERR:
+            # Curses has none of the input buffered, so read from the
+            # terminal while the paste keeps arriving.
+            while (end < 0 and
+                   select.select([fd], [], [], kPasteWaitSeconds)[0]):
+                chunk = os.read(fd, kPasteReadSize)
+                if not chunk:
+                    break
+                searchFrom = max(0, len(data) - len(pasteEnd) + 1)
+                data.extend(chunk)
+                end = data.find(pasteEnd, searchFrom)
+        elif 0 < n < 256:
+            # (A 0 is pushed to wake getch(), see hackCursesFixes().)
+            data.append(n)
+            if data.endswith(pasteEnd):
+                end = len(data) - len(pasteEnd)
+    text = bytes(data[:end]).decode(u'utf-8', u'replace')
+    return text, bytes(data[end + len(pasteEnd):])
+
+
 def hackCursesFixes():
     if sys.platform == u'darwin':
 
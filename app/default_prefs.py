@@ -115,6 +115,7 @@ color8 = {
     "html_element_end": 1,
     "js_string": 3,
     "keyword": 1,
+    "line_modified": 3,
     "line_number": 7,
     "line_number_current": 6,
     "line_overflow": 7,
@@ -192,6 +193,7 @@ color16 = {
     "html_element_end": keywordsColor16Index,
     "js_string": stringColor16Index,
     "keyword": keywordsColor16Index,
+    "line_modified": 11,
     "line_number": borderColor16Index,
     "line_number_current": borderHighlightColor16Index,
     "line_overflow": 15,
@@ -267,6 +269,7 @@ color256 = {
     "html_element_end": keywordsColorIndex,
     "js_string": stringColorIndex,
     "keyword": keywordsColorIndex,
+    "line_modified": 184,
     "line_number": 168,
     "line_number_current": 146,
     "line_overflow": 105,
@@ -347,6 +350,18 @@ prefs = {
         # Scroll the window to keep the cursor on screen.
         "captiveCursor": False,
         "colorScheme": "default",
+        # Files with these extensions are shown in column mode: the fields
+        # separated by the delimiter are lined up (see app.columns).
+        "columnDelimiters": {
+            ".csv": ",",
+            ".tsv": "\t",
+        },
+        # What to do when a file that looks like text (from its start) has
+        # bytes that can't be decoded: "binary" opens it as a binary file,
+        # "replace" shows those bytes as U+FFFD in a read only view. For a
+        # progressive load (see "progressiveLoadSize") with edits made before
+        # those bytes are read, it's always "replace".
+        "decodeErrors": "replace",
         # Show hidden files in file list.
         "filesShowDotFiles": True,
         # Show the size on disk for files in the file list.
@@ -367,6 +382,9 @@ prefs = {
         # override this value.
         "indentation": "  ",
         "lineLimitIndicator": 80,
+        # Files of at least this many bytes are opened as a read only view,
+        # which is mapped into memory rather than read. None to disable.
+        "mappedFileSize": 1024 * 1024 * 1024,
         # When the mouse wheel is moved, which way should the window scroll.
         "naturalScrollDirection": True,
         "onSaveStripTrailingSpaces": True,
@@ -378,6 +396,21 @@ prefs = {
         "palette8": "default8",
         "palette16": "default16",
         "palette256": "default256",
+        # Files of at least this many bytes are saved by rewriting only the
+        # part of the file from the first changed row on, if the file hasn't
+        # changed on disk. That's faster, but the save isn't atomic. None to
+        # always write the whole file.
+        "partialWriteSize": 64 * 1024 * 1024,
+        # Large files are edited with fewer features to stay responsive. A
+        # file is past a tier when its size (in characters) or its longest
+        # line exceeds the limits of that entry. Past the first: no spelling
+        # or overlays; past the second: also no file history, and the lines
+        # are packed in memory; past the third: also undo in coarse steps.
+        "performanceTiers": [
+            {"fileSize": 16 * 1024 * 1024, "lineLength": 64 * 1024},
+            {"fileSize": 64 * 1024 * 1024, "lineLength": 1024 * 1024},
+            {"fileSize": 256 * 1024 * 1024, "lineLength": 16 * 1024 * 1024},
+        ],
         "predictionShowOpenFiles": True,
         "predictionShowAlternateFiles": True,
         "predictionShowRecentFiles": True,
@@ -385,6 +418,16 @@ prefs = {
         "predictionSortAscendingByType": None,
         "predictionSortAscendingByName": None,
         "predictionSortAscendingByStatus": None,
+        # Files of at least this many bytes are shown once the first part is
+        # read, and the rest is read in the background. None to disable.
+        "progressiveLoadSize": 4 * 1024 * 1024,
+        # Keep a journal of unsaved changes (in the backups directory), so
+        # they can be recovered after a crash when the file is next opened.
+        "recoveryJournal": True,
+        # How much a save waits for the file to reach the disk: "none" leaves
+        # it to the OS, "file" waits for the file data, and "all" also waits
+        # for the directory entry.
+        "saveSync": "file",
         "saveUndo": True,
         "showLineNumbers": True,
         "showStatusLine": True,
@@ -392,8 +435,14 @@ prefs = {
         # When expanding tabs to spaces, how many spaces to use. This is not
         # used for indentation, see "indentation" or grammar "indent".
         "tabSize": 8,
+        # The maximum number of undo steps kept for each file, or None for no
+        # limit.
+        "undoLimit": None,
         # Use a background thread to process changes and parse grammars.
         "useBgThread": True,
+        # Notice when open files are changed by other programs, and update
+        # the documents without unsaved changes to match.
+        "watchFiles": True,
     },
     "fileType": {
         "bash": {
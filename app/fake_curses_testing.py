@@ -32,8 +32,10 @@ import unittest
 
 import third_party.pyperclip as clipboard
 
+import app.buffer_file
 import app.ci_program
 import app.curses_util
+import app.journal
 
 #from app.curses_util import *
 
@@ -309,6 +311,10 @@ class FakeCursesTestCase(unittest.TestCase):
         if os.path.isfile(kTestFile):
             os.unlink(kTestFile)
         self.assertFalse(os.path.isfile(kTestFile))
+        # Nor any unsaved changes to it left by a prior run.
+        app.journal.Journal(
+            os.path.join(self.prg.prefs.userData.get('homePath'), 'backups'),
+            app.buffer_file.expandFullPath(kTestFile)).remove()
         self.runWithFakeInputs(fakeInputs, ["ci_test_program", kTestFile])
 
     def selectionDocumentCheck(self, expectedPenRow, expectedPenCol,
@@ -0,0 +1,274 @@
+# Copyright 2019 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+  Notice when the files of open documents are changed by other programs (e.g.
+  a build tool or a 'git checkout'), so that the documents can be brought up
+  to date (see app.actions.Actions.fileRefresh()).
+
+  On Linux, inotify (through ctypes) reports changes to the directories of the
+  files. Elsewhere, or if inotify is not available, the files are polled with
+  os.stat(), less often while nothing is changing.
+"""
+
+# For Python 2to3 support.
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import struct
+import sys
+import threading
+
+import app.log
+
+# Polling starts this often (in seconds), and backs off to the maximum while
+# no polled file changes.
+kPollMinSeconds = 0.5
+kPollMaxSeconds = 8.0
+
+# inotify constants (see inotify(7)).
+kInCloseWrite = 0x00000008
+kInMovedFrom = 0x00000040
+kInMovedTo = 0x00000080
+kInCreate = 0x00000100
+kInDelete = 0x00000200
+kInQueueOverflow = 0x00004000
+kInIgnored = 0x00008000
+kInNonBlock = 0o4000
+kInCloseOnExec = 0o2000000
+# Changes that complete a new version of a file. Writes (in progress) are
+# not included, the file is checked once it's closed.
+kInWatchMask = (kInCloseWrite | kInMovedFrom | kInMovedTo | kInCreate |
+                kInDelete)
+kInEventHeader = struct.Struct('iIII')
+
+kFileSystemEncoding = sys.getfilesystemencoding() or 'utf-8'
+
+
+def _loadInotify():
+    """Get the C library, if it has inotify."""
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        libc.inotify_init1.argtypes = [ctypes.c_int]
+        libc.inotify_add_watch.argtypes = [
+            ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32
+        ]
+        libc.inotify_rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+        return libc
+    except (AttributeError, OSError, TypeError):
+        return None
+
+
+def _signature(path):
+    """What's compared to tell whether the file at |path| has changed."""
+    try:
+        fileStat = os.stat(path)
+    except OSError:
+        return None
+    return (fileStat.st_ino, fileStat.st_size, fileStat.st_mtime)
+
+
+class FileWatcher:
+    """Watches a set of file paths (see setPaths()) on a thread of its own.
+    The paths that may have changed are collected for changedPaths(). A
+    reported path may not have actually changed (e.g. it was saved by this
+    program), so the caller compares it with what it knows of the file."""
+
+    def __init__(self, useInotify=True):
+        self.__lock = threading.Lock()
+        self.__paths = set()
+        self.__changed = set()
+        # The last signature of each path that is polled (see _signature()).
+        self.__polled = {}
+        # Map of directory path to inotify watch descriptor, and back.
+        self.__directories = {}
+        self.__watches = {}
+        self.__libc = _loadInotify() if useInotify else None
+        self.__inotifyFd = None
+        # Written to wake the thread (to stop or to see new paths).
+        self.__wakeFds = None
+        self.__thread = None
+        self.__stopped = False
+
+    def changedPaths(self):
+        """Get (and forget) the paths that may have changed since the last
+        call.
+
+        Returns:
+            A set of paths.
+        """
+        with self.__lock:
+            changed = self.__changed
+            self.__changed = set()
+        return changed
+
+    def close(self):
+        """Stop watching. The thread exits soon after."""
+        with self.__lock:
+            self.__stopped = True
+            self.__wake()
+
+    def setPaths(self, paths):
+        """Watch the files at |paths| (an iterable of paths), and stop watching
+        any others."""
+        paths = set(paths)
+        with self.__lock:
+            if paths == self.__paths or self.__stopped:
+                return
+            for path in self.__paths - paths:
+                self.__polled.pop(path, None)
+                directory = os.path.dirname(path)
+                if directory in self.__directories and not any(
+                        os.path.dirname(i) == directory for i in paths):
+                    watch = self.__directories.pop(directory)
+                    del self.__watches[watch]
+                    self.__libc.inotify_rm_watch(self.__inotifyFd, watch)
+            added = paths - self.__paths
+            self.__paths = paths
+            if self.__thread is None:
+                self.__start()
+            for path in added:
+                if not self.__watchDirectory(os.path.dirname(path)):
+                    self.__polled[path] = _signature(path)
+            self.__wake()
+
+    def __pollFiles(self):
+        """Check the signatures of the polled files.
+
+        Returns:
+            True if any have changed.
+        """
+        with self.__lock:
+            polled = list(self.__polled)
+        signatures = [(path, _signature(path)) for path in polled]
+        found = False
+        with self.__lock:
+            for path, signature in signatures:
+                if (path in self.__polled and
+                        self.__polled[path] != signature):
+                    self.__polled[path] = signature
+                    self.__changed.add(path)
+                    found = True
+        return found
+
+    def __readEvents(self):
+        try:
+            data = os.read(self.__inotifyFd, 64 * 1024)
+        except OSError as e:
+            if e.errno in (errno.EAGAIN, errno.EINTR):
+                return
+            raise
+        offset = 0
+        with self.__lock:
+            while offset + kInEventHeader.size <= len(data):
+                watch, mask, _, length = kInEventHeader.unpack_from(
+                    data, offset)
+                offset += kInEventHeader.size
+                name = data[offset:offset + length].rstrip(b'\0')
+                offset += length
+                if mask & kInQueueOverflow:
+                    # Events were lost, so check every file.
+                    self.__changed.update(self.__paths)
+                    continue
+                directory = self.__watches.get(watch)
+                if directory is None:
+                    continue
+                if mask & kInIgnored:
+                    # The directory is gone, so poll its files instead.
+                    del self.__watches[watch]
+                    del self.__directories[directory]
+                    for path in self.__paths:
+                        if os.path.dirname(path) == directory:
+                            self.__polled[path] = None
+                            self.__changed.add(path)
+                    continue
+                path = os.path.join(directory,
+                                    name.decode(kFileSystemEncoding, 'replace'))
+                if path in self.__paths:
+                    self.__changed.add(path)
+
+    def __run(self):
+        interval = kPollMinSeconds
+        wakeFd = self.__wakeFds[0]
+        try:
+            while True:
+                with self.__lock:
+                    if self.__stopped:
+                        return
+                    fds = [wakeFd]
+                    if self.__directories:
+                        fds.append(self.__inotifyFd)
+                    timeout = interval if self.__polled else None
+                ready = select.select(fds, [], [], timeout)[0]
+                if wakeFd in ready:
+                    os.read(wakeFd, 1024)
+                if self.__inotifyFd is not None and self.__inotifyFd in ready:
+                    self.__readEvents()
+                if self.__pollFiles():
+                    interval = kPollMinSeconds
+                else:
+                    interval = min(2 * interval, kPollMaxSeconds)
+        except Exception as e:
+            app.log.exception(e)
+        finally:
+            with self.__lock:
+                wakeFds = self.__wakeFds
+                self.__wakeFds = None
+            for fd in wakeFds:
+                os.close(fd)
+            if self.__inotifyFd is not None:
+                os.close(self.__inotifyFd)
+
+    def __start(self):
+        if self.__libc is not None:
+            fd = self.__libc.inotify_init1(kInNonBlock | kInCloseOnExec)
+            if fd >= 0:
+                self.__inotifyFd = fd
+            else:
+                app.log.info(u'inotify is not available',
+                             os.strerror(ctypes.get_errno()))
+        self.__wakeFds = os.pipe()
+        self.__thread = threading.Thread(target=self.__run)
+        self.__thread.setName('ci_edit_file_watcher')
+        self.__thread.setDaemon(True)
+        self.__thread.start()
+
+    def __wake(self):
+        if self.__wakeFds is not None:
+            os.write(self.__wakeFds[1], b'.')
+
+    def __watchDirectory(self, directory):
+        """Watch |directory| with inotify.
+
+        Returns:
+            False if it can't be watched (so its files are polled).
+        """
+        if directory in self.__directories:
+            return True
+        if self.__inotifyFd is None:
+            return False
+        watch = self.__libc.inotify_add_watch(
+            self.__inotifyFd, directory.encode(kFileSystemEncoding), kInWatchMask)
+        if watch < 0:
+            app.log.info(u'inotify_add_watch failed', directory,
+                         os.strerror(ctypes.get_errno()))
+            return False
+        self.__directories[directory] = watch
+        self.__watches[watch] = directory
+        return True
@@ -33,6 +33,7 @@ Command line help
   --log           Display logging and debug info.
   --help          Print this help message then exit.
   --keys          Print key bindings then exit.
+  --pager         View standard in (read only) as it arrives, like a pager.
   --singleThread  Do not use a background thread for parsing.
   --test          Run unit tests and exit.
   --version       Print version and license information then exit.\
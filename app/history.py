@@ -129,7 +129,7 @@ class History():
                 except ValueError as e:
                     app.log.info(unicode(e))
 
-    def saveUserHistory(self, fileInfo, fileHistory):
+    def saveUserHistory(self, fileInfo, fileHistory, newFileInfo=None):
         """
         Saves the user's file history by writing to a pickle file.
 
@@ -137,6 +137,8 @@ class History():
           fileInfo (tuple): Contains (filePath, lastChecksum, lastFileSize).
           fileHistory (dict): The history of the file that the user wants to
                               save.
+          newFileInfo (tuple): Defaults to None. The (checksum, fileSize) of
+            the file as it was saved, if it was hashed as it was written.
 
         Returns:
           None.
@@ -145,7 +147,9 @@ class History():
         try:
             if self.pathToHistory is not None:
                 self.userHistory.pop((lastChecksum, lastFileSize), None)
-                newChecksum, newFileSize = getFileInfo(filePath)
+                if newFileInfo is None:
+                    newFileInfo = getFileInfo(filePath)
+                newChecksum, newFileSize = newFileInfo
                 if newChecksum is None:
                     app.log.info(u"Failed to checksum", repr(filePath))
                     return
@@ -156,7 +160,7 @@ class History():
         except Exception as e:
             app.log.exception(e)
 
-    def getFileHistory(self, filePath, data=None):
+    def getFileHistory(self, filePath, data=None, fileInfo=None):
         """
         Takes in an file path and an optimal data
         argument and checks for the current file's history.
@@ -169,11 +173,15 @@ class History():
           filePath (str): The absolute path to the file.
           data (str): Defaults to None. This is the data
             returned by calling read() on a file object.
+          fileInfo (tuple): Defaults to None. The (checksum, fileSize) of the
+            file, if it was hashed as it was read (see getFileInfo()).
 
         Returns:
           The file history (dict) of the desired file if it exists.
         """
-        checksum, fileSize = getFileInfo(filePath, data)
+        if fileInfo is None:
+            fileInfo = getFileInfo(filePath, data)
+        checksum, fileSize = fileInfo
         if checksum is None:
             fileHistory = {}
         else:
@@ -26,7 +26,14 @@ import os
 import re
 import subprocess
 
+import app.columns
 import app.controller
+import app.line_filter
+
+
+# Parts of a regex that may match a new line (or the start or end of the
+# text), so that a match may span rows. This errs on the side of finding one.
+kReMultiRowPattern = re.compile(r'\n|\\[nsWDAZx0-7uUN]|\[\^|\(\?[a-zA-Z]*s')
 
 
 def functionTestEq(a, b):
@@ -104,9 +111,15 @@ class InteractivePrompt(app.controller.Controller):
         self.commands = {
             u'bm': self.bookmarkCommand,
             u'build': self.buildCommand,
+            u'cancel': self.cancelCommand,
+            u'col': self.columnCommand,
+            u'columns': self.columnModeCommand,
             u'cua': self.changeToCuaMode,
+            u'cursors': self.cursorsCommand,
             u'emacs': self.changeToEmacsMode,
+            u'follow': self.followCommand,
             u'make': self.makeCommand,
+            u'revert': self.revertCommand,
             #u'split': self.splitCommand,  # Experimental wip.
             u'vim': self.changeToVimNormalMode,
         }
@@ -148,6 +161,64 @@ class InteractivePrompt(app.controller.Controller):
     def changeToVimNormalMode(self, cmdLine, view):
         return {}, u'Vim normal mode'
 
+    def cancelCommand(self, cmdLine, view):
+        if view.textBuffer.filterCancel():
+            return {}, u'Cancelled the filter'
+        return {}, u'No filter is running'
+
+    def columnCommand(self, cmdLine, view):
+        """Move to a field of the row (by number, from 1, or by the name in
+        the first row) in column mode."""
+        tb = view.textBuffer
+        if tb.columnIndex is None:
+            return {}, u'Column mode is off, see the columns command'
+        args = cmdLine.split(None, 1)
+        if len(args) < 2:
+            return {}, u'tip: col 3 or col name to move to that column'
+        name = kReUnquote.sub(u'\\2', args[1].strip())
+        if name.isdigit():
+            index = int(name) - 1
+        else:
+            index = tb.columnIndex.fieldIndex(tb, name)
+        if index is None or index < 0 or not tb.cursorMoveToField(index):
+            return {}, u'No column %s' % (name,)
+        return {}, u'Column %d' % (index + 1,)
+
+    def columnModeCommand(self, cmdLine, view):
+        """Turn column mode on (with the given delimiter, ',' by default) or
+        off."""
+        tb = view.textBuffer
+        args = cmdLine.split(None, 1)
+        if len(args) < 2 and tb.columnIndex is not None:
+            tb.setColumnMode(None)
+            return {}, u'Column mode is off'
+        delimiter = args[1].strip() if len(args) > 1 else u','
+        if len(delimiter) != 1:
+            return {}, u'The delimiter is one character, e.g. columns ;'
+        tb.setColumnMode(delimiter)
+        return {}, u'Column mode, separated by %s' % (delimiter,)
+
+    def cursorsCommand(self, cmdLine, view):
+        """Put a cursor on each selected row (or with "find", on each match of
+        the find pattern) to type at all of them at once. With "none", go
+        back to the one cursor."""
+        tb = view.textBuffer
+        args = cmdLine.split()
+        if len(args) < 2:
+            count = tb.cursorsOnSelectedRows()
+            if not count:
+                return {}, u'Select the rows to put the cursors on'
+        elif args[1] == u'find':
+            count = tb.cursorsOnFinds()
+            if not count:
+                return {}, u'Find something to put the cursors on'
+        elif args[1] == u'none':
+            tb.cursorsClear()
+            return {}, u'One cursor'
+        else:
+            return {}, u'tip: cursors, cursors find, or cursors none'
+        return {}, u'%d cursors (escape for one)' % (count,)
+
     def focus(self):
         app.log.info(u'InteractivePrompt.focus')
         self.textBuffer.selectionAll()
@@ -164,14 +235,31 @@ class InteractivePrompt(app.controller.Controller):
 
         fileName, ext = os.path.splitext(self.view.host.textBuffer.fullPath)
         app.log.info(fileName, ext)
-        lines = self.view.host.textBuffer.doDataToLines(
-            formatter.get(ext,
-                          noOp)(self.view.host.textBuffer.doLinesToData(lines)))
-        return lines, u'Changed %d lines' % (len(lines),)
+        tb = self.view.host.textBuffer
+
+        def formatRows(rows, start):
+            return tb.doDataToLines(
+                formatter.get(ext, noOp)(tb.doLinesToData(rows)))
+
+        return app.line_filter.LineFilter(lines, formatRows, None), u''
+
+    def followCommand(self, cmdLine, view):
+        tb = view.textBuffer
+        if tb.isFollowing:
+            tb.fileFollow(False)
+            return {}, u'Stopped following the file'
+        if tb.fileFollow():
+            return {}, u'Following the file'
+        return {}, u'Only a saved text file can be followed'
 
     def makeCommand(self, cmdLine, view):
         return {}, u'making stuff'
 
+    def revertCommand(self, cmdLine, view):
+        if view.textBuffer.editRevertToSaved():
+            return {}, u'Reverted to the saved version'
+        return {}, u'The saved version is not in the undo history'
+
     def splitCommand(self, cmdLine, view):
         view.splitWindow()
         return {}, u'Split window'
@@ -203,12 +291,14 @@ class InteractivePrompt(app.controller.Controller):
                     if not len(lines):
                         tb.setMessage(
                             u'The %s filter needs a selection.' % (cmd,))
+                    elif tb.lineFilter is not None:
+                        tb.setMessage(u'A filter is running, see cancel')
                     else:
-                        lines, message = dataFilter(cmdLine, lines)
-                        tb.setMessage(message)
-                        if not len(lines):
-                            lines.append(u'')
-                        tb.editPasteLines(tuple(lines))
+                        lineFilter, message = dataFilter(cmdLine, lines)
+                        if lineFilter is None:
+                            tb.setMessage(message)
+                        else:
+                            tb.filterStart(lineFilter)
                 else:
                     command = self.commands.get(cmd, self.unknownCommand)
                     message = command(cmdLine, self.view.host)[1]
@@ -273,44 +363,66 @@ class InteractivePrompt(app.controller.Controller):
         app.log.info(u'InteractivePrompt command set')
 
     def lowerSelectedLines(self, cmdLine, lines):
-        lines = [line.lower() for line in lines]
-        return lines, u'Changed %d lines' % (len(lines),)
+        return app.line_filter.LineFilter(
+            lines, lambda rows, start: [line.lower() for line in rows]), u''
 
     def assignIndexToSelectedLines(self, cmdLine, lines):
-        output = []
-        for i, line in enumerate(lines):
-            output.append(u"%s = %d" % (line, i))
-        return output, u'Changed %d lines' % (len(output),)
+
+        def assignIndex(rows, start):
+            return [
+                u"%s = %d" % (line, start + i) for i, line in enumerate(rows)
+            ]
+
+        return app.line_filter.LineFilter(lines, assignIndex), u''
 
     def sortSelectedLines(self, cmdLine, lines):
-        lines.sort()
-        return lines, u'Changed %d lines' % (len(lines),)
+        args = cmdLine.split()
+        if len(args) > 1:
+            # Sort by a column (see app.columns).
+            tb = self.view.host.textBuffer
+            if tb.columnIndex is None:
+                return None, u'Sorting by a column needs column mode'
+            if not args[1].isdigit() or int(args[1]) < 1:
+                return None, u'tip: sort 3 to sort by the third column'
+            return app.line_filter.SortFilter(
+                lines,
+                app.columns.fieldSortKey(tb.columnIndex.delimiter,
+                                         int(args[1]) - 1)), u''
+        return app.line_filter.SortFilter(lines), u''
 
     def substituteText(self, cmdLine, lines):
         if len(cmdLine) < 2:
-            return (lines, u'''tip: %s/foo/bar/ to replace 'foo' with 'bar'.'''
+            return (None, u'''tip: %s/foo/bar/ to replace 'foo' with 'bar'.'''
                     % (cmdLine,))
         if not lines:
-            return lines, u'No text was selected.'
+            return None, u'No text was selected.'
         sre = re.match('\w+(\W)', cmdLine)
         if not sre:
-            return (lines, u'''Separator punctuation missing, example:'''
+            return (None, u'''Separator punctuation missing, example:'''
                     u''' %s/foo/bar/''' % (cmdLine,))
         separator = sre.groups()[0]
         try:
             _, find, replace, flags = cmdLine.split(separator, 3)
         except ValueError:
-            return (lines, u'''Separator punctuation missing, there should be'''
+            return (None, u'''Separator punctuation missing, there should be'''
                     u''' three '%s'.''' % (separator,))
-        data = self.view.host.textBuffer.doLinesToData(lines)
-        output = self.view.host.textBuffer.findReplaceText(
-            find, replace, flags, data)
-        lines = self.view.host.textBuffer.doDataToLines(output)
-        return lines, u'Changed %d lines' % (len(lines),)
+        tb = self.view.host.textBuffer
+
+        def substitute(rows, start):
+            return tb.doDataToLines(
+                tb.findReplaceText(find, replace, flags,
+                                   tb.doLinesToData(rows)))
+
+        # A match can't span two steps of the filter, so a pattern that may
+        # match across rows is done in one step.
+        chunkRows = app.line_filter.kStepRows
+        if u's' in flags or kReMultiRowPattern.search(find):
+            chunkRows = None
+        return app.line_filter.LineFilter(lines, substitute, chunkRows), u''
 
     def upperSelectedLines(self, cmdLine, lines):
-        lines = [line.upper() for line in lines]
-        return lines, u'Changed %d lines' % (len(lines),)
+        return app.line_filter.LineFilter(
+            lines, lambda rows, start: [line.upper() for line in rows]), u''
 
     def unknownCommand(self, cmdLine, view):
         self.view.host.textBuffer.setMessage(u'Unknown command')
@@ -322,5 +434,7 @@ class InteractivePrompt(app.controller.Controller):
         width = 80 if len(tokens) == 1 else int(tokens[1])
         indent = len(lines[0]) - len(lines[0].lstrip())
         width -= indent
-        lines = app.curses_util.wrapLines(lines, u" " * indent, width)
-        return lines, u'Changed %d lines' % (len(lines),)
+        # The words of all of the lines are wrapped together, in one step.
+        return app.line_filter.LineFilter(
+            lines, lambda rows, start: app.curses_util.wrapLines(
+                tuple(rows), u" " * indent, width), None), u''
@@ -0,0 +1,167 @@
+# Copyright 2019 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+  A recovery journal of the unsaved changes to a document, so that they
+  survive a crash or a dropped connection.
+
+  The journal is a file in the backups directory (see
+  CiProgram.makeHomeDirs()). It starts with a header naming the version of the
+  file on disk that the changes apply to, followed by the changes as records:
+    - (u'r', row, removedCount, lines): the |removedCount| rows at |row| are
+      replaced by |lines|.
+    - (u's', lines): all of the rows are replaced by |lines| (a snapshot,
+      written when the journal is compacted).
+  The records are appended as the document changes (see
+  Actions.journalFlush()) and replayed over the file when it's next opened
+  (see Actions.journalRecover()).
+"""
+
+# For Python 2to3 support.
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+import hashlib
+import io
+import os
+
+import app.log
+
+kJournalFormat = u'ci_edit journal 1'
+# Readable by both Python 2 and 3.
+kPickleProtocol = 2
+
+
+def replay(lines, records):
+    """Apply the journal |records| to |lines| (a list of unicode), in place.
+
+    Raises:
+        ValueError: if a record doesn't fit the lines.
+    """
+    for record in records:
+        if record[0] == u's':
+            lines[:] = record[1]
+            continue
+        _, row, removedCount, added = record
+        if row + removedCount > len(lines):
+            raise ValueError(u'journal record past the end of the document')
+        lines[row:row + removedCount] = added
+    if not lines:
+        raise ValueError(u'journal left no rows')
+
+
+class Journal:
+    """The recovery journal for the file at |path|, kept in |directory|."""
+
+    def __init__(self, directory, path):
+        self.path = path
+        self.journalPath = os.path.join(
+            directory,
+            hashlib.sha1(path.encode(u'utf-8')).hexdigest() + u'.journal')
+        # The Mutator savedVersion and changeVersion that the journal file
+        # reaches, or None while there is no journal file.
+        self.baseVersion = None
+        self.version = None
+        # The size of the journal file, and of its last snapshot.
+        self.size = 0
+        self.snapshotSize = 0
+
+    def append(self, records):
+        """Add |records| (see the module doc) to the end of the journal."""
+        with self.__open(self.journalPath, os.O_APPEND) as f:
+            for record in records:
+                pickle.dump(record, f, kPickleProtocol)
+            self.size = f.tell()
+
+    def __open(self, path, flags):
+        """Open the journal file at |path| for writing, creating it if need
+        be. The journal holds the document's text, so only the user may read
+        it."""
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | flags, 0o600)
+        return io.open(fd, 'ab' if flags & os.O_APPEND else 'wb')
+
+    def read(self):
+        """Read the journal file. A record cut short (by a crash while it was
+        written) ends the journal.
+
+        Returns:
+            A (base, records) tuple, or None if there is no journal.
+        """
+        try:
+            f = io.open(self.journalPath, 'rb')
+        except (IOError, OSError):
+            return None
+        records = []
+        with f:
+            try:
+                header = pickle.load(f)
+            except Exception as e:
+                app.log.info(u'unreadable journal', self.journalPath, e)
+                return None
+            if (type(header) is not tuple or len(header) != 3 or
+                    header[0] != kJournalFormat or header[1] != self.path):
+                return None
+            while True:
+                try:
+                    records.append(pickle.load(f))
+                except EOFError:
+                    break
+                except Exception as e:
+                    app.log.info(u'journal ends early', self.journalPath, e)
+                    break
+            self.size = f.tell()
+        return header[2], records
+
+    def remove(self):
+        """Delete the journal file (if any)."""
+        self.baseVersion = None
+        self.version = None
+        self.size = 0
+        try:
+            os.remove(self.journalPath)
+        except OSError:
+            pass
+
+    def setAside(self):
+        """Keep the journal file under another name, where it won't be
+        replayed or replaced.
+
+        Returns:
+            The new path of the journal file.
+        """
+        oldPath = self.journalPath + u'.old'
+        os.rename(self.journalPath, oldPath)
+        self.remove()
+        return oldPath
+
+    def start(self, base, lines=None):
+        """Begin a new journal, replacing any prior one.
+
+        Args:
+            base: Identifies the version of the file the changes apply to, to
+                be compared when the journal is read.
+            lines (list of unicode): A snapshot of the document, if any.
+        """
+        tempPath = self.journalPath + u'.tmp'
+        with self.__open(tempPath, os.O_TRUNC) as f:
+            pickle.dump((kJournalFormat, self.path, base), f, kPickleProtocol)
+            if lines is not None:
+                pickle.dump((u's', list(lines)), f, kPickleProtocol)
+            self.size = f.tell()
+        os.rename(tempPath, self.journalPath)
+        self.snapshotSize = self.size if lines is not None else 0
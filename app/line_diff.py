@@ -0,0 +1,233 @@
+# Copyright 2018 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+  Compute the difference between two lists of lines, in the line diff format
+  used by the 'ld' redoChain change. That is, a list of:
+    - int: the number of unchanged lines to keep.
+    - u'- <line>': a line that is removed.
+    - u'+ <line>': a line that is added.
+
+  The lines common to both lists are found with a patience diff (matching
+  lines that are unique in both lists), falling back to a Myers diff for small
+  regions with no unique lines. Unlike difflib.ndiff() there is no intraline
+  (fuzzy) matching, so this runs in roughly linear time for typical edits.
+"""
+
+# For Python 2to3 support.
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import bisect
+
+# Regions without unique common lines are compared with a Myers diff, unless
+# they differ by more than this many edits (then they're simply replaced).
+kMyersMaxEdits = 500
+
+
+class _LineDiff:
+
+    def __init__(self, a, b):
+        self.a = a
+        self.b = b
+        self.result = []
+
+    def equal(self, count):
+        if count:
+            if self.result and type(self.result[-1]) is int:
+                self.result[-1] += count
+            else:
+                self.result.append(count)
+
+    def replace(self, alo, ahi, blo, bhi):
+        self.result.extend([u'- ' + line for line in self.a[alo:ahi]])
+        self.result.extend([u'+ ' + line for line in self.b[blo:bhi]])
+
+    def diff(self):
+        a = self.a
+        b = self.b
+        # A stack of work to do, in reverse order. Each entry is either a
+        # region to compare (alo, ahi, blo, bhi) or a count of equal lines.
+        todo = [(0, len(a), 0, len(b))]
+        while todo:
+            item = todo.pop()
+            if type(item) is int:
+                self.equal(item)
+                continue
+            alo, ahi, blo, bhi = item
+            # Trim the common prefix and suffix.
+            while alo < ahi and blo < bhi and a[alo] == b[blo]:
+                alo += 1
+                blo += 1
+            self.equal(alo - item[0])
+            suffix = 0
+            while alo < ahi and blo < bhi and a[ahi - 1] == b[bhi - 1]:
+                ahi -= 1
+                bhi -= 1
+                suffix += 1
+            if suffix:
+                todo.append(suffix)
+            if alo == ahi or blo == bhi:
+                self.replace(alo, ahi, blo, bhi)
+                continue
+            anchors = self.uniqueAnchors(alo, ahi, blo, bhi)
+            if not anchors:
+                self.myers(alo, ahi, blo, bhi)
+                continue
+            # Compare the regions between the anchors (in order).
+            regions = []
+            for i, j in anchors:
+                regions.append((alo, i, blo, j))
+                regions.append(1)
+                alo = i + 1
+                blo = j + 1
+            regions.append((alo, ahi, blo, bhi))
+            regions.reverse()
+            todo.extend(regions)
+        return self.result
+
+    def uniqueAnchors(self, alo, ahi, blo, bhi):
+        """Find the longest (increasing) sequence of lines that occur exactly
+        once in each of the regions.
+
+        Returns:
+            A list of (a index, b index) tuples.
+        """
+        counts = {}
+        for i in range(alo, ahi):
+            line = self.a[i]
+            count = counts.get(line)
+            counts[line] = (i, None) if count is None else (None, None)
+        for j in range(blo, bhi):
+            line = self.b[j]
+            count = counts.get(line)
+            if count is not None and count[0] is not None:
+                counts[line] = (count[0], j) if count[1] is None else (None,
+                                                                        None)
+        pairs = [count for count in counts.values() if count[1] is not None]
+        if not pairs:
+            return pairs
+        pairs.sort()
+        # Patience sort to find the longest increasing subsequence of b
+        # indices.
+        tails = []
+        tailPairs = []
+        prior = {}
+        for pair in pairs:
+            pile = bisect.bisect_left(tails, pair[1])
+            if pile == len(tails):
+                tails.append(pair[1])
+                tailPairs.append(pair)
+            else:
+                tails[pile] = pair[1]
+                tailPairs[pile] = pair
+            prior[pair] = tailPairs[pile - 1] if pile else None
+        anchors = []
+        pair = tailPairs[-1]
+        while pair is not None:
+            anchors.append(pair)
+            pair = prior[pair]
+        anchors.reverse()
+        return anchors
+
+    def myers(self, alo, ahi, blo, bhi):
+        """Emit the shortest edit script for the regions (Myers' algorithm)."""
+        a = self.a
+        b = self.b
+        n = ahi - alo
+        m = bhi - blo
+        maxEdits = min(n + m, kMyersMaxEdits)
+        v = {1: 0}
+        trace = []
+        for d in range(maxEdits + 1):
+            trace.append(v.copy())
+            for k in range(-d, d + 1, 2):
+                if k == -d or (k != d and v[k - 1] < v[k + 1]):
+                    x = v[k + 1]
+                else:
+                    x = v[k - 1] + 1
+                y = x - k
+                while x < n and y < m and a[alo + x] == b[blo + y]:
+                    x += 1
+                    y += 1
+                v[k] = x
+                if x >= n and y >= m:
+                    self.myersResult(trace, alo, blo, n, m)
+                    return
+        # Too many differences to be worth the effort.
+        self.replace(alo, ahi, blo, bhi)
+
+    def myersResult(self, trace, alo, blo, x, y):
+        """Walk back through the |trace| of a Myers diff to build the edits."""
+        edits = []
+        for d in range(len(trace) - 1, -1, -1):
+            v = trace[d]
+            k = x - y
+            if k == -d or (k != d and v[k - 1] < v[k + 1]):
+                priorK = k + 1
+            else:
+                priorK = k - 1
+            priorX = v[priorK]
+            priorY = priorX - priorK
+            while x > priorX and y > priorY:
+                edits.append(1)
+                x -= 1
+                y -= 1
+            if d > 0:
+                if x == priorX:
+                    edits.append(u'+ ' + self.b[blo + priorY])
+                else:
+                    edits.append(u'- ' + self.a[alo + priorX])
+            x = priorX
+            y = priorY
+        edits.reverse()
+        for edit in edits:
+            if edit == 1:
+                self.equal(1)
+            else:
+                self.result.append(edit)
+
+
+def diffLines(a, b):
+    """Get a line diff (see module doc) that changes |a| into |b|.
+
+    Args:
+        a (list of unicode): The original lines.
+        b (list of unicode): The new lines.
+
+    Returns:
+        A list of ints and unicode strings.
+    """
+    return _LineDiff(a, b).diff()
+
+
+def mapRow(diff, row):
+    """Find where |row| of the original lines is after the line |diff| (see
+    diffLines()) is applied. A removed row maps to where its replacement (if
+    any) begins."""
+    oldRow = 0
+    newRow = 0
+    for entry in diff:
+        if type(entry) is int:
+            if row < oldRow + entry:
+                return newRow + row - oldRow
+            oldRow += entry
+            newRow += entry
+        elif entry[0] == u'-':
+            if row == oldRow:
+                return newRow
+            oldRow += 1
+        else:
+            newRow += 1
+    return newRow + row - oldRow
@@ -0,0 +1,149 @@
+# Copyright 2019 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+  Filters of the selected lines (see InteractivePrompt.filters), done a step
+  at a time so that filtering a huge selection can run in the background (see
+  Actions.filterMore()) with its progress shown, and be cancelled.
+
+  A sort sorts the rows in runs, a step per run, then merges the runs.
+"""
+
+# For Python 2to3 support.
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import heapq
+import itertools
+
+# Each step filters (or merges) about this many rows.
+kStepRows = 64 * 1024
+# A sort sorts this many rows at a time (one run per step).
+kSortRunRows = 256 * 1024
+
+
+class LineFilter:
+    """Filter |lines| with |function|(rows, start), which returns the output
+    rows for the input |rows| (the rows from index |start| of |lines|). The
+    function is given |chunkRows| rows at a time, or all of them at once if
+    |chunkRows| is None.
+    """
+
+    def __init__(self, lines, function, chunkRows=kStepRows):
+        self.lines = lines
+        self.output = []
+        self.isDone = False
+        self.__function = function
+        self.__chunkRows = chunkRows or max(1, len(lines))
+        # The number of input rows filtered.
+        self.__done = 0
+
+    def close(self):
+        """Release what the filter holds, e.g. once it's cancelled."""
+        self.isDone = True
+
+    def progress(self):
+        """The portion of the work that is done (0 to 1.0)."""
+        if not self.lines:
+            return 1.0
+        return self.__done / len(self.lines)
+
+    def run(self):
+        """Do all of the (remaining) work.
+
+        Returns:
+            The output rows.
+        """
+        while not self.step():
+            pass
+        return self.output
+
+    def step(self):
+        """Do a slice of the work.
+
+        Returns:
+            True once the output is complete.
+        """
+        if not self.isDone:
+            start = self.__done
+            self.output.extend(
+                self.__function(self.lines[start:start + self.__chunkRows],
+                                start))
+            self.__done = min(start + self.__chunkRows, len(self.lines))
+            self.isDone = self.__done >= len(self.lines)
+        return self.isDone
+
+
+class SortFilter:
+    """Sort |lines| (by |key|(line), if |key| is not None). The sort is stable.
+    It has the interface of LineFilter.
+    """
+
+    def __init__(self, lines, key=None, runRows=kSortRunRows):
+        self.lines = lines
+        self.output = []
+        self.isDone = False
+        self.__key = key
+        self.__runRows = runRows
+        # The sorted runs, lists of rows (or of (key, index, row) tuples).
+        self.__runs = []
+        # The number of input rows sorted into runs.
+        self.__sorted = 0
+        self.__merged = None
+
+    def close(self):
+        self.isDone = True
+        self.__runs = []
+        self.__merged = None
+
+    def progress(self):
+        if not self.lines:
+            return 1.0
+        return (self.__sorted + len(self.output)) / (2 * len(self.lines))
+
+    def run(self):
+        while not self.step():
+            pass
+        return self.output
+
+    def step(self):
+        if self.isDone:
+            return True
+        if self.__sorted < len(self.lines):
+            self.__sortRun()
+            return False
+        if self.__merged is None:
+            self.__merged = heapq.merge(*self.__runs)
+        if self.__key is None:
+            self.output.extend(itertools.islice(self.__merged, kStepRows))
+        else:
+            self.output.extend(
+                i[2] for i in itertools.islice(self.__merged, kStepRows))
+        if len(self.output) >= len(self.lines):
+            self.close()
+        return self.isDone
+
+    def __sortRun(self):
+        start = self.__sorted
+        rows = self.lines[start:start + self.__runRows]
+        if self.__key is None:
+            run = sorted(rows)
+        else:
+            # The index keeps the sort stable (and rows with equal keys are
+            # never compared).
+            key = self.__key
+            run = sorted((key(row), start + i, row)
+                         for i, row in enumerate(rows))
+        self.__sorted = start + len(rows)
+        self.__runs.append(run)
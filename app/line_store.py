@@ -0,0 +1,1219 @@
+# Copyright 2018 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+  Reading and writing a file as the lines of a document, and alternatives to a
+  list of unicode strings for holding the lines of documents too large to keep
+  in memory that way.
+"""
+
+# For Python 2to3 support.
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+try:
+    unicode
+except NameError:
+    unicode = str
+    unichr = chr
+
+import array
+import binascii
+import bisect
+import codecs
+import collections
+import hashlib
+import io
+import locale
+import mmap
+import os
+import re
+import select
+import stat
+import tempfile
+import time
+
+import app.log
+
+# The line index records the offset of every |kBlockRows|th row.
+kBlockRows = 64
+# Index at most this many bytes in one call to MappedLines.indexMore().
+kIndexChunkSize = 16 * 1024 * 1024
+# The number of decoded blocks (of kBlockRows rows) kept in memory.
+kCachedBlocks = 64
+
+# rewriteFile() reads the start of the file (to hash it) this much at a time.
+kRewriteReadSize = 16 * 1024 * 1024
+# Encodings where a row encodes the same alone as within the file (there are
+# no byte order marks or shift states), so that a file may be rewritten from
+# the start of a row (see rewriteFile()).
+kRowSafeEncodings = (u'ascii', u'iso8859-1', u'utf-8')
+# rowStartOffset() searches back through the file this much at a time.
+kRowSearchSize = 64 * 1024
+
+# The encoding of a file is judged from this many bytes at its start (see
+# sniffEncoding()).
+kSniffSize = 64 * 1024
+# A sample with more than this portion of NUL bytes is binary (unless it
+# starts with a UTF-16 or UTF-32 byte order mark).
+kSniffMaxNulRatio = 0.01
+# Byte order marks, and the encodings that decode the rest of the file. The
+# mark itself is decoded as u'\ufeff' and kept in the first row, so saving
+# writes it back. UTF-32 is first, its little endian mark starts with the
+# UTF-16 one.
+kByteOrderMarks = (
+    (codecs.BOM_UTF32_LE, u'utf-32-le'),
+    (codecs.BOM_UTF32_BE, u'utf-32-be'),
+    (codecs.BOM_UTF16_LE, u'utf-16-le'),
+    (codecs.BOM_UTF16_BE, u'utf-16-be'),
+)
+
+# The number of bytes on each row of a HexLines.
+kHexRowBytes = 16
+# Rows of a HexLines as they're formatted from the file.
+kReHexRow = re.compile(u'[0-9a-f]{%d}$' % (2 * kHexRowBytes,))
+kReHexLastRow = re.compile(u'(?:[0-9a-f]{2}){1,%d}$' % (kHexRowBytes,))
+# For str.translate(), to remove the white space from hex rows.
+kRemoveWhiteSpace = {
+    ord(u' '): None,
+    ord(u'\n'): None,
+    ord(u'\r'): None,
+    ord(u'\t'): None,
+}
+
+kReBlock = re.compile(b'(?:[^\n]*\n){%d}' % (kBlockRows,))
+kReControlCharacter = re.compile(u'([\0-\x09\x0b-\x1f])')
+# The control characters other than tab, for rows that keep their tabs.
+kReControlCharacterNotTab = re.compile(u'([\0-\x08\x0b-\x1f])')
+kReEscapedControlCharacter = re.compile(u'\x01([0-9a-fA-F][0-9a-fA-F])')
+
+
+def escapeControlCharacter(found):
+    return u"\x01%02x" % ord(found.groups()[0])
+
+
+def unescapeControlCharacter(found):
+    return unichr(int(found.groups()[0], 16))
+
+
+def unescapeControlCharacters(text):
+    """Undo the escaping of control characters done by textToLines()."""
+    if u'\x01' not in text:
+        # Skip the (comparatively slow) regex when there's nothing to do.
+        return text
+    return kReEscapedControlCharacter.sub(unescapeControlCharacter, text)
+
+
+def isRowSafeEncoding(encoding):
+    """Whether |encoding| is one of kRowSafeEncodings."""
+    try:
+        return codecs.lookup(encoding).name in kRowSafeEncodings
+    except LookupError:
+        return False
+
+
+def sniffEncoding(path, default=None):
+    """Judge the encoding of the file at |path| from a sample of its start
+    (kSniffSize bytes): a byte order mark, else the density of NUL bytes, else
+    whether the sample decodes as UTF-8 (or as |default|, which is the
+    locale's encoding if None).
+
+    Returns:
+        The name of the encoding, or None if the file looks binary.
+    """
+    with io.open(path, 'rb') as f:
+        data = f.read(kSniffSize)
+    for mark, encoding in kByteOrderMarks:
+        if data.startswith(mark):
+            return encoding
+    if data.count(b'\0') > len(data) * kSniffMaxNulRatio:
+        return None
+    # A short sample is the whole file, otherwise it may end part way through
+    # a character.
+    isFinal = len(data) < kSniffSize
+    default = default or locale.getpreferredencoding(False)
+    for encoding in (u'utf-8', default):
+        try:
+            codecs.getincrementaldecoder(encoding)().decode(data, isFinal)
+        except (LookupError, UnicodeDecodeError):
+            continue
+        return encoding
+    return None
+
+
+def textToLines(text, tabSize):
+    """Split |text| into rows, as they're held in TextBuffer.lines: any of
+    '\r\n', '\r', or '\n' ends a row, tabs are expanded (or kept, if |tabSize|
+    is None), and other control characters are escaped (as '\x01' and two hex
+    digits)."""
+    # Performance: it's faster to do some simple .replace() calls than to
+    # handle the line endings in the regex.
+    text = text.replace(u'\r\n', u'\n').replace(u'\r', u'\n')
+    if tabSize is None:
+        reControl = kReControlCharacterNotTab
+    else:
+        text = text.expandtabs(tabSize)
+        reControl = kReControlCharacter
+    if reControl.search(text) is not None:
+        text = reControl.sub(escapeControlCharacter, text)
+    return text.split(u'\n')
+
+
+class LineReader:
+    """Reads a text file as rows (see textToLines()) a chunk at a time. Each
+    chunk is hashed, decoded, and split into rows as it's read, so the file is
+    read once and the whole text is never held in memory. The tabs are
+    expanded to |tabSize| columns, or kept if it's None.
+
+    The checksum is of the file's bytes, as app.history.getFileInfo() computes
+    it.
+
+    |rowOffsets| is a list of (row, byte offset) pairs, recording where some
+    of the rows start in the file (see rewriteFile()). It's None if saving the
+    rows would not reproduce the file, e.g. if it has expanded tabs or '\r\n'
+    line endings.
+
+    |path| may also be the file descriptor of a pipe (or other stream), which
+    the reader takes ownership of. Each read() then returns the rows that
+    have arrived so far (see |isStream|).
+
+    Reading may start at the byte |offset| of a file, which should be the
+    start of a row (see rowStartOffset()). Nothing is hashed then and there
+    are no |rowOffsets|. With |follow| the end of the file is not the end of
+    the input: read() returns the rows appended to the file since the prior
+    read(), like 'tail -f'.
+
+    With |errors| u'replace', bytes that can't be decoded are read as
+    u'\ufffd' (and |hasDecodeErrors| is set) rather than raising a
+    UnicodeDecodeError.
+    """
+
+    def __init__(self, path, encoding=None, tabSize=8, offset=0, follow=False,
+                 errors=u'strict'):
+        self.encoding = encoding or locale.getpreferredencoding(False)
+        self.errors = errors
+        self.hasDecodeErrors = False
+        self.tabSize = tabSize
+        self.path = path
+        self.offset = offset
+        self.follow = follow
+        self.isDone = False
+        self.bytesRead = 0
+        self.__decoder = codecs.getincrementaldecoder(self.encoding)()
+        self.__hasher = None if offset else hashlib.sha512()
+        # The text after the last complete row. A '\r' at the end of a chunk
+        # is held here too, in case the next chunk starts with '\n'.
+        self.__tail = u''
+        # The '\r' of a '\r\n' pair was just before |offset|, so a leading
+        # '\n' does not start another row.
+        self.__skipNewLine = False
+        # The number of complete rows read.
+        self.__rows = 0
+        self.rowOffsets = ([(0, 0)] if not offset and
+                           isRowSafeEncoding(self.encoding) else None)
+        # Unbuffered, so that a read from a pipe returns whatever is available
+        # rather than waiting to fill the buffer.
+        self.__file = io.open(path, 'rb', buffering=0)
+        if offset:
+            self.__file.seek(offset - 1)
+            self.__skipNewLine = self.__file.read(1) == b'\r'
+        fileStat = os.fstat(self.__file.fileno())
+        # The input is not a regular file, so its size is not known.
+        self.isStream = not stat.S_ISREG(fileStat.st_mode)
+        self.size = fileStat.st_size
+
+    def checksum(self):
+        """The checksum of the bytes read, or None if the file is empty (or
+        wasn't read from the start)."""
+        if not self.bytesRead or self.__hasher is None:
+            return None
+        return self.__hasher.hexdigest()
+
+    def close(self):
+        if self.__file is not None:
+            self.__file.close()
+            self.__file = None
+
+    def isReplaced(self):
+        """Whether the file at |path| has been truncated, or replaced by
+        another file (e.g. by log rotation), since it was opened."""
+        try:
+            pathStat = os.stat(self.path)
+        except OSError:
+            # It may be in the midst of being replaced, so keep reading the
+            # open file for now.
+            return False
+        fileStat = self.stat()
+        return ((pathStat.st_dev, pathStat.st_ino) !=
+                (fileStat.st_dev, fileStat.st_ino) or
+                fileStat.st_size < self.offset + self.bytesRead)
+
+    def progress(self):
+        """The portion of the file that has been read (0 to 1.0), or None for
+        a stream."""
+        if self.isStream:
+            return None
+        if not self.size:
+            return 0.0
+        return min(self.bytesRead / self.size, 1.0)
+
+    def read(self, size=-1, wait=None):
+        """Read up to |size| more bytes of the file (all of it if |size| is
+        negative). isDone is set once the end of the file is reached.
+
+        For a stream (or a followed file), a read of |size| returns as soon as
+        there is some data. If |wait| is not None, it returns after at most
+        |wait| seconds, even if no data has arrived.
+
+        Returns:
+            A list of rows. The first replaces the last row returned by the
+            prior read(), which may have been partial. The list is empty if
+            no data arrived.
+        """
+        if (self.isStream and size >= 0 and wait is not None and
+                not select.select([self.__file], [], [], wait)[0]):
+            return []
+        data = self.__file.read(size)
+        if not data and self.follow and size >= 0 and not self.isStream:
+            # The end of the file, for now.
+            if wait:
+                time.sleep(wait)
+            return []
+        isFinal = size < 0 or not data
+        if self.__hasher is not None:
+            self.__hasher.update(data)
+        self.bytesRead += len(data)
+        try:
+            text = self.__tail + self.__decoder.decode(data, isFinal)
+        except UnicodeDecodeError:
+            if self.errors == u'strict':
+                raise
+            # The decoder keeps its state when it raises, so decode again.
+            self.__decoder.errors = self.errors
+            text = self.__tail + self.__decoder.decode(data, isFinal)
+            self.hasDecodeErrors = True
+            # The rows no longer encode to the bytes of the file.
+            self.rowOffsets = None
+        if self.__skipNewLine and text:
+            self.__skipNewLine = False
+            if text.startswith(u'\n'):
+                text = text[1:]
+        if self.rowOffsets is not None and (
+                u'\r' in text or self.tabSize is not None and u'\t' in text):
+            self.rowOffsets = None
+        if isFinal:
+            self.isDone = True
+            self.__tail = u''
+            return textToLines(text, self.tabSize)
+        end = len(text) - 1 if text.endswith(u'\r') else len(text)
+        cut = max(text.rfind(u'\n', 0, end), text.rfind(u'\r', 0, end)) + 1
+        self.__tail = text[cut:]
+        rows = textToLines(text[:cut], self.tabSize)
+        rows[-1] = textToLines(text[cut:end], self.tabSize)[0]
+        self.__rows += len(rows) - 1
+        if self.rowOffsets is not None and self.__rows > self.rowOffsets[-1][0]:
+            # The bytes of the partial row (decoded or not) aren't included.
+            pending = self.__decoder.getstate()[0]
+            self.rowOffsets.append((self.__rows, self.bytesRead - len(pending) -
+                                    len(self.__tail.encode(self.encoding))))
+        return rows
+
+    def stat(self):
+        """os.fstat() of the open file."""
+        return os.fstat(self.__file.fileno())
+
+
+def rowStartOffset(path, offset):
+    """Find where the row that ends at the byte |offset| of the file at |path|
+    starts, i.e. just after the prior '\n' or '\r'. The file's encoding should
+    be one of kRowSafeEncodings."""
+    with io.open(path, 'rb') as f:
+        end = offset
+        while end > 0:
+            start = max(0, end - kRowSearchSize)
+            f.seek(start)
+            data = f.read(end - start)
+            found = max(data.rfind(b'\n'), data.rfind(b'\r'))
+            if found >= 0:
+                return start + found + 1
+            end = start
+    return 0
+
+
+def writeFile(path, chunks, sync=u'file'):
+    """Write the byte strings from |chunks| to the file at |path|. The file is
+    replaced atomically: the chunks are written to a temporary file which is
+    renamed over the original once complete, so a failed save leaves the
+    original intact. The chunks are hashed as they're written.
+
+    If |path| is a symbolic link, the file it links to is replaced. A file with
+    other hard links, or in a directory that can't be written, is rewritten in
+    place instead.
+
+    Args:
+      path (unicode): The file to write.
+      chunks (iterable of bytes): The file data.
+      sync (unicode): u'none' to leave flushing to the OS, u'file' to fsync the
+        file, or u'all' to also fsync the directory (making the rename
+        durable).
+
+    Returns:
+      (checksum, size) of the file, as app.history.getFileInfo() computes them.
+    """
+    path = os.path.realpath(path)
+    directory = os.path.dirname(path)
+    try:
+        fileStat = os.stat(path)
+    except OSError:
+        fileStat = None
+    tempPath = None
+    if fileStat is None or fileStat.st_nlink == 1:
+        try:
+            fd, tempPath = tempfile.mkstemp(
+                prefix=u'.%s.' % (os.path.basename(path),), suffix=u'.tmp',
+                dir=directory)
+        except (IOError, OSError):
+            tempPath = None
+    if tempPath is None:
+        outputFile = io.open(path, 'wb')
+    else:
+        outputFile = io.open(fd, 'wb')
+    hasher = hashlib.sha512()
+    size = 0
+    try:
+        with outputFile:
+            for chunk in chunks:
+                hasher.update(chunk)
+                size += len(chunk)
+                outputFile.write(chunk)
+            if sync != u'none':
+                outputFile.flush()
+                os.fsync(outputFile.fileno())
+        if tempPath is not None:
+            if fileStat is not None:
+                os.chmod(tempPath, stat.S_IMODE(fileStat.st_mode))
+                try:
+                    os.chown(tempPath, fileStat.st_uid, fileStat.st_gid)
+                except (AttributeError, OSError):
+                    pass
+            else:
+                # mkstemp() makes a private file, use the usual mode instead.
+                umask = os.umask(0)
+                os.umask(umask)
+                os.chmod(tempPath, 0o666 & ~umask)
+            getattr(os, 'replace', os.rename)(tempPath, path)
+            tempPath = None
+            if sync == u'all' and hasattr(os, 'O_DIRECTORY'):
+                directoryFd = os.open(directory, os.O_RDONLY | os.O_DIRECTORY)
+                try:
+                    os.fsync(directoryFd)
+                finally:
+                    os.close(directoryFd)
+    finally:
+        if tempPath is not None:
+            os.remove(tempPath)
+    return (hasher.hexdigest() if size else None, size)
+
+
+def patchFile(path, patches, sync=u'file', checksum=True):
+    """Write each (offset, bytes) of |patches| into the file at |path| in
+    place, so that only the changed pages are written. Like rewriteFile(), a
+    failed save may leave the file partly written.
+
+    Args:
+      path (unicode): The file to write.
+      patches (list): (offset, bytes) tuples.
+      sync (unicode): See writeFile().
+      checksum (bool): Whether to compute the checksum, which means reading
+        the whole file.
+
+    Returns:
+      (checksum, size) of the file, as app.history.getFileInfo() computes them
+      (the checksum is None if not |checksum|).
+    """
+    with io.open(path, 'r+b') as outputFile:
+        for offset, data in patches:
+            outputFile.seek(offset)
+            outputFile.write(data)
+        if sync != u'none':
+            outputFile.flush()
+            os.fsync(outputFile.fileno())
+        size = os.fstat(outputFile.fileno()).st_size
+        if not checksum or not size:
+            return (None, size)
+        hasher = hashlib.sha512()
+        outputFile.seek(0)
+        for data in iter(lambda: outputFile.read(kRewriteReadSize), b''):
+            hasher.update(data)
+    return (hasher.hexdigest(), size)
+
+
+def rewriteFile(path, offset, chunks, sync=u'file', checksum=True):
+    """Replace the file at |path| from byte |offset| on with the byte strings
+    from |chunks|, keeping the start of the file. Unlike writeFile(), the file
+    is changed in place, so a failed save may leave it partly written.
+
+    Args:
+      path (unicode): The file to write.
+      offset (int): Where to start writing.
+      chunks (iterable of bytes): The new file data, from |offset| on.
+      sync (unicode): See writeFile().
+      checksum (bool): Whether to compute the checksum, which means reading
+        the start of the file.
+
+    Returns:
+      (checksum, size) of the file, as app.history.getFileInfo() computes them
+      (the checksum is None if not |checksum|).
+    """
+    hasher = hashlib.sha512() if checksum else None
+    size = offset
+    with io.open(path, 'r+b') as outputFile:
+        if hasher is not None:
+            while outputFile.tell() < offset:
+                data = outputFile.read(
+                    min(offset - outputFile.tell(), kRewriteReadSize))
+                if not data:
+                    raise IOError(u'The file is shorter than expected')
+                hasher.update(data)
+        outputFile.seek(offset)
+        for chunk in chunks:
+            if hasher is not None:
+                hasher.update(chunk)
+            size += len(chunk)
+            outputFile.write(chunk)
+        outputFile.truncate()
+        if sync != u'none':
+            outputFile.flush()
+            os.fsync(outputFile.fileno())
+    if hasher is None or not size:
+        return (None, size)
+    return (hasher.hexdigest(), size)
+
+
+class MappedLines:
+    """A read only sequence of the lines of a file, which is mapped into memory
+    (mmap) rather than read. Only the rows that are accessed are decoded.
+
+    The rows are found by an index of line offsets that is built a chunk at a
+    time by indexMore(), so len() is the number of rows found so far until
+    isComplete(). The finished index is kept in |indexDir| and reused if the
+    file is opened again unchanged.
+
+    Unlike Actions.doDataToLines(), a lone '\r' does not end a line (it's shown
+    as a control character).
+
+    The rows are found by their b'\n' bytes, so the |encoding| must be one of
+    kRowSafeEncodings. Bytes that can't be decoded are shown as u'\ufffd' and
+    |hasDecodeErrors| is set.
+    """
+
+    def __init__(self, path, encoding=u'utf-8', tabSize=8, indexDir=None):
+        self.encoding = encoding or u'utf-8'
+        if not isRowSafeEncoding(self.encoding):
+            raise ValueError(u'rows of %s can not be mapped' % (self.encoding,))
+        self.tabSize = tabSize
+        self.hasDecodeErrors = False
+        self.__file = io.open(path, 'rb')
+        stat = os.fstat(self.__file.fileno())
+        self.__size = stat.st_size
+        self.__map = None
+        if self.__size:
+            self.__map = mmap.mmap(
+                self.__file.fileno(), 0, access=mmap.ACCESS_READ)
+        # Identify the index for this version of the file.
+        self.__indexKey = (self.__size, int(stat.st_mtime * 1000000),
+                           kBlockRows)
+        self.__indexPath = None
+        if indexDir is not None:
+            pathHash = hashlib.sha1(os.path.abspath(path).encode(u'utf-8'))
+            self.__indexPath = os.path.join(indexDir, pathHash.hexdigest())
+        # The offset of the first row of each block. The last entry begins a
+        # block that may not be complete.
+        self.__blocks = array.array('l', [0])
+        # Once the index is complete, the number of rows in the last block.
+        self.__tailRows = None
+        self.__cache = collections.OrderedDict()
+        if not self.__loadIndex():
+            self.indexMore(kBlockRows)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(u'row out of range')
+        block = index // kBlockRows
+        return self.__blockLines(block)[index - block * kBlockRows]
+
+    def __iter__(self):
+        row = 0
+        while row < len(self):
+            yield self[row]
+            row += 1
+
+    def __len__(self):
+        full = (len(self.__blocks) - 1) * kBlockRows
+        if self.__tailRows is None:
+            return full
+        return full + self.__tailRows
+
+    def __blockLines(self, block):
+        lines = self.__cache.pop(block, None)
+        if lines is not None:
+            # Most recently used.
+            self.__cache[block] = lines
+            return lines
+        begin = self.__blocks[block]
+        if block + 1 < len(self.__blocks):
+            # Leave off the final new line of the block.
+            end = self.__blocks[block + 1] - 1
+        else:
+            end = self.__size
+        data = self.__map[begin:end] if self.__map is not None else b''
+        try:
+            data = data.decode(self.encoding)
+        except UnicodeDecodeError:
+            data = data.decode(self.encoding, u'replace')
+            self.hasDecodeErrors = True
+        data = data.replace(u'\r\n', u'\n')
+        if self.tabSize is None:
+            data = kReControlCharacterNotTab.sub(escapeControlCharacter, data)
+        else:
+            data = kReControlCharacter.sub(escapeControlCharacter,
+                                           data.expandtabs(self.tabSize))
+        lines = data.split(u'\n')
+        self.__cache[block] = lines
+        if len(self.__cache) > kCachedBlocks:
+            self.__cache.popitem(last=False)
+        return lines
+
+    def close(self):
+        if self.__map is not None:
+            self.__map.close()
+            self.__map = None
+        self.__file.close()
+
+    def indexMore(self, rowLimit=None):
+        """Extend the line index by about kIndexChunkSize bytes or, if
+        |rowLimit| is given, until (at least) |rowLimit| rows are known.
+
+        Returns:
+            True if the index is complete.
+        """
+        if self.__tailRows is not None:
+            return True
+        blocks = self.__blocks
+        offset = blocks[-1]
+        limit = offset + kIndexChunkSize
+        match = kReBlock.match
+        while (offset < limit) if rowLimit is None else (len(self) < rowLimit):
+            found = self.__map is not None and match(self.__map, offset)
+            if not found:
+                # Fewer than kBlockRows rows remain.
+                self.__tailRows = 1
+                if self.__map is not None:
+                    offset = self.__map.find(b'\n', offset)
+                    while offset >= 0:
+                        self.__tailRows += 1
+                        offset = self.__map.find(b'\n', offset + 1)
+                self.__saveIndex()
+                return True
+            offset = found.end()
+            blocks.append(offset)
+        return False
+
+    def isComplete(self):
+        return self.__tailRows is not None
+
+    def progress(self):
+        """The portion of the file that has been indexed, from 0 to 1.0."""
+        if self.__tailRows is not None or not self.__size:
+            return 1.0
+        return self.__blocks[-1] / self.__size
+
+    def __loadIndex(self):
+        if self.__indexPath is None or not os.path.isfile(self.__indexPath):
+            return False
+        # The file holds the index key, the tailRows, then the blocks.
+        blocks = array.array('l')
+        try:
+            with io.open(self.__indexPath, 'rb') as indexFile:
+                data = indexFile.read()
+            if hasattr(blocks, 'frombytes'):
+                blocks.frombytes(data)
+            else:
+                blocks.fromstring(data)
+        except (IOError, OSError, ValueError) as e:
+            app.log.info(u'line index not loaded', e)
+            return False
+        header = blocks[:4]
+        blocks = blocks[4:]
+        if tuple(header[:3]) != self.__indexKey or not blocks or blocks[0]:
+            return False
+        self.__blocks = blocks
+        self.__tailRows = header[3]
+        return True
+
+    def __saveIndex(self):
+        if self.__indexPath is None or len(self.__blocks) == 1:
+            # Small files are quick to index again.
+            return
+        try:
+            indexDir = os.path.dirname(self.__indexPath)
+            if not os.path.isdir(indexDir):
+                os.makedirs(indexDir)
+            index = array.array('l', self.__indexKey + (self.__tailRows,))
+            index.extend(self.__blocks)
+            with io.open(self.__indexPath, 'wb') as indexFile:
+                if hasattr(index, 'tobytes'):
+                    indexFile.write(index.tobytes())
+                else:
+                    indexFile.write(index.tostring())
+        except (IOError, OSError) as e:
+            app.log.info(u'line index not saved', e)
+
+
+def packRows(rows):
+    """Pack a list of |rows| (unicode strings) into a (UTF-8 data, row offset
+    array) tuple. Row i is data[offsets[i]:offsets[i + 1] - 1]."""
+    text = u'\n'.join(rows)
+    data = text.encode(u'utf-8')
+    if len(data) == len(text):
+        sizes = map(len, rows)
+    else:
+        sizes = (len(row.encode(u'utf-8')) for row in rows)
+    offsets = array.array('I', [0])
+    offset = 0
+    for size in sizes:
+        offset += size + 1
+        offsets.append(offset)
+    return (data, offsets)
+
+
+class PackedLines:
+    """A list of unicode lines that holds most rows compactly.
+
+    Rows are stored in blocks of about kBlockRows rows. A block is either
+    packed, as UTF-8 data with an array of row offsets, or (once it has been
+    changed) a plain list of unicode strings. A packed row is decoded each time
+    it's read. A changed block is packed again once it grows to
+    2 * kBlockRows rows.
+
+    The row counts of the blocks are summed in a Fenwick tree, so finding the
+    block that holds a row, or changing the row count of a block, is
+    O(log blocks). Removing rows leaves their blocks in place (perhaps empty).
+    Only adding blocks, e.g. as a changed block is packed again, sums the row
+    counts again (and drops the empty blocks), which is O(blocks) once per
+    kBlockRows or so rows added.
+
+    This supports the parts of the list interface that the Mutator and Actions
+    use on |lines|: indexing and slicing, item and slice assignment, del,
+    insert(), len(), iteration, and comparison.
+
+    Only the lines are compact. The parser still holds the whole text and a
+    node per row, so these take much of the memory of a large document.
+    """
+
+    def __init__(self, lines=()):
+        # Each block is a list or a (data, offsets) tuple. |__sizes| holds
+        # the row count of each block, and |__tree| the sums of the row counts
+        # (see __find()).
+        self.__blocks = []
+        self.__sizes = []
+        self.__tree = []
+        # The largest power of two that is at most the number of blocks.
+        self.__step = 0
+        # The (block, first row, end row) last found by __find(), as rows are
+        # often read in order.
+        self.__found = (0, 0, 0)
+        self.__count = 0
+        self.__replace(0, 0, lines)
+
+    def __copy__(self):
+        other = PackedLines()
+        other.__blocks = [
+            list(block) if type(block) is list else block
+            for block in self.__blocks
+        ]
+        other.__sizes = list(self.__sizes)
+        other.__tree = list(self.__tree)
+        other.__step = self.__step
+        other.__found = self.__found
+        other.__count = self.__count
+        return other
+
+    def __delitem__(self, index):
+        start, stop = self.__range(index)
+        self.__replace(start, stop, ())
+
+    def __eq__(self, other):
+        if not isinstance(other, (list, PackedLines)):
+            return NotImplemented
+        return len(self) == len(other) and list(self) == list(other)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(self.__count)
+            if step != 1:
+                return list(self)[index]
+            return self.__rows(start, stop)
+        if index < 0:
+            index += self.__count
+        if not 0 <= index < self.__count:
+            raise IndexError(u'row out of range')
+        b, i = self.__find(index)
+        block = self.__blocks[b]
+        if type(block) is list:
+            return block[i]
+        data, offsets = block
+        return data[offsets[i]:offsets[i + 1] - 1].decode(u'utf-8')
+
+    def __iter__(self):
+        for block in self.__blocks:
+            if type(block) is list:
+                for row in block:
+                    yield row
+            else:
+                for row in block[0].decode(u'utf-8').split(u'\n'):
+                    yield row
+
+    def __len__(self):
+        return self.__count
+
+    def __ne__(self, other):
+        result = self.__eq__(other)
+        return result if result is NotImplemented else not result
+
+    def __repr__(self):
+        return u'<PackedLines %d rows in %d blocks>' % (self.__count,
+                                                        len(self.__blocks))
+
+    def __setitem__(self, index, value):
+        if isinstance(index, slice):
+            start, stop = self.__range(index)
+            self.__replace(start, stop, value)
+            return
+        if index < 0:
+            index += self.__count
+        if not 0 <= index < self.__count:
+            raise IndexError(u'row out of range')
+        b, i = self.__find(index)
+        self.__blockRows(b)[i] = value
+
+    def __blockRows(self, b):
+        """Get block |b| as a list, unpacking it if need be."""
+        block = self.__blocks[b]
+        if type(block) is not list:
+            block = block[0].decode(u'utf-8').split(u'\n')
+            self.__blocks[b] = block
+        return block
+
+    def __find(self, index):
+        """Find the block that holds row |index| (which is less than len()).
+
+        Returns:
+            A (block, index of the row within the block) tuple.
+        """
+        b, begin, end = self.__found
+        if begin <= index < end:
+            return b, index - begin
+        # |__tree[i]| is the sum of the row counts of the blocks from
+        # (i & (i + 1)) up to i, so the blocks before the row are found a
+        # power of two at a time.
+        tree = self.__tree
+        b = 0
+        i = index
+        step = self.__step
+        while step:
+            if b + step <= len(tree) and tree[b + step - 1] <= i:
+                b += step
+                i -= tree[b - 1]
+            step >>= 1
+        self.__found = (b, index - i, index - i + self.__sizes[b])
+        return b, i
+
+    def __range(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(self.__count)
+            if step != 1:
+                raise ValueError(u'PackedLines slices must be contiguous')
+            return start, max(start, stop)
+        if index < 0:
+            index += self.__count
+        if not 0 <= index < self.__count:
+            raise IndexError(u'row out of range')
+        return index, index + 1
+
+    def __rebuild(self):
+        """Drop the empty blocks and sum the row counts (see __find())."""
+        blocks = self.__blocks
+        sizes = self.__sizes
+        if 0 in sizes:
+            blocks[:] = [block for block, size in zip(blocks, sizes) if size]
+            sizes[:] = [size for size in sizes if size]
+        tree = list(sizes)
+        for i in range(len(tree)):
+            parent = i | (i + 1)
+            if parent < len(tree):
+                tree[parent] += tree[i]
+        self.__tree = tree
+        self.__step = 1 if tree else 0
+        while self.__step * 2 <= len(tree):
+            self.__step *= 2
+        self.__count = sum(sizes)
+
+    def __replace(self, start, stop, rows):
+        """Replace the rows from |start| up to |stop| with |rows|. Blocks that
+        are entirely replaced are not unpacked."""
+        if self.__count:
+            # The row just before |start| finds the last block for an append.
+            first, offset = self.__find(min(start, self.__count - 1))
+            offset += max(start - self.__count + 1, 0)
+            head = self.__blockRows(first)[:offset]
+            row = max(stop - 1, start)
+            last, offset = self.__find(min(row, self.__count - 1))
+            offset += max(row - self.__count + 1, 0)
+            tail = self.__blockRows(last)[offset + stop - row:]
+        else:
+            first = 0
+            last = len(self.__blocks) - 1
+            head = []
+            tail = []
+        rows = head + list(rows) + tail
+        if len(rows) < 2 * kBlockRows:
+            newBlocks = [rows] if rows else []
+        else:
+            newBlocks = [
+                packRows(rows[i:i + kBlockRows])
+                for i in range(0, len(rows), kBlockRows)
+            ]
+        sizes = [
+            len(block) if type(block) is list else len(block[1]) - 1
+            for block in newBlocks
+        ]
+        # The rows that were found have moved.
+        self.__found = (0, 0, 0)
+        if len(newBlocks) > last + 1 - first:
+            self.__blocks[first:last + 1] = newBlocks
+            self.__sizes[first:last + 1] = sizes
+            self.__rebuild()
+            return
+        # The blocks stay where they are, so only their counts are updated.
+        while len(newBlocks) < last + 1 - first:
+            newBlocks.append([])
+            sizes.append(0)
+        self.__blocks[first:last + 1] = newBlocks
+        tree = self.__tree
+        for b, size in enumerate(sizes, first):
+            delta = size - self.__sizes[b]
+            if delta:
+                self.__sizes[b] = size
+                self.__count += delta
+                while b < len(tree):
+                    tree[b] += delta
+                    b |= b + 1
+
+    def __rows(self, start, stop):
+        """Get the rows from |start| up to |stop| as a list."""
+        rows = []
+        while start < stop:
+            b, i = self.__find(start)
+            block = self.__blocks[b]
+            if type(block) is not list:
+                block = block[0].decode(u'utf-8').split(u'\n')
+            rows.extend(block[i:i + stop - start])
+            start += len(block) - i
+        return rows
+
+    def insert(self, index, value):
+        if index < 0:
+            index = max(index + self.__count, 0)
+        index = min(index, self.__count)
+        self.__replace(index, index, (value,))
+
+
+class HexLines(object):
+    """The rows of a binary file, shown as hex digits (kHexRowBytes bytes per
+    row). The last row is always empty, as if the hex ended with a new line.
+
+    The file is mapped into memory (mmap) and rows are formatted as they're
+    accessed. Changed rows are held as text, so memory use follows the size of
+    the changes rather than the size of the file. Like PackedLines, this
+    supports the parts of the list interface used on |lines|.
+    """
+
+    def __init__(self, path):
+        self.__map = b''
+        self.__size = 0
+        self.__pieces = [[u'']]
+        self.__starts = [0]
+        self.__count = 1
+        # Whether the file holds the rows that are read from |__map| (see
+        # patches()).
+        self.__isFileCurrent = True
+        self.__mapFile(path)
+
+    def __copy__(self):
+        other = HexLines.__new__(HexLines)
+        other.__map = self.__map
+        other.__size = self.__size
+        other.__pieces = [
+            piece if type(piece) is tuple else list(piece)
+            for piece in self.__pieces
+        ]
+        other.__starts = list(self.__starts)
+        other.__count = self.__count
+        other.__isFileCurrent = self.__isFileCurrent
+        return other
+
+    def __delitem__(self, index):
+        start, stop = self.__range(index)
+        self.__replace(start, stop, [])
+
+    def __eq__(self, other):
+        if not isinstance(other, (list, PackedLines, HexLines)):
+            return NotImplemented
+        return len(self) == len(other) and list(self) == list(other)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(self.__count)
+            if step != 1:
+                return list(self)[index]
+            return list(self.__rows(start, max(start, stop)))
+        if index < 0:
+            index += self.__count
+        if not 0 <= index < self.__count:
+            raise IndexError(u'row out of range')
+        p = bisect.bisect_right(self.__starts, index) - 1
+        piece = self.__pieces[p]
+        if type(piece) is tuple:
+            return self.__fileRows(piece[0] + index - self.__starts[p], 1)[0]
+        return piece[index - self.__starts[p]]
+
+    def __iter__(self):
+        return self.__rows(0, self.__count)
+
+    def __len__(self):
+        return self.__count
+
+    def __ne__(self, other):
+        result = self.__eq__(other)
+        return result if result is NotImplemented else not result
+
+    def __repr__(self):
+        return u'<HexLines %d rows in %d pieces>' % (self.__count,
+                                                     len(self.__pieces))
+
+    def __setitem__(self, index, value):
+        start, stop = self.__range(index)
+        self.__replace(start, stop,
+                       list(value) if isinstance(index, slice) else [value])
+
+    def __fileRows(self, row, count):
+        """Format |count| rows of the file, starting at |row|."""
+        data = self.__map[row * kHexRowBytes:(row + count) * kHexRowBytes]
+        text = binascii.hexlify(data).decode(u'ascii')
+        width = 2 * kHexRowBytes
+        return [text[i:i + width] for i in range(0, len(text), width)]
+
+    def __mapFile(self, path):
+        with io.open(path, 'rb') as inputFile:
+            size = os.fstat(inputFile.fileno()).st_size
+            fileMap = b''
+            if size:
+                fileMap = mmap.mmap(inputFile.fileno(), 0,
+                                    access=mmap.ACCESS_READ)
+        self.__map = fileMap
+        self.__size = size
+        fileRows = -(-size // kHexRowBytes)
+        self.__pieces = [(0, fileRows), [u'']] if fileRows else [[u'']]
+        self.__starts = [0, fileRows] if fileRows else [0]
+        self.__count = fileRows + 1
+        self.__isFileCurrent = True
+
+    def __range(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(self.__count)
+            if step != 1:
+                raise ValueError(u'HexLines slices must be contiguous')
+            return start, max(start, stop)
+        if index < 0:
+            index += self.__count
+        if not 0 <= index < self.__count:
+            raise IndexError(u'row out of range')
+        return index, index + 1
+
+    def __replace(self, start, stop, rows):
+        """Replace the rows from |start| up to |stop| with |rows|."""
+        pieces = []
+
+        def add(piece):
+            # Join the piece to the prior one, if they're alike.
+            if not (piece[1] if type(piece) is tuple else piece):
+                return
+            if pieces and type(piece) is type(pieces[-1]):
+                prior = pieces[-1]
+                if type(piece) is list:
+                    prior.extend(piece)
+                    return
+                if prior[0] + prior[1] == piece[0]:
+                    pieces[-1] = (prior[0], prior[1] + piece[1])
+                    return
+            pieces.append(piece)
+
+        isAdded = False
+        for begin, piece in zip(self.__starts, self.__pieces):
+            isList = type(piece) is list
+            end = begin + (len(piece) if isList else piece[1])
+            if end <= start:
+                add(piece)
+                continue
+            if begin >= stop:
+                if not isAdded:
+                    add(rows)
+                    isAdded = True
+                add(piece)
+                continue
+            # The piece overlaps the rows being replaced.
+            if begin < start:
+                add(piece[:start - begin] if isList else
+                    (piece[0], start - begin))
+            if not isAdded:
+                add(rows)
+                isAdded = True
+            if end > stop:
+                add(piece[stop - begin:] if isList else
+                    (piece[0] + stop - begin, end - stop))
+        if not isAdded:
+            add(rows)
+        sizes = [
+            len(piece) if type(piece) is list else piece[1] for piece in pieces
+        ]
+        self.__pieces = pieces
+        starts = []
+        count = 0
+        for size in sizes:
+            starts.append(count)
+            count += size
+        self.__starts = starts
+        self.__count = count
+
+    def __rows(self, start, stop):
+        """Yield the rows from |start| up to |stop|."""
+        while start < stop:
+            p = bisect.bisect_right(self.__starts, start) - 1
+            piece = self.__pieces[p]
+            i = start - self.__starts[p]
+            if type(piece) is list:
+                rows = piece[i:i + stop - start]
+            else:
+                rows = self.__fileRows(
+                    piece[0] + i, min(piece[1] - i, stop - start, kBlockRows))
+            for row in rows:
+                yield row
+            start += len(rows)
+
+    def byteChunks(self):
+        """Yield the bytes the rows represent, a piece at a time.
+
+        Raises:
+            ValueError: The rows are not valid hex.
+        """
+        # A changed piece may end part way through a byte (an odd hex digit).
+        text = u''
+        for piece in self.__pieces:
+            if type(piece) is tuple and not text:
+                begin = piece[0] * kHexRowBytes
+                end = min((piece[0] + piece[1]) * kHexRowBytes, self.__size)
+                for i in range(begin, end, kRewriteReadSize):
+                    yield self.__map[i:min(i + kRewriteReadSize, end)]
+                continue
+            if type(piece) is tuple:
+                text += u''.join(self.__fileRows(*piece))
+            else:
+                text += u''.join(piece).translate(kRemoveWhiteSpace)
+            end = len(text) - len(text) % 2
+            yield binascii.unhexlify(text[:end])
+            text = text[end:]
+        if text:
+            raise ValueError(u'odd number of hex digits')
+
+    def insert(self, index, value):
+        if index < 0:
+            index = max(index + self.__count, 0)
+        index = min(index, self.__count)
+        self.__replace(index, index, [value])
+
+    def isComplete(self):
+        """See MappedLines.isComplete(), all rows are always available."""
+        return True
+
+    def patches(self):
+        """Find the changes to the file as (offset, bytes) pairs to write in
+        place, if the changed rows still hold the same number of bytes.
+
+        Returns:
+            A list of (offset, bytes) tuples, or None if the whole file must be
+            written.
+
+        Raises:
+            ValueError: The rows are not valid hex.
+        """
+        if not self.__isFileCurrent:
+            return None
+        patches = []
+        for begin, piece in zip(self.__starts, self.__pieces):
+            if type(piece) is tuple:
+                if piece[0] != begin:
+                    return None
+                continue
+            text = u''.join(piece).translate(kRemoveWhiteSpace)
+            offset = begin * kHexRowBytes
+            size = max(
+                min((begin + len(piece)) * kHexRowBytes, self.__size) - offset,
+                0)
+            if len(text) != 2 * size:
+                return None
+            data = binascii.unhexlify(text)
+            if data != self.__map[offset:offset + size]:
+                patches.append((offset, data))
+        return patches
+
+    def rebase(self, path):
+        """Called once the rows have been written to the file at |path| (in
+        full). If the file would be shown as these same rows, map it, dropping
+        the changed rows held in memory."""
+        self.__isFileCurrent = False
+        lastRow = self.__count - 1
+        partialRow = self.__size // kHexRowBytes if (self.__size %
+                                                     kHexRowBytes) else None
+        for begin, piece in zip(self.__starts, self.__pieces):
+            if type(piece) is tuple:
+                # Only the last row of the data may be short.
+                if (partialRow is not None and
+                        piece[0] <= partialRow < piece[0] + piece[1] and
+                        begin + partialRow - piece[0] != lastRow - 1):
+                    return
+                continue
+            for row, text in enumerate(piece, begin):
+                if row == lastRow:
+                    isSame = not text
+                elif row == lastRow - 1:
+                    isSame = kReHexLastRow.match(text)
+                else:
+                    isSame = kReHexRow.match(text)
+                if not isSame:
+                    return
+        self.__mapFile(path)
@@ -16,15 +16,38 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
+import bisect
+import copy
 import os
 import re
 
 import app.buffer_file
 from app.curses_util import columnWidth
 import app.log
+import app.packed_payload
 import app.parser
 import app.selectable
 
+# Packed payloads in redoChain entries older than this many changes (counting
+# back from the redoIndex) are spilled to disk.
+kSpillAfterChangeCount = 32
+
+# A checkpoint (a copy of the document state, see Mutator.addCheckpoint()) is
+# kept at least every this many redoChain entries, to limit how many changes an
+# undoToIndex() replays.
+kCheckpointInterval = 200
+kCheckpointLimit = 16
+
+# With coarseUndo, consecutive edits are grouped into one redoChain entry of up
+# to this many changes.
+kCoarseUndoChangeLimit = 64
+
+# The change journal keeps (at least) this many recent entries. While there are
+# checkpoints it keeps up to kCheckpointJournalLimit entries, so that the rows
+# changed since a checkpoint can be found.
+kChangeJournalLimit = 1000
+kCheckpointJournalLimit = 16 * kChangeJournalLimit
+
 # If a change is in |noOpInstructions| then it has no real effect.
 noOpInstructions = set([
     ('m', (0, 0, 0, 0, 0)),
@@ -36,12 +59,68 @@ def addVectors(a, b):
     return tuple([a[i] + b[i] for i in range(len(a))])
 
 
+def composeChanges(changes):
+    """Compose a series of |changes| (see Mutator.changesSince()) into the
+    spans of rows they replaced.
+
+    Returns:
+        A sorted list of (begin, end, oldBegin, oldEnd) tuples. Rows |begin| up
+        to |end| of the lines after the |changes| replaced rows |oldBegin| up to
+        |oldEnd| of the lines before them. The rows outside of these spans are
+        unchanged (though they may have moved).
+    """
+    spans = []
+    for row, removedCount, addedCount in changes:
+        end = row + removedCount
+        delta = addedCount - removedCount
+        # The spans that overlap (or touch) the change are merged with it.
+        first = bisect.bisect_left(spans, (row,))
+        if first and spans[first - 1][1] >= row:
+            first -= 1
+        last = bisect.bisect_right(spans, (end, float('inf')), first)
+        # Rows after span i have moved by spans[i][1] - spans[i][3].
+        if first < last and spans[first][0] < row:
+            begin, oldBegin = spans[first][0], spans[first][2]
+        elif first:
+            begin = row
+            oldBegin = row - spans[first - 1][1] + spans[first - 1][3]
+        else:
+            begin, oldBegin = row, row
+        if first < last and spans[last - 1][1] > end:
+            stop, oldEnd = spans[last - 1][1], spans[last - 1][3]
+        elif last:
+            stop, oldEnd = end, end - spans[last - 1][1] + spans[last - 1][3]
+        else:
+            stop, oldEnd = end, end
+        spans[first:last] = [(begin, stop + delta, oldBegin, oldEnd)]
+        if delta:
+            spans[first + 1:] = [(i[0] + delta, i[1] + delta, i[2], i[3])
+                                 for i in spans[first + 1:]]
+    return spans
+
+
 class Mutator(app.selectable.Selectable):
     """Track and enact changes to a body of text."""
 
     def __init__(self):
         app.selectable.Selectable.__init__(self)
         self.__compoundChange = []
+        # |changeVersion| is incremented for each change to the lines. The rows
+        # touched by a change are stamped with it in |lineVersions|, so that a
+        # row's version is the |changeVersion| when it last changed.
+        self.changeVersion = 0
+        self.lineVersions = [0]
+        # The |changeVersion| when the file was last loaded or saved.
+        self.savedVersion = 0
+        # The change journal is a list of (changeVersion, row, removedCount,
+        # addedCount) tuples. Older entries are dropped as it grows.
+        self.__changeJournal = []
+        # The newest version that is no longer in the change journal.
+        self.__changeJournalBase = 0
+        # The changes not yet written to the recovery journal (see
+        # app.journal), as (changeVersion, u'r', row, removedCount, lines)
+        # tuples. None if the document has no recovery journal.
+        self.journalRecords = None
         # |oldRedoIndex| is used to store the redo index before an action
         # occurs, so we know where to insert the compound change.
         self.oldRedoIndex = 0
@@ -53,6 +132,18 @@ class Mutator(app.selectable.Selectable):
         self.fileStat = None
         self.goalCol = 0
         self.isReadOnly = False
+        # The document can't be changed at all (e.g. a mapped file, see
+        # Actions.fileMap()).
+        self.isViewOnly = False
+        # The document is still being read from the file (see
+        # Actions.loadMore()). The last row is not complete, so it can't be
+        # edited.
+        self.isLoading = False
+        # If not None, a message shown (in place of making the edit) the first
+        # time an edit is tried while loading.
+        self.loadingEditWarning = None
+        # The file is being followed as it grows (see Actions.fileFollow()).
+        self.isFollowing = False
         self.penGrammar = None
         self.parser = None
         self.parserTime = .0
@@ -70,13 +161,147 @@ class Mutator(app.selectable.Selectable):
         self.redoIndex = 0
         # |savedAtRedoIndex| may be > len(self.redoChain).
         self.savedAtRedoIndex = 0
+        # If not None, the maximum number of entries kept on the redoChain.
+        # The oldest entries are dropped first.
+        self.redoChainLimit = None
+        # Entries in redoChain before |spilledToIndex| have had their packed
+        # payloads spilled to disk (see __spillOldPayloads()).
+        self.spilledToIndex = 0
+        # Map of redoIndex to the document state (see addCheckpoint()) at
+        # that index.
+        self.checkpoints = {}
+        # Group edits into larger undo steps and keep no checkpoints, to save
+        # time and memory on very large documents.
+        self.coarseUndo = False
         self.shouldReparse = False
+        # The cursors, other than the pen, where edits are also made (see
+        # Actions.cursorsActive()). A sorted list of (row, col) tuples.
+        self.extraCursors = []
+        # The |changeVersion| the |extraCursors| are placed for.
+        self.extraCursorsVersion = 0
+
+    def changesSince(self, version):
+        """Get the changes made to the lines after |version| (a prior
+        |changeVersion|).
+
+        Returns:
+            A list of (row, removedCount, addedCount) tuples to be applied in
+            order, or None if the journal no longer reaches back to |version|
+            (in which case any cached per-row data should be discarded).
+        """
+        if version < self.__changeJournalBase:
+            return None
+        journal = self.__changeJournal
+        index = len(journal)
+        while index > 0 and journal[index - 1][0] > version:
+            index -= 1
+        return [change[1:] for change in journal[index:]]
+
+    def lineVersion(self, row):
+        """Get the |changeVersion| when |row| last changed."""
+        if len(self.lineVersions) != len(self.lines):
+            # The lines were replaced wholesale (outside of the Mutator).
+            self.lineVersions = [self.changeVersion] * len(self.lines)
+        return self.lineVersions[row]
+
+    def isRowModified(self, row):
+        """Whether |row| has changed since the file was last loaded or saved."""
+        return self.lineVersion(row) > self.savedVersion and self.isDirty()
+
+    def modifiedRows(self):
+        """Get the rows that have changed since the file was last loaded or
+        saved (see isRowModified()), in order. Rows are found from the change
+        journal rather than by checking every row."""
+        changes = self.changesSince(self.savedVersion)
+        if changes is None:
+            ranges = [(0, len(self.lines))]
+        else:
+            # Follow the rows touched by each change as later changes move
+            # them, as a list of [begin, end) ranges.
+            ranges = []
+            for row, removedCount, addedCount in changes:
+                end = row + removedCount
+                delta = addedCount - removedCount
+                moved = [(row, row + addedCount)]
+                for begin, stop in ranges:
+                    if begin < row:
+                        moved.append((begin, min(stop, row)))
+                    if stop > end:
+                        moved.append((max(begin, end) + delta, stop + delta))
+                ranges = [i for i in moved if i[0] < i[1]]
+            ranges.sort()
+        rows = []
+        checkedTo = 0
+        for begin, stop in ranges:
+            stop = min(stop, len(self.lines))
+            rows.extend(i for i in range(max(begin, checkedTo), stop)
+                        if self.isRowModified(i))
+            checkedTo = max(checkedTo, stop)
+        return rows
+
+    def noteLinesChanged(self, row, removedCount, addedCount):
+        app.selectable.Selectable.noteLinesChanged(self, row, removedCount,
+                                                   addedCount)
+        self.changeVersion += 1
+        version = self.changeVersion
+        self.lineVersions[row:row + removedCount] = [version] * addedCount
+        if len(self.lineVersions) != len(self.lines):
+            # The lines were replaced wholesale (outside of the Mutator).
+            self.lineVersions = [version] * len(self.lines)
+        journal = self.__changeJournal
+        journal.append((version, row, removedCount, addedCount))
+        limit = (kCheckpointJournalLimit
+                 if self.checkpoints else kChangeJournalLimit)
+        if len(journal) > 2 * limit:
+            # Trim in batches, so that trimming is rare.
+            self.__changeJournalBase = journal[-limit - 1][0]
+            del journal[:-limit]
+            for index in [
+                    index for index, state in self.checkpoints.items()
+                    if state[0] < self.__changeJournalBase]:
+                del self.checkpoints[index]
+        if self.journalRecords is not None:
+            self.journalRecords.append(
+                (version, u'r', row, removedCount,
+                 self.lines[row:row + addedCount]))
+
+    def noteRowsChanged(self, rows):
+        """Like noteLinesChanged(row, 1, 1) for each of the (sorted) |rows|,
+        though noted as one change spanning them."""
+        row = rows[0]
+        count = rows[-1] + 1 - row
+        versions = self.lineVersions[row:row + count]
+        self.noteLinesChanged(row, count, count)
+        # Only the |rows| are modified, not the rows between them.
+        for i in rows:
+            versions[i - row] = self.changeVersion
+        self.lineVersions[row:row + count] = versions
+
+    def noteLinesLoaded(self, row, removedCount, addedCount):
+        """Like noteLinesChanged(), for rows that are read from the file
+        (rather than modified)."""
+        # The checkpoints don't have the rows.
+        self.checkpoints = {}
+        self.noteLinesChanged(row, removedCount, addedCount)
+        self.lineVersions[row:row + addedCount] = ([self.savedVersion] *
+                                                   addedCount)
+        if self.journalRecords:
+            # The rows are part of the file, not a change to it.
+            self.journalRecords.pop()
+
+    def noteLinesReplaced(self):
+        """Called when all of the lines have been replaced, e.g. by loading a
+        file. The new lines are considered unmodified."""
+        self.noteLinesChanged(0, len(self.lineVersions), len(self.lines))
+        self.savedVersion = self.changeVersion
 
     def compoundChangePush(self):
         # app.log.info('compoundChangePush')
         if self.__compoundChange:
             self.redoIndex = self.oldRedoIndex
-            self.redoChain = self.redoChain[:self.redoIndex]
+            del self.redoChain[self.redoIndex:]
+            self.spilledToIndex = min(self.spilledToIndex, self.redoIndex)
+            self.__dropCheckpoints(self.redoIndex)
             changes = tuple(self.__compoundChange)
             change = changes[0]
             handledChange = False
@@ -84,6 +309,8 @@ class Mutator(app.selectable.Selectable):
             if (len(self.redoChain) and
                     self.redoChain[-1][0][0] == change[0] and
                     len(self.redoChain[-1]) == 1):
+                # The state after the last entry may change.
+                self.__dropCheckpoints(len(self.redoChain) - 1)
                 if change[0] in ('d', 'i'):
                     change = (change[0], self.redoChain[-1][0][1] + change[1])
                     self.redoChain[-1] = (change,)
@@ -112,11 +339,165 @@ class Mutator(app.selectable.Selectable):
                     else:
                         self.redoChain[-1] = (change,)
                     handledChange = True
+            if (not handledChange and self.coarseUndo and
+                    self.savedAtRedoIndex < len(self.redoChain) and
+                    len(self.redoChain[-1]) + len(changes) <=
+                    kCoarseUndoChangeLimit):
+                self.__dropCheckpoints(len(self.redoChain) - 1)
+                self.redoChain[-1] += changes
+                handledChange = True
             if not handledChange:
                 self.redoChain.append(changes)
                 self.redoIndex += 1
         self.__compoundChange = []
         self.oldRedoIndex = self.redoIndex
+        self.__spillOldPayloads()
+        for index in self.checkpoints:
+            if self.redoIndex - kCheckpointInterval < index <= self.redoIndex:
+                break
+        else:
+            self.addCheckpoint()
+
+    def addCheckpoint(self):
+        """Keep a copy of the document state at the current redoIndex, for use
+        by undoToIndex(). The copy of the lines shares structure with them:
+        the line strings of a list, or the packed blocks of a PackedLines."""
+        if self.coarseUndo or self.isLoading:
+            return
+        if self.__compoundChange:
+            # The redoChain is not settled.
+            return
+        penRow = self.penRow
+        penCol = self.penCol
+        markerRow = self.markerRow
+        markerCol = self.markerCol
+        selectionMode = self.selectionMode
+        if self.tempChange and not self.processTempChange:
+            # The tempChange is applied, but is not part of the redoChain.
+            penRow, penCol, markerRow, markerCol, selectionMode = (
+                penRow - self.tempChange[1][0], penCol - self.tempChange[1][1],
+                markerRow - self.tempChange[1][2],
+                markerCol - self.tempChange[1][3],
+                selectionMode - self.tempChange[1][4])
+        self.checkpoints[self.redoIndex] = (self.changeVersion,
+                                            copy.copy(self.lines), penRow,
+                                            penCol, markerRow, markerCol,
+                                            selectionMode)
+        if len(self.checkpoints) > kCheckpointLimit:
+            # Drop the oldest, though keep the saved state if possible.
+            indices = sorted(self.checkpoints)
+            if indices[0] == self.savedAtRedoIndex:
+                del self.checkpoints[indices[1]]
+            else:
+                del self.checkpoints[indices[0]]
+
+    def __restoreCheckpoint(self, index):
+        """Return the document to the checkpoint at |index|. Only the rows
+        changed since the checkpoint are replaced (and noted as changed), so
+        the other rows keep their line versions.
+
+        Returns:
+            False if the rows changed since the checkpoint are no longer
+            known (the checkpoint is dropped).
+        """
+        (version, lines, penRow, penCol, markerRow, markerCol,
+         selectionMode) = self.checkpoints[index]
+        changes = self.changesSince(version)
+        if changes is None:
+            del self.checkpoints[index]
+            return False
+        # Later spans first, so that the rows of earlier spans don't move.
+        for begin, end, oldBegin, oldEnd in reversed(composeChanges(changes)):
+            rows = lines[oldBegin:oldEnd]
+            current = self.lines[begin:end]
+            # Rows that are as they were (e.g. a change that was undone) are
+            # left alone.
+            head = 0
+            while (head < min(len(rows), len(current)) and
+                   rows[head] == current[head]):
+                head += 1
+            tail = 0
+            while (tail < min(len(rows), len(current)) - head and
+                   rows[-tail - 1] == current[-tail - 1]):
+                tail += 1
+            if head == len(rows) == len(current):
+                continue
+            self.lines[begin + head:end - tail] = rows[head:len(rows) - tail]
+            self.noteLinesChanged(begin + head, len(current) - head - tail,
+                                  len(rows) - head - tail)
+        self.penRow = penRow
+        self.penCol = penCol
+        self.markerRow = markerRow
+        self.markerCol = markerCol
+        self.selectionMode = selectionMode
+        self.redoIndex = index
+        return True
+
+    def __isEditAllowed(self, change):
+        """Whether the document |change| may be made now."""
+        if self.isViewOnly:
+            self.setMessage(u'This is a read only view of the file')
+            return False
+        if self.isLoading and (
+                change[0] == 'ld' or
+                max(self.penRow, self.markerRow) >= len(self.lines) - 1 or
+                change[0] == 'mc' and
+                change[1][0][-1][0] >= len(self.lines) - 1):
+            self.setMessage(u'That part of the file is still loading')
+            return False
+        if self.isLoading and self.loadingEditWarning is not None:
+            # The edit is made if it's tried again.
+            self.setMessage(self.loadingEditWarning)
+            self.loadingEditWarning = None
+            return False
+        return True
+
+    def __dropCheckpoints(self, index):
+        """Forget checkpoints after |index| (the redoChain is changing)."""
+        for i in [i for i in self.checkpoints if i > index]:
+            del self.checkpoints[i]
+
+    def __packChange(self, change):
+        """Store the large parts of |change| compactly (see
+        app.packed_payload)."""
+        if change[0] in ('ds', 'ld', 'v'):
+            return (change[0], app.packed_payload.pack(change[1]))
+        elif change[0] == 'dr':
+            return (change[0], change[1], app.packed_payload.pack(change[2]))
+        return change
+
+    def __spillOldPayloads(self):
+        """Move the packed payloads of older changes out of memory."""
+        end = min(self.redoIndex, len(self.redoChain)) - kSpillAfterChangeCount
+        for changes in self.redoChain[self.spilledToIndex:end]:
+            for change in changes:
+                for part in change[1:]:
+                    if isinstance(part, app.packed_payload.PackedPayload):
+                        part.spill()
+        self.spilledToIndex = max(self.spilledToIndex, end)
+
+    def __trimRedoChain(self):
+        """Drop the oldest entries on the redoChain, leaving
+        |redoChainLimit| entries. This is done in batches (see
+        redoAddChange()) so that the cost of trimming is spread over many
+        changes."""
+        count = min(
+            len(self.redoChain) - self.redoChainLimit, self.redoIndex,
+            self.oldRedoIndex)
+        if count <= 0:
+            return
+        del self.redoChain[:count]
+        self.redoIndex -= count
+        self.oldRedoIndex -= count
+        self.spilledToIndex = max(0, self.spilledToIndex - count)
+        self.checkpoints = dict((index - count, state)
+                                for index, state in self.checkpoints.items()
+                                if index >= count)
+        if self.savedAtRedoIndex < count:
+            # The saved state can no longer be reached by undo.
+            self.savedAtRedoIndex = -1
+        else:
+            self.savedAtRedoIndex -= count
 
     def getPenOffset(self, row, col):
         """inefficient test hack. wip on parser"""
@@ -179,14 +560,13 @@ class Mutator(app.selectable.Selectable):
         if begin < to:
             assert end < to
             assert self.penRow < to
+            changedRows = (begin, to)
             to -= count
             self.penRow -= count
             if self.selectionMode != app.selectable.kSelectionNone:
                 assert self.markerRow < to + count
                 assert self.markerRow >= count
                 self.markerRow -= count
-            if self.upperChangedRow > begin:
-                self.upperChangedRow = begin
         else:
             assert end > to
             assert self.penRow >= to
@@ -194,25 +574,83 @@ class Mutator(app.selectable.Selectable):
             if self.selectionMode != app.selectable.kSelectionNone:
                 assert self.markerRow >= to
                 self.markerRow += count
-            if self.upperChangedRow > to:
-                self.upperChangedRow = to
-        self.lines = self.lines[:to] + lines + self.lines[to:]
+            changedRows = (to, end)
+        self.lines[to:to] = lines
+        count = changedRows[1] - changedRows[0]
+        self.noteLinesChanged(changedRows[0], count, count)
+
+    def __doLineDiff(self, diff, add, remove):
+        """Apply a line diff (see 'ld'). Lines marked with |add| are added and
+        lines marked with |remove| are removed, so swapping them reverses the
+        diff."""
+        lines = []
+        index = 0
+        # Changed spans as [row, removedCount, addedCount].
+        spans = []
+        span = None
+        for ii in diff:
+            if type(ii) is type(0):
+                lines.extend(self.lines[index:index + ii])
+                index += ii
+                if span is not None:
+                    spans.append(span)
+                    span = None
+                continue
+            if span is None:
+                span = [len(lines), 0, 0]
+            if ii[0] == add:
+                lines.append(ii[2:])
+                span[2] += 1
+            elif ii[0] == remove:
+                index += 1
+                span[1] += 1
+        if span is not None:
+            spans.append(span)
+        # Keep the same list, since it's cheap and lets the parser keep the
+        # parse of the unchanged rows (see Actions.updateParser()).
+        self.lines[:] = lines
+        for row, removedCount, addedCount in spans:
+            self.noteLinesChanged(row, removedCount, addedCount)
+
+    def __doCursorEdits(self, change, isUndo):
+        """Make (or undo) the edits of a multi-cursor change (see
+        Actions.cursorsEdit()), noted as one change."""
+        edits, cursorsBefore, cursorsAfter = change[1]
+        lines = self.lines
+        if isUndo:
+            # The edits to the left are undone first, so that each edit is
+            # found where it was made.
+            for row, col, removed, added in edits:
+                line = lines[row]
+                lines[row] = line[:col] + removed + line[col + len(added):]
+            self.extraCursors = list(cursorsBefore)
+        else:
+            # The edits to the right are made first, so that each edit is made
+            # where it was found.
+            for row, col, removed, added in reversed(edits):
+                line = lines[row]
+                lines[row] = line[:col] + added + line[col + len(removed):]
+            self.extraCursors = list(cursorsAfter)
+        rows = [edits[0][0]]
+        for edit in edits:
+            if edit[0] != rows[-1]:
+                rows.append(edit[0])
+        self.noteRowsChanged(rows)
+        self.extraCursorsVersion = self.changeVersion
 
     def __doVerticalInsert(self, change):
         text, row, endRow, col = change[1]
         for i in range(row, endRow + 1):
             line = self.lines[i]
             self.lines[i] = line[:col] + text + line[col:]
-        if self.upperChangedRow > row:
-            self.upperChangedRow = row
+        self.noteLinesChanged(row, endRow + 1 - row, endRow + 1 - row)
 
     def __doVerticalDelete(self, change):
         text, row, endRow, col = change[1]
         for i in range(row, endRow + 1):
             line = self.lines[i]
             self.lines[i] = line[:col] + line[col + len(text):]
-        if self.upperChangedRow > row:
-            self.upperChangedRow = row
+        self.noteLinesChanged(row, endRow + 1 - row, endRow + 1 - row)
 
     def __redoMove(self, change):
         assert self.penRow + change[1][0] >= 0, "%s %s" % (self.penRow,
@@ -250,6 +688,7 @@ class Mutator(app.selectable.Selectable):
                     len(changes) == 1):
                 self.shouldReparse = True
                 break
+        self.__noteSavedState()
         self.updateBasicScrollPosition()
 
     def __redoChange(self, change):
@@ -259,22 +698,19 @@ class Mutator(app.selectable.Selectable):
             self.penCol -= width
             x = self.penCol
             self.lines[self.penRow] = line[:x] + line[x + width:]
-            if self.upperChangedRow > self.penRow:
-                self.upperChangedRow = self.penRow
+            self.noteLinesChanged(self.penRow, 1, 1)
         elif change[0] == 'bw':  # Redo backspace word.
             line = self.lines[self.penRow]
             width = columnWidth(change[1])
             self.penCol -= width
             x = self.penCol
             self.lines[self.penRow] = line[:x] + line[x + width:]
-            if self.upperChangedRow > self.penRow:
-                self.upperChangedRow = self.penRow
+            self.noteLinesChanged(self.penRow, 1, 1)
         elif change[0] == 'd':  # Redo delete character.
             line = self.lines[self.penRow]
             x = self.penCol
             self.lines[self.penRow] = line[:x] + line[x + columnWidth(change[1]):]
-            if self.upperChangedRow > self.penRow:
-                self.upperChangedRow = self.penRow
+            self.noteLinesChanged(self.penRow, 1, 1)
         elif change[0] == 'dr':  # Redo delete range.
             self.doDelete(*change[1])
         elif change[0] == 'ds':  # Redo delete selection.
@@ -287,32 +723,18 @@ class Mutator(app.selectable.Selectable):
             self.lines[self.penRow] = line[:x] + change[1] + line[x:]
             self.penCol += columnWidth(change[1])
             self.goalCol = self.penCol
-            if self.upperChangedRow > self.penRow:
-                self.upperChangedRow = self.penRow
+            self.noteLinesChanged(self.penRow, 1, 1)
         elif change[0] == 'j':  # Redo join lines (delete \n).
             self.lines[self.penRow] += self.lines[self.penRow + 1]
             del self.lines[self.penRow + 1]
-            if self.upperChangedRow > self.penRow:
-                self.upperChangedRow = self.penRow
+            self.noteLinesChanged(self.penRow, 2, 1)
         elif change[0] == 'ld':  # Redo line diff.
-            lines = []
-            index = 0
-            for ii in change[1]:
-                if type(ii) is type(0):
-                    for line in self.lines[index:index + ii]:
-                        lines.append(line)
-                    index += ii
-                elif ii[0] == '+':
-                    lines.append(ii[2:])
-                elif ii[0] == '-':
-                    index += 1
-            self.lines = lines
-            firstChangedRow = change[1][0] if type(
-                change[1][0]) is type(0) else 0
-            if self.upperChangedRow > firstChangedRow:
-                self.upperChangedRow = firstChangedRow
+            self.__doLineDiff(
+                app.packed_payload.unpack(change[1]), u'+', u'-')
         elif change[0] == 'm':  # Redo move
             self.__redoMove(change)
+        elif change[0] == 'mc':  # Redo multi-cursor edit.
+            self.__doCursorEdits(change, False)
         elif change[0] == 'ml':  # Redo move lines
             begin, end, to = change[1]
             self.__doMoveLines(begin, end, to)
@@ -322,11 +744,10 @@ class Mutator(app.selectable.Selectable):
             self.lines[self.penRow] = line[:self.penCol]
             for i in range(max(change[1] - 1, 0)):
                 self.lines.insert(self.penRow + 1, u"")
-            if self.upperChangedRow > self.penRow:
-                self.upperChangedRow = self.penRow
+            self.noteLinesChanged(self.penRow, 1, 1 + max(change[1], 1))
             self.__redoMove(change[2])
         elif change[0] == 'v':  # Redo paste.
-            self.insertLines(change[1])
+            self.insertLines(app.packed_payload.unpack(change[1]))
         elif change[0] == 'vb':  # Redo vertical backspace.
             self.penCol -= columnWidth(change[1])
             row = min(self.markerRow, self.penRow)
@@ -335,8 +756,7 @@ class Mutator(app.selectable.Selectable):
                 line = self.lines[i]
                 x = self.penCol
                 self.lines[self.penRow] = line[:x] + line[x + columnWidth(change[1]):]
-            if self.upperChangedRow > row:
-                self.upperChangedRow = row
+            self.noteLinesChanged(row, rowEnd + 1 - row, rowEnd + 1 - row)
         elif change[0] == 'vd':  # Redo vertical delete.
             self.__doVerticalDelete(change)
         elif change[0] == 'vi':  # Redo vertical insert.
@@ -352,6 +772,9 @@ class Mutator(app.selectable.Selectable):
         """
         if self.debugRedo:
             app.log.info('redoAddChange', change)
+        if change[0] not in ('f', 'm') and not self.__isEditAllowed(change):
+            self.stallNextRedo = True
+            return
         # Handle new trivial actions, which are defined as standalone cursor
         # moves.
         if change[0] == 'm' and not self.__compoundChange:
@@ -374,12 +797,15 @@ class Mutator(app.selectable.Selectable):
             # We may lose the saved at when trimming.
             if self.redoIndex < self.savedAtRedoIndex:
                 self.savedAtRedoIndex = -1
-            self.redoChain = self.redoChain[:self.redoIndex]
+            del self.redoChain[self.redoIndex:]
+            self.spilledToIndex = min(self.spilledToIndex, self.redoIndex)
+            self.__dropCheckpoints(self.redoIndex)
             if self.tempChange:
                 # If previous action was a cursor move, we can merge it with
                 # tempChange.
                 if (len(self.redoChain) and self.redoChain[-1][0][0] == 'm' and
                         len(self.redoChain[-1]) == 1):
+                    self.__dropCheckpoints(len(self.redoChain) - 1)
                     combinedChange = ('m',
                                       addVectors(self.tempChange[1],
                                                  self.redoChain[-1][0][1]))
@@ -394,9 +820,14 @@ class Mutator(app.selectable.Selectable):
                     self.redoIndex += 1
                     self.oldRedoIndex += 1
                 self.tempChange = None
+            change = self.__packChange(change)
             # Accumulating changes together as a unit.
             self.__compoundChange.append(change)
             self.redoChain.append((change,))
+            if (self.redoChainLimit is not None and
+                    len(self.redoChain) >
+                    self.redoChainLimit + self.redoChainLimit // 8):
+                self.__trimRedoChain()
         if self.debugRedo:
             app.log.info('--- redoIndex', self.redoIndex)
             for i, c in enumerate(self.redoChain):
@@ -413,6 +844,41 @@ class Mutator(app.selectable.Selectable):
         assert self.penRow >= 0, self.penRow
         assert self.penCol >= 0, self.penCol
 
+    def undoToIndex(self, index):
+        """Undo (or redo) to the state after the first |index| entries of the
+        redoChain, e.g. to revert to the saved file in one step. Starts from
+        the nearest checkpoint to avoid replaying many changes. Only the rows
+        that change are noted as changed."""
+        assert 0 <= index <= len(self.redoChain)
+        if self.tempChange:
+            self.__undoMove(self.tempChange)
+            self.tempChange = None
+        self.processTempChange = False
+        nearest = self.redoIndex
+        for i in self.checkpoints:
+            if abs(i - index) < abs(nearest - index):
+                nearest = i
+        if nearest != self.redoIndex:
+            self.__restoreCheckpoint(nearest)
+        while self.redoIndex > index:
+            self.redoIndex -= 1
+            for change in reversed(self.redoChain[self.redoIndex]):
+                self.__undoChange(change)
+        while self.redoIndex < index:
+            for change in self.redoChain[self.redoIndex]:
+                self.__redoChange(change)
+            self.redoIndex += 1
+        self.shouldReparse = True
+        self.__noteSavedState()
+        self.updateBasicScrollPosition()
+
+    def __noteSavedState(self):
+        """Once undo (or redo) is back to the saved file, the rows the
+        replayed changes touched match the file again. Rows changed after this
+        are the only modified rows (see isRowModified())."""
+        if not self.isDirty():
+            self.savedVersion = self.changeVersion
+
     def undo(self):
         """Undo a set of redo nodes."""
         assert 0 <= self.redoIndex <= len(self.redoChain)
@@ -436,6 +902,7 @@ class Mutator(app.selectable.Selectable):
                     self.__undoChange(change)
                 break
         self.processTempChange = False
+        self.__noteSavedState()
 
     def __undoChange(self, change):
         if change[0] == 'b':
@@ -443,26 +910,24 @@ class Mutator(app.selectable.Selectable):
             x = self.penCol
             self.lines[self.penRow] = line[:x] + change[1] + line[x:]
             self.penCol += columnWidth(change[1])
-            if self.upperChangedRow > self.penRow:
-                self.upperChangedRow = self.penRow
+            self.noteLinesChanged(self.penRow, 1, 1)
         elif change[0] == 'bw':
             line = self.lines[self.penRow]
             x = self.penCol
             self.lines[self.penRow] = line[:x] + change[1] + line[x:]
             self.penCol += columnWidth(change[1])
-            if self.upperChangedRow > self.penRow:
-                self.upperChangedRow = self.penRow
+            self.noteLinesChanged(self.penRow, 1, 1)
         elif change[0] == 'd':
             line = self.lines[self.penRow]
             x = self.penCol
             self.lines[self.penRow] = line[:x] + change[1] + line[x:]
-            if self.upperChangedRow > self.penRow:
-                self.upperChangedRow = self.penRow
+            self.noteLinesChanged(self.penRow, 1, 1)
         elif change[0] == 'dr':  # Undo delete range.
-            self.insertLinesAt(change[1][0], change[1][1], change[2],
+            self.insertLinesAt(change[1][0], change[1][1],
+                               app.packed_payload.unpack(change[2]),
                                app.selectable.kSelectionCharacter)
         elif change[0] == 'ds':  # Undo delete selection.
-            self.insertLines(change[1])
+            self.insertLines(app.packed_payload.unpack(change[1]))
         elif change[0] == 'f':  # Undo fence.
             pass
         elif change[0] == 'i':  # Undo insert.
@@ -472,33 +937,19 @@ class Mutator(app.selectable.Selectable):
             self.penCol -= width
             self.lines[self.penRow] = line[:x - width] + line[x:]
             self.goalCol = self.penCol
-            if self.upperChangedRow > self.penRow:
-                self.upperChangedRow = self.penRow
+            self.noteLinesChanged(self.penRow, 1, 1)
         elif change[0] == 'j':  # Undo join lines.
             line = self.lines[self.penRow]
             self.lines.insert(self.penRow + 1, line[self.penCol:])
             self.lines[self.penRow] = line[:self.penCol]
-            if self.upperChangedRow > self.penRow:
-                self.upperChangedRow = self.penRow
+            self.noteLinesChanged(self.penRow, 1, 2)
         elif change[0] == 'ld':  # Undo line diff.
-            lines = []
-            index = 0
-            for ii in change[1]:
-                if type(ii) is type(0):
-                    for line in self.lines[index:index + ii]:
-                        lines.append(line)
-                    index += ii
-                elif ii[0] == '+':
-                    index += 1
-                elif ii[0] == '-':
-                    lines.append(ii[2:])
-            self.lines = lines
-            firstChangedRow = change[1][0] if type(
-                change[1][0]) is type(0) else 0
-            if self.upperChangedRow > firstChangedRow:
-                self.upperChangedRow = firstChangedRow
+            self.__doLineDiff(
+                app.packed_payload.unpack(change[1]), u'-', u'+')
         elif change[0] == 'm':
             self.__undoMove(change)
+        elif change[0] == 'mc':  # Undo multi-cursor edit.
+            self.__doCursorEdits(change, True)
         elif change[0] == 'ml':
             # Undo move lines
             begin, end, to = change[1]
@@ -513,10 +964,9 @@ class Mutator(app.selectable.Selectable):
             self.lines[self.penRow] += self.lines[self.penRow + change[1]]
             for _ in range(change[1]):
                 del self.lines[self.penRow + 1]
-            if self.upperChangedRow > self.penRow:
-                self.upperChangedRow = self.penRow
+            self.noteLinesChanged(self.penRow, 1 + change[1], 1)
         elif change[0] == 'v':  # undo paste
-            clip = change[1]
+            clip = app.packed_payload.unpack(change[1])
             row = self.penRow
             col = self.penCol
             app.log.info('len clip', len(clip))
@@ -529,8 +979,7 @@ class Mutator(app.selectable.Selectable):
                     self.lines[row + len(clip) - 1][len(clip[-1]):])
                 delLineCount = len(clip[1:-1])
                 del self.lines[row + 1:row + 1 + delLineCount + 1]
-            if self.upperChangedRow > row:
-                self.upperChangedRow = row
+            self.noteLinesChanged(row, len(clip), 1)
         elif change[0] == 'vb':
             row = min(self.markerRow, self.penRow)
             endRow = max(self.markerRow, self.penRow)
@@ -539,8 +988,7 @@ class Mutator(app.selectable.Selectable):
                 x = self.penCol
                 self.lines[self.penRow] = line[:x] + change[1] + line[x:]
             self.penCol += columnWidth(change[1])
-            if self.upperChangedRow > row:
-                self.upperChangedRow = row
+            self.noteLinesChanged(row, endRow + 1 - row, endRow + 1 - row)
         elif change[0] == 'vd':  # Undo vertical delete
             self.__doVerticalInsert(change)
         elif change[0] == 'vi':  # Undo vertical insert
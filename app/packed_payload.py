@@ -0,0 +1,162 @@
+# Copyright 2018 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+  Compact storage for large undo (redoChain) payloads, such as the text of a
+  big deleted selection or paste. Large payloads are compressed and may later
+  be spilled to a temporary file to free memory. The spill file is compacted
+  as the spilled payloads are dropped (e.g. by trimming the redoChain).
+"""
+
+# For Python 2to3 support.
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+import tempfile
+import threading
+import weakref
+import zlib
+
+import app.config
+
+# Payloads with fewer characters than this are not worth packing.
+kPackThreshold = 4096
+
+# The temporary file that spilled payloads are appended to. It's created when
+# first needed and removed by the OS when the program exits.
+_spillFile = None
+_spillLock = threading.Lock()
+# The payloads that are in the spill file. A payload that is dropped leaves
+# this set, and its part of the file is dead.
+_spilledPayloads = weakref.WeakSet()
+
+# The spill file is compacted when it's at least this large and less than
+# kCompactLiveRatio of it is still used.
+kCompactMinSize = 1024 * 1024
+kCompactLiveRatio = 0.5
+
+
+class PackedPayload:
+    """A tuple of lines (or 'ld' line diff entries) in compressed form."""
+
+    def __init__(self, value):
+        if app.config.strict_debug:
+            assert isinstance(value, tuple)
+        self.__data = zlib.compress(
+            pickle.dumps(value, pickle.HIGHEST_PROTOCOL), 1)
+        # (offset, length) in the spill file, if spilled.
+        self.__spilled = None
+
+    def __getstate__(self):
+        # Spill file offsets don't survive the process, so always pickle the
+        # compressed data itself (e.g. for the file history).
+        return {'data': self.__compressedData()}
+
+    def __repr__(self):
+        return '<PackedPayload %s>' % (self.__spilled and 'spilled' or
+                                       len(self.__data),)
+
+    def __setstate__(self, state):
+        self.__data = state['data']
+        self.__spilled = None
+
+    def __compressedData(self):
+        if self.__spilled is None:
+            return self.__data
+        offset, length = self.__spilled
+        with _spillLock:
+            _spillFile.seek(offset)
+            return _spillFile.read(length)
+
+    def isSpilled(self):
+        return self.__spilled is not None
+
+    def spill(self):
+        """Move the compressed data out of memory into the spill file."""
+        global _spillFile
+        if self.__spilled is not None:
+            return
+        with _spillLock:
+            if _spillFile is None:
+                _spillFile = tempfile.TemporaryFile(prefix='ci_edit_undo_')
+            _spillFile.seek(0, 2)
+            size = _spillFile.tell()
+            if size >= kCompactMinSize:
+                size = self.__compact(size)
+            self.__spilled = (size, len(self.__data))
+            _spillFile.seek(size)
+            _spillFile.write(self.__data)
+            _spilledPayloads.add(self)
+        self.__data = None
+
+    def __compact(self, size):
+        """Drop the dead parts of the spill file, if that's worthwhile. The
+        _spillLock is held.
+
+        Returns:
+            The size of the spill file.
+        """
+        global _spillFile
+        payloads = sorted(_spilledPayloads, key=lambda i: i.__spilled[0])
+        live = sum(i.__spilled[1] for i in payloads)
+        if live >= size * kCompactLiveRatio:
+            return size
+        if not payloads:
+            _spillFile.truncate(0)
+            return 0
+        # Copy the live payloads to a new file.
+        newFile = tempfile.TemporaryFile(prefix='ci_edit_undo_')
+        for payload in payloads:
+            offset, length = payload.__spilled
+            _spillFile.seek(offset)
+            payload.__spilled = (newFile.tell(), length)
+            newFile.write(_spillFile.read(length))
+        _spillFile.close()
+        _spillFile = newFile
+        return newFile.tell()
+
+    def value(self):
+        return pickle.loads(zlib.decompress(self.__compressedData()))
+
+
+def spillFileSize():
+    """The size of the spill file, in bytes."""
+    with _spillLock:
+        if _spillFile is None:
+            return 0
+        _spillFile.seek(0, 2)
+        return _spillFile.tell()
+
+
+def pack(value):
+    """Get a compact form of |value| (a tuple of strings and ints), which may
+    be |value| itself if it's small."""
+    size = 0
+    for i in value:
+        if type(i) is not int:
+            size += len(i)
+    if size < kPackThreshold:
+        return value
+    return PackedPayload(value)
+
+
+def unpack(value):
+    """Reverse pack()."""
+    if isinstance(value, PackedPayload):
+        return value.value()
+    return value
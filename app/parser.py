@@ -31,22 +31,48 @@ import traceback
 import third_party.pyperclip as clipboard
 
 import app.config
+import app.curses_util
+import app.line_store
 import app.log
 import app.selectable
 
-# Keys to tuples within |parserNodes|.
+# Keys to tuples within |Parser.rows|.
 # Reference to a prefs grammar dictionary.
 kGrammar = 0
-# The current grammar begins at byte offset |kBegin| in the source data.
+# The current grammar begins at offset |kBegin| in the text of its row.
 kBegin = 1
-# An index into the parserNodes list to the prior (or parent) grammar.
+# The (grammar, prior) pair to resume when the current grammar ends (like a
+# stack of grammars), or None.
 kPrior = 2
 # Some characters display wider (or narrower) than others. Visual is a running
-# display offset. E.g. if the first character in some utf-8 data is a double
-# width and 3 bytes long the kBegin = 0, and kVisual = 0; the second character
-# will start at kBegin = 3, kVisual = 2.
+# display offset from the start of the row. E.g. if the first character in a row
+# is double width the kBegin = 0, and kVisual = 0; the second character will
+# start at kBegin = 1, kVisual = 2.
 kVisual = 3
 
+# Characters that are displayed two columns wide (see rowTextAndWidth()).
+kReDoubleWide = re.compile(
+    u'[%s-%s]' % (app.curses_util.MIN_DOUBLE_WIDE_CHARACTER,
+                  unichr(sys.maxunicode)))
+
+
+def isSamePrior(prior, other):
+    """Whether two kPrior chains resume the same grammars. The grammars are
+    compared by identity (comparing the dictionaries would be slow)."""
+    while prior is not other:
+        if prior is None or other is None or prior[0] is not other[0]:
+            return False
+        prior = prior[1]
+        other = other[1]
+    return True
+
+
+def isSameNode(node, other):
+    return (node[kGrammar] is other[kGrammar] and
+            node[kBegin] == other[kBegin] and
+            node[kVisual] == other[kVisual] and
+            isSamePrior(node[kPrior], other[kPrior]))
+
 
 class ParserNode:
     """A parser node represents a span of grammar. i.e. from this point to that
@@ -55,52 +81,89 @@ class ParserNode:
 
     def __init__(self, grammar, begin, prior, visual):
         self.grammar = grammar
-        # Offset from start of file.
+        # Offset from start of row.
         self.begin = begin
-        # Index of prior grammar (like a stack of grammars).
+        # The (grammar, prior) to resume (like a stack of grammars).
         self.prior = prior
         # Visible width on screen (double wide chars, and tabs).
         self.visual = visual
 
-    def debugLog(self, out, indent, data):
-        out('%sParserNode %26s prior %4s, b%4d, v%4d %s' %
-            (indent, self.grammar.get('name', 'None'), self.prior, self.begin,
-             self.visual, repr(data[self.begin:self.begin + 15])[1:-1]))
+    def debugLog(self, out, indent, text):
+        out('%sParserNode %26s prior %10s, b%4d, v%4d %s' %
+            (indent, self.grammar.get('name', 'None'),
+             self.prior and self.prior[0].get('name', 'None'), self.begin,
+             self.visual, repr(text[self.begin:self.begin + 15])[1:-1]))
 
 
 class Parser:
-    """A parser generates a set of grammar segments (ParserNode objects)."""
+    """A parser generates a set of grammar segments (ParserNode objects).
+
+    The rows are read from the document's lines (see parse()). After an edit
+    only the changed rows are parsed again, along with the rows below them
+    until the grammar at the start of a row is as it was before the edit.
+    """
 
     def __init__(self):
-        self.data = u""
+        # The rows of the document, e.g. TextBuffer.lines.
+        self.lines = [u'']
         self.emptyNode = ParserNode({}, None, None, 0)
         self.endNode = ({}, sys.maxsize, sys.maxsize, sys.maxsize)
-        self.fullyParsedToLine = -1
-        # A row on screen will consist of one or more ParserNodes. When a
-        # ParserNode is returned from the parser it will be an instance of
-        # ParserNode, but internally tuples are used in place of ParserNodes.
-        # This makes for some ugly code, but the performance difference (~5%) is
-        # worth it.
-        self.parserNodes = [({}, 0, None, 0)]
-        # Each entry in |self.rows| is an index into the |self.parserNodes|
-        # array to the parerNode that begins that row.
-        self.rows = [0]  # Row parserNodes index.
+        # The rows before this have been parsed.
+        self.fullyParsedToLine = 0
+        # Each entry in |self.rows| is a tuple of the ParserNodes of that row,
+        # or None if the row has changed since it was parsed. When a ParserNode
+        # is returned from the parser it will be an instance of ParserNode, but
+        # internally tuples are used in place of ParserNodes. This makes for
+        # some ugly code, but the performance difference (~5%) is worth it.
+        self.rows = [None]
+        # The number of None entries in |self.rows|.
+        self.__changedCount = 1
+        # Where an interrupted parse stopped within a row, as a (row, nodes,
+        # cursor, visual, previous node) tuple (see __buildGrammarList()).
+        self.__resume = None
         app.log.parser('__init__')
 
+    def noteLinesChanged(self, row, removedCount, addedCount):
+        """Called when |removedCount| rows at |row| were replaced by
+        |addedCount| rows. The grammar at the start of the row after them may
+        change too, so it is also parsed again."""
+        end = row + removedCount
+        if end < len(self.rows):
+            end += 1
+            addedCount += 1
+        removed = self.rows[row:end]
+        self.rows[row:end] = [None] * addedCount
+        self.__changedCount += addedCount - removed.count(None)
+        self.fullyParsedToLine = min(self.fullyParsedToLine, row)
+        if self.__resume is not None and self.__resume[0] >= row:
+            self.__resume = None
+
+    def noteLinesReplaced(self):
+        """Called when all of the rows have changed."""
+        self.rows = [None] * len(self.lines)
+        self.__changedCount = len(self.rows)
+        self.fullyParsedToLine = 0
+        self.__resume = None
+
+    def __rowNodes(self, row):
+        """The nodes of |row|. A row that hasn't been parsed is one node."""
+        if row < len(self.rows):
+            nodes = self.rows[row]
+            if nodes is not None:
+                return nodes
+        return ((self.emptyNode.grammar, 0, None, 0),)
+
     def grammarIndexFromRowCol(self, row, col):
         """
         Returns:
             index. |index| may then be passed to grammarAtIndex().
         """
-        if row + 1 >= len(
-                self.rows):  # or self.rows[row + 1] > len(self.parserNodes):
-            # This file is too large. There's other ways to handle this, but for
-            # now let's leave the tail un-highlighted.
+        if row >= len(self.rows) or self.rows[row] is None:
+            # The row hasn't been parsed yet (e.g. the file is too large to
+            # parse all at once), leave it un-highlighted for now.
             return 0
-        gl = self.parserNodes[self.rows[row]:self.rows[row + 1]] + [
-            self.endNode
-        ]
-        offset = gl[0][kVisual] + col
+        gl = self.rows[row] + (self.endNode,)
+        offset = col
         # Binary search to find the node for the column.
         low = 0
         high = len(gl) - 1
@@ -132,27 +195,40 @@ class Parser:
             relative to the |col| parameter.
         """
         if app.config.strict_debug:
-            assert row < len(self.rows), row
+            assert row < len(self.lines), row
         eol = True
         finalResult = (self.emptyNode, 0, 0, eol)
-        rowIndex = self.rows[row]
-        if rowIndex + index + 1 >= len(self.parserNodes):
+        nodes = self.__rowNodes(row)
+        isLastRow = row + 1 >= len(self.lines)
+        if index + 1 < len(nodes):
+            nextOffset = nodes[index + 1][kVisual]
+        elif index + 1 == len(nodes):
+            # The next node is the start of the next row (after the new line).
+            nextOffset = self.rowWidth(row) + (not isLastRow)
+        elif index == len(nodes) and not isLastRow:
+            # Past the end of the row, carry on with the grammar the next row
+            # starts with (e.g. to fill the rest of a row within a comment).
+            node = self.__rowNodes(row + 1)[0]
+            return ParserNode(*node), 0, 1, False
+        else:
             return finalResult
-        nextOffset = self.parserNodes[rowIndex + index + 1][kVisual]
-        offset = self.parserNodes[rowIndex][kVisual] + col
+        offset = col
         remaining = nextOffset - offset
         if remaining < 0:
             return finalResult
-        node = self.parserNodes[rowIndex + index]
+        node = nodes[index]
         eol = False
         return ParserNode(*node), offset - node[kVisual], remaining, eol
 
     def parse(self, bgThread, appPrefs, data, grammar, beginRow, endRow):
         """
         Args:
-          data (string): The file contents. The document.
+          data (list or string): The rows of the document, e.g.
+              TextBuffer.lines (a string is split into rows). The rows are
+              read as they are needed, so changes to them must be noted with
+              noteLinesChanged() before the next parse.
           grammar (object): The initial grammar (often determined by the file
-              extension). If |beginRow| is not zero then grammar is ignored.
+              extension).
           beginRow (int): is the first row (which is line number - 1) in data
               that is has changed since the previous parse of this data. Pass
               zero to parse the entire document. If beginRow >= len(data) then
@@ -162,57 +238,21 @@ class Parser:
               million rows are needed (which can save a lot of cpu time).
         """
         app.log.parser('grammar', grammar['name'])
-        # Trim partially parsed data.
-        if self.fullyParsedToLine < beginRow:
-            beginRow = self.fullyParsedToLine
-
+        if isinstance(data, unicode):
+            data = data.split(u'\n')
+        if data is not self.lines or len(data) != len(self.rows):
+            # Not the rows that were parsed before.
+            self.lines = data
+            self.noteLinesReplaced()
         self.emptyNode = ParserNode(grammar, None, None, 0)
-        self.data = data
         self.endRow = endRow
-        if beginRow > 0:  # and len(self.rows):
-            if beginRow < len(self.rows):
-                self.parserNodes = self.parserNodes[:self.rows[beginRow]]
-                self.rows = self.rows[:beginRow]
-        else:
-            # First time parse. Do a parse of the whole file.
-            self.parserNodes = [(grammar, 0, None, 0)]
-            self.rows = [0]
-        if self.endRow > len(self.rows):
-            self.__buildGrammarList(bgThread, appPrefs)
-        self.fullyParsedToLine = len(self.rows)
-        self.__fastLineParse(grammar)
+        self.__buildGrammarList(bgThread, appPrefs, grammar, beginRow)
         #self.debug_checkLines(app.log.parser, data)
-        #startTime = time.time()
         if app.log.enabledChannels.get('parser', False):
-            self.debugLog(app.log.parser, data)
-        #app.log.startup('parsing took', time.time() - startTime)
-
-    def __fastLineParse(self, grammar):
-        """If there's not enough time to thoroughly parse the file, identify the
-        lines so that the document can still be edited.
-        """
-        data = self.data
-        offset = self.parserNodes[self.rows[-1]][kBegin]
-        visual = self.parserNodes[self.rows[-1]][kVisual]
-        limit = len(data)
-        while True:
-            while offset < limit and data[offset] != '\n':
-                if data[offset] >= app.curses_util.MIN_DOUBLE_WIDE_CHARACTER:
-                    visual += 2
-                else:
-                    visual += 1
-                offset += 1
-            if offset >= limit:
-                # Add a terminating (end) node.
-                self.parserNodes.append((grammar, len(data), None, visual))
-                break
-            offset += 1
-            visual += 1
-            self.rows.append(len(self.parserNodes))
-            self.parserNodes.append((grammar, offset, None, visual))
+            self.debugLog(app.log.parser)
 
     def rowCount(self):
-        return len(self.rows)
+        return len(self.lines)
 
     def rowText(self, row):
         """Get the text for |row|.
@@ -225,14 +265,7 @@ class Parser:
         """
         if app.config.strict_debug:
             assert isinstance(row, int)
-            assert isinstance(self.data, unicode)
-        begin = self.parserNodes[self.rows[row]][kBegin]
-        if row + 1 >= len(self.rows):
-            return self.data[begin:]
-        end = self.parserNodes[self.rows[row + 1]][kBegin]
-        if len(self.data) and self.data[end - 1] == '\n':
-            end -= 1
-        return self.data[begin:end]
+        return app.line_store.unescapeControlCharacters(self.lines[row])
 
     def charAt(self, row, col):
         """Get the character at |row|, |col|.
@@ -247,21 +280,14 @@ class Parser:
         if app.config.strict_debug:
             assert isinstance(row, int)
             assert isinstance(col, int)
-            assert isinstance(self.data, unicode)
-        if row > len(self.rows):
+        if row >= len(self.lines):
             return None
-        begin = self.parserNodes[self.rows[row]][kBegin]
-        if row + 1 >= len(self.rows):
-            end = self.parserNodes[-1][kBegin]
-        else:
-            end = self.parserNodes[self.rows[row + 1]][kBegin]
-        while begin < end:
+        for ch in self.rowText(row):
             if col <= 0:
-                return self.data[begin]
-            if self.data[begin] >= app.curses_util.MIN_DOUBLE_WIDE_CHARACTER:
+                return ch
+            if ch >= app.curses_util.MIN_DOUBLE_WIDE_CHARACTER:
                 col -= 1
             col -= 1
-            begin += 1
         return None
 
     def rowTextAndWidth(self, row):
@@ -278,23 +304,8 @@ class Parser:
         Returns:
             (text, columnWidth) (tuple)
         """
-        if app.config.strict_debug:
-            assert isinstance(row, int)
-        begin = self.parserNodes[self.rows[row]][kBegin]
-        visual = self.parserNodes[self.rows[row]][kVisual]
-        if row + 1 < len(self.rows):
-            end = self.parserNodes[self.rows[row + 1]][kBegin]
-            visualEnd = self.parserNodes[self.rows[row + 1]][kVisual]
-            if len(self.data) and self.data[end - 1] == '\n':
-                end -= 1
-                visualEnd -= 1
-        else:
-            # There is a sentinel node at the end that records the end of
-            # document.
-            lastNode = self.parserNodes[-1]
-            end = lastNode[kBegin]
-            visualEnd = lastNode[kVisual]
-        return self.data[begin:end], visualEnd - visual
+        text = self.rowText(row)
+        return text, len(text) + len(kReDoubleWide.findall(text))
 
     def rowWidth(self, row):
         """Get the visual/display column width of a row.
@@ -309,129 +320,186 @@ class Parser:
         Returns:
             columnWidth (int)
         """
-        if app.config.strict_debug:
-            assert isinstance(row, int)
-        visual = self.parserNodes[self.rows[row]][kVisual]
-        if row + 1 < len(self.rows):
-            end = self.parserNodes[self.rows[row + 1]][kBegin]
-            visualEnd = self.parserNodes[self.rows[row + 1]][kVisual]
-            if len(self.data) and self.data[end - 1] == '\n':
-                visualEnd -= 1
-        else:
-            # There is a sentinel node at the end that records the end of
-            # document.
-            lastNode = self.parserNodes[-1]
-            visualEnd = lastNode[kVisual]
-        return visualEnd - visual
+        return self.rowTextAndWidth(row)[1]
+
+    def __startAbove(self, grammar, row):
+        """Find where to start parsing to learn the grammar that |row| begins
+        with. That's the row above it, or further up if a dynamic end tag (see
+        'end_key') is needed, since it's only set up where its grammar begins.
 
-    def __buildGrammarList(self, bgThread, appPrefs):
+        Returns:
+            (row, nodes, cursor, visual, previous node) to parse from.
+        """
+        rows = self.rows
+        row = max(0, row - 1)
+        while row and rows[row][0][kGrammar].get('end_key'):
+            row -= 1
+        if row:
+            return row, [rows[row][0]], 0, 0, rows[row - 1][-1]
+        cursor = 0
+        # At the start of the document, skip the 'begin' part of the grammar.
+        beginRegex = grammar.get('begin')
+        if beginRegex is not None:
+            sre = re.match(beginRegex, self.rowText(0))
+            if sre is not None:
+                cursor = sre.regs[0][1]
+        # The visual offset assumes single-wide characters.
+        return 0, [(grammar, 0, None, 0)], cursor, cursor, None
+
+    def __buildGrammarList(self, bgThread, appPrefs, grammar, beginRow):
         """The guts of the parser. This is where the heavy lifting is done.
 
+        The rows are parsed one at a time, from the row above the first changed
+        row. Once the grammar at the start of a row is as it was before, the
+        rows from there to the next changed row are also as they were, and are
+        skipped.
+
         This code can be interrupted (by |bgThread|) and resumed (by calling it
         again).
         """
+        rows = self.rows
+        rowLimit = len(rows)
+        row = min(beginRow, self.fullyParsedToLine)
+        self.fullyParsedToLine = row
+        if row >= min(self.endRow, rowLimit):
+            return
+        resume, self.__resume = self.__resume, None
+        if (resume is not None and resume[0] == row and
+                not resume[1][-1][kGrammar].get('end_key')):
+            row, nodes, cursor, visual, previous = resume
+        else:
+            row, nodes, cursor, visual, previous = self.__startAbove(
+                grammar, row)
+        # The nodes |row| had before this parse (None if it had changed).
+        old = rows[row]
+        text = self.rowText(row)
+        if row + 1 < rowLimit:
+            text += u'\n'
         # An arbitrary limit to avoid run-away looping.
         leash = 50000
-        topNode = self.parserNodes[-1]
-        cursor = topNode[kBegin]
-        visual = topNode[kVisual]
-        # If we are at the start of a grammar, skip the 'begin' part of the
-        # grammar.
-        if (len(self.parserNodes) == 1 or
-                topNode[kGrammar] is not self.parserNodes[-2][kGrammar]):
-            beginRegex = topNode[kGrammar].get('begin')
-            if beginRegex is not None:
-                sre = re.match(beginRegex, self.data[cursor:])
-                if sre is not None:
-                    cursor += sre.regs[0][1]
-                    visual += sre.regs[0][1]  # Assumes single-wide characters.
-        while self.endRow > len(self.rows):
-            if not leash:
-                #app.log.error('grammar likely caught in a loop')
-                break
+        while True:
+            if not leash or bgThread and bgThread.hasUserEvent():
+                # Pick up from here on the next parse.
+                if old is not None:
+                    rows[row] = None
+                    self.__changedCount += 1
+                self.__resume = (row, nodes, cursor, visual, previous)
+                self.fullyParsedToLine = row
+                return
             leash -= 1
-            if bgThread and bgThread.hasUserEvent():
-                break
-            subdata = self.data[cursor:]
-            found = self.parserNodes[-1][kGrammar].get('matchRe').search(
-                subdata)
+            topNode = nodes[-1]
+            subdata = text[cursor:]
+            found = topNode[kGrammar].get('matchRe').search(subdata)
+            # Where |nodes| is split when the row ends.
+            rowBreak = None
             if not found:
-                #app.log.info('parser exit, match not found')
-                # todo(dschuyler): mark parent grammars as unterminated (if they
-                # expect be terminated). e.g. unmatched string quote or xml tag.
-                break
-            index = -1
-            foundGroups = found.groups()
-            for k in foundGroups:
-                index += 1
-                if k is not None:
-                    break
-            reg = found.regs[index + 1]
-            if index == 0:
-                # Found escaped value.
-                cursor += reg[1]
-                visual += reg[1]
-                continue
-            if index == len(foundGroups) - 1:
-                # Found new line.
-                child = (self.parserNodes[-1][kGrammar], cursor + reg[1],
-                         self.parserNodes[-1][kPrior], visual + reg[1])
-                cursor += reg[1]
-                visual += reg[1]
-                self.rows.append(len(self.parserNodes))
-            elif index == len(foundGroups) - 2:
-                # Found double wide character.
-                topNode = self.parserNodes[-1]
-                regBegin, regEnd = reg
-                # First, add any preceding single wide characters.
-                if regBegin > 0:
-                    self.parserNodes.append((topNode[kGrammar], cursor,
-                                             topNode[kPrior], visual))
-                    cursor += regBegin
-                    visual += regBegin
-                    # Remove the regular text from reg values.
-                    regEnd -= regBegin
-                    regBegin = 0
-                # Resume current grammar; store the double wide characters.
-                child = (topNode[kGrammar], cursor, topNode[kPrior], visual)
-                cursor += regEnd
-                visual += regEnd * 2
-            elif index == 1:
-                # Found end of current grammar section (an 'end').
-                child = (
-                    self.parserNodes[self.parserNodes[-1][kPrior]][kGrammar],
-                    cursor + reg[1],
-                    self.parserNodes[self.parserNodes[-1][kPrior]][kPrior],
-                    visual + reg[1])
-                cursor = child[kBegin]
-                visual += reg[1]
-                if subdata[reg[1] - 1] == '\n':
-                    # This 'end' ends with a new line.
-                    self.rows.append(len(self.parserNodes))
+                if row + 1 >= rowLimit:
+                    # The end of the document.
+                    # todo(dschuyler): mark parent grammars as unterminated (if
+                    # they expect be terminated). e.g. unmatched string quote or
+                    # xml tag.
+                    if old is None:
+                        self.__changedCount -= 1
+                    rows[row] = tuple(nodes)
+                    self.fullyParsedToLine = rowLimit
+                    return
+                # End the row as if the new line was found.
+                rowBreak = len(nodes)
+                child = (topNode[kGrammar], len(text), topNode[kPrior],
+                         visual + len(subdata))
+                cursor = len(text)
+                visual += len(subdata)
+                nodes.append(child)
             else:
-                [
-                    containsGrammarIndexLimit, nextGrammarIndexLimit,
-                    errorIndexLimit, keywordIndexLimit, typeIndexLimit,
-                    specialIndexLimit
-                ] = self.parserNodes[-1][kGrammar]['indexLimits']
-                if index < containsGrammarIndexLimit:
-                    # A new grammar within this grammar (a 'contains').
-                    if subdata[reg[0]] == '\n':
-                        # This 'begin' begins with a new line.
-                        self.rows.append(len(self.parserNodes))
-                    priorGrammar = self.parserNodes[-1][kGrammar].get(
-                        'matchGrammars', [])[index]
-                    if priorGrammar['end'] is None:
-                        # Found single regex match (a leaf grammar).
-                        self.parserNodes.append((priorGrammar, cursor + reg[0],
-                                                 len(self.parserNodes) - 1,
-                                                 visual + reg[0]))
-                        # Resume the current grammar.
-                        child = (self.parserNodes[self.parserNodes[-1][kPrior]]
-                                 [kGrammar], cursor + reg[1], self.parserNodes[
-                                     self.parserNodes[-1][kPrior]][kPrior],
-                                 visual + reg[1])
-                    else:
+                index = -1
+                foundGroups = found.groups()
+                for k in foundGroups:
+                    index += 1
+                    if k is not None:
+                        break
+                reg = found.regs[index + 1]
+                if index == 0:
+                    # Found escaped value.
+                    cursor += reg[1]
+                    visual += reg[1]
+                    continue
+                if index == len(foundGroups) - 1:
+                    # Found new line.
+                    child = (topNode[kGrammar], cursor + reg[1],
+                             topNode[kPrior], visual + reg[1])
+                    cursor += reg[1]
+                    visual += reg[1]
+                    rowBreak = len(nodes)
+                elif index == len(foundGroups) - 2:
+                    # Found double wide character.
+                    regBegin, regEnd = reg
+                    # First, add any preceding single wide characters.
+                    if regBegin > 0:
+                        nodes.append((topNode[kGrammar], cursor,
+                                      topNode[kPrior], visual))
+                        cursor += regBegin
+                        visual += regBegin
+                        # Remove the regular text from reg values.
+                        regEnd -= regBegin
+                        regBegin = 0
+                    # Resume current grammar; store the double wide characters.
+                    child = (topNode[kGrammar], cursor, topNode[kPrior], visual)
+                    cursor += regEnd
+                    visual += regEnd * 2
+                elif index == 1:
+                    # Found end of current grammar section (an 'end').
+                    prior = topNode[kPrior]
+                    child = (prior[0], cursor + reg[1], prior[1],
+                             visual + reg[1])
+                    cursor = child[kBegin]
+                    visual += reg[1]
+                    if subdata[reg[1] - 1] == '\n':
+                        # This 'end' ends with a new line.
+                        rowBreak = len(nodes)
+                else:
+                    [
+                        containsGrammarIndexLimit, nextGrammarIndexLimit,
+                        errorIndexLimit, keywordIndexLimit, typeIndexLimit,
+                        specialIndexLimit
+                    ] = topNode[kGrammar]['indexLimits']
+                    # The grammar to resume after a child grammar.
+                    context = (topNode[kGrammar], topNode[kPrior])
+                    if index < containsGrammarIndexLimit:
+                        # A new grammar within this grammar (a 'contains').
+                        if subdata[reg[0]] == '\n':
+                            # This 'begin' begins with a new line.
+                            rowBreak = len(nodes)
+                        priorGrammar = topNode[kGrammar].get(
+                            'matchGrammars', [])[index]
+                        if priorGrammar['end'] is None:
+                            # Found single regex match (a leaf grammar).
+                            nodes.append((priorGrammar, cursor + reg[0],
+                                          context, visual + reg[0]))
+                            # Resume the current grammar.
+                            child = (topNode[kGrammar], cursor + reg[1],
+                                     topNode[kPrior], visual + reg[1])
+                        else:
+                            if priorGrammar.get('end_key'):
+                                # A dynamic end tag.
+                                hereKey = re.search(
+                                    priorGrammar['end_key'],
+                                    subdata[reg[0]:]).groups()[0]
+                                markers = priorGrammar['markers']
+                                markers[1] = priorGrammar['end'].replace(
+                                    r'\0', re.escape(hereKey))
+                                priorGrammar['matchRe'] = re.compile(
+                                    app.regex.joinReList(markers))
+                            child = (priorGrammar, cursor + reg[0], context,
+                                     visual + reg[0])
+                        cursor += reg[1]
+                        visual += reg[1]
+                    elif index < nextGrammarIndexLimit:
+                        # A new grammar follows this grammar (a 'next').
+                        if subdata[reg[0]] == '\n':
+                            # This 'begin' begins with a new line.
+                            rowBreak = len(nodes)
+                        priorGrammar = topNode[kGrammar].get(
+                            'matchGrammars', [])[index]
                         if priorGrammar.get('end_key'):
                             # A dynamic end tag.
                             hereKey = re.search(priorGrammar['end_key'],
@@ -441,103 +509,91 @@ class Parser:
                                 r'\0', re.escape(hereKey))
                             priorGrammar['matchRe'] = re.compile(
                                 app.regex.joinReList(markers))
+                        # Resume the grammar before this one.
+                        before = (nodes[-2] if len(nodes) > 1 else
+                                  previous or topNode)
                         child = (priorGrammar, cursor + reg[0],
-                                 len(self.parserNodes) - 1, visual + reg[0])
-                    cursor += reg[1]
-                    visual += reg[1]
-                elif index < nextGrammarIndexLimit:
-                    # A new grammar follows this grammar (a 'next').
-                    if subdata[reg[0]] == '\n':
-                        # This 'begin' begins with a new line.
-                        self.rows.append(len(self.parserNodes))
-                    priorGrammar = self.parserNodes[-1][kGrammar].get(
-                        'matchGrammars', [])[index]
-                    if priorGrammar.get('end_key'):
-                        # A dynamic end tag.
-                        hereKey = re.search(priorGrammar['end_key'],
-                                            subdata[reg[0]:]).groups()[0]
-                        markers = priorGrammar['markers']
-                        markers[1] = priorGrammar['end'].replace(
-                            r'\0', re.escape(hereKey))
-                        priorGrammar['matchRe'] = re.compile(
-                            app.regex.joinReList(markers))
-                    child = (priorGrammar, cursor + reg[0],
-                             len(self.parserNodes) - 2, visual + reg[0])
-                    cursor += reg[1]
-                    visual += reg[1]
-                elif index < errorIndexLimit:
-                    # A special doesn't change the nodeIndex.
-                    self.parserNodes.append(
-                        (appPrefs.grammars['error'], cursor + reg[0],
-                         len(self.parserNodes) - 1, visual + reg[0]))
-                    # Resume the current grammar.
-                    child = (
-                        self.parserNodes[self.parserNodes[-1]
-                                         [kPrior]][kGrammar], cursor + reg[1],
-                        self.parserNodes[self.parserNodes[-1][kPrior]][kPrior],
-                        visual + reg[1])
-                    cursor += reg[1]
-                    visual += reg[1]
-                elif index < keywordIndexLimit:
-                    # A keyword doesn't change the nodeIndex.
-                    self.parserNodes.append(
-                        (appPrefs.grammars['keyword'], cursor + reg[0],
-                         len(self.parserNodes) - 1, visual + reg[0]))
-                    # Resume the current grammar.
-                    child = (
-                        self.parserNodes[self.parserNodes[-1]
-                                         [kPrior]][kGrammar], cursor + reg[1],
-                        self.parserNodes[self.parserNodes[-1][kPrior]][kPrior],
-                        visual + reg[1])
-                    cursor += reg[1]
-                    visual += reg[1]
-                elif index < typeIndexLimit:
-                    # A type doesn't change the nodeIndex.
-                    self.parserNodes.append(
-                        (appPrefs.grammars['type'], cursor + reg[0],
-                         len(self.parserNodes) - 1, visual + reg[0]))
-                    # Resume the current grammar.
-                    child = (
-                        self.parserNodes[self.parserNodes[-1]
-                                         [kPrior]][kGrammar], cursor + reg[1],
-                        self.parserNodes[self.parserNodes[-1][kPrior]][kPrior],
-                        visual + reg[1])
-                    cursor += reg[1]
-                    visual += reg[1]
-                elif index < specialIndexLimit:
-                    # A special doesn't change the nodeIndex.
-                    self.parserNodes.append(
-                        (appPrefs.grammars['special'], cursor + reg[0],
-                         len(self.parserNodes) - 1, visual + reg[0]))
-                    # Resume the current grammar.
-                    child = (
-                        self.parserNodes[self.parserNodes[-1]
-                                         [kPrior]][kGrammar], cursor + reg[1],
-                        self.parserNodes[self.parserNodes[-1][kPrior]][kPrior],
-                        visual + reg[1])
-                    cursor += reg[1]
-                    visual += reg[1]
-                else:
-                    app.log.error('invalid grammar index')
-            self.parserNodes.append(child)
-
-    def debugLog(self, out, data):
+                                 (before[kGrammar], before[kPrior]),
+                                 visual + reg[0])
+                        cursor += reg[1]
+                        visual += reg[1]
+                    elif index < specialIndexLimit:
+                        # An error, keyword, type, or special doesn't change
+                        # the current grammar.
+                        if index < errorIndexLimit:
+                            name = 'error'
+                        elif index < keywordIndexLimit:
+                            name = 'keyword'
+                        elif index < typeIndexLimit:
+                            name = 'type'
+                        else:
+                            name = 'special'
+                        nodes.append((appPrefs.grammars[name], cursor + reg[0],
+                                      context, visual + reg[0]))
+                        # Resume the current grammar.
+                        child = (topNode[kGrammar], cursor + reg[1],
+                                 topNode[kPrior], visual + reg[1])
+                        cursor += reg[1]
+                        visual += reg[1]
+                    else:
+                        app.log.error('invalid grammar index')
+                        continue
+                nodes.append(child)
+                if rowBreak is None:
+                    continue
+            # The row is done; the nodes after |rowBreak| begin the next row.
+            finished = tuple(nodes[:rowBreak])
+            if old is None:
+                self.__changedCount -= 1
+            rows[row] = finished
+            nodes = [(node[kGrammar], max(0, node[kBegin] - cursor),
+                      node[kPrior], max(0, node[kVisual] - visual))
+                     for node in nodes[rowBreak:]]
+            previous = finished[-1]
+            cursor = 0
+            visual = 0
+            row += 1
+            nextOld = rows[row]
+            if (old is not None and nextOld is not None and
+                    isSameNode(old[-1], previous) and
+                    len(nextOld) >= len(nodes) and
+                    all(isSameNode(a, b) for a, b in zip(nextOld, nodes)) and
+                    not nodes[-1][kGrammar].get('end_key')):
+                # The grammar at the start of |row| is as it was, so the rows
+                # up to the next changed row are too.
+                if not self.__changedCount:
+                    self.fullyParsedToLine = rowLimit
+                    return
+                row = rows.index(None, row)
+                self.fullyParsedToLine = row
+                if row >= self.endRow:
+                    return
+                row, nodes, cursor, visual, previous = self.__startAbove(
+                    grammar, row)
+                nextOld = rows[row]
+            elif row >= self.endRow:
+                # The rows from here are parsed on a later parse.
+                if nextOld is not None:
+                    rows[row] = None
+                    self.__changedCount += 1
+                self.fullyParsedToLine = row
+                return
+            old = nextOld
+            text = self.rowText(row)
+            if row + 1 < rowLimit:
+                text += u'\n'
+
+    def debugLog(self, out):
         out('parser debug:')
         out('RowList ----------------', len(self.rows))
-        for i, start in enumerate(self.rows):
-            if i + 1 < len(self.rows):
-                end = self.rows[i + 1]
-            else:
-                end = len(self.parserNodes)
-            out('row', i, '(line', str(i + 1) + ') index', start, 'to', end)
-            for node in self.parserNodes[start:end]:
-                if node is None:
-                    out('a None')
-                    continue
-                nodeBegin = node[kBegin]
-                out('  ParserNode %26s prior %4s, b%4d, v%4d, %s' % (
-                    node[kGrammar].get('name', 'None'), node[kPrior], nodeBegin,
-                    node[kVisual], repr(data[nodeBegin:nodeBegin + 15])[1:-1]))
+        for i, nodes in enumerate(self.rows):
+            if nodes is None:
+                out('row', i, '(line', str(i + 1) + ') not parsed')
+                continue
+            out('row', i, '(line', str(i + 1) + ')', len(nodes), 'nodes')
+            text = self.rowText(i)
+            for node in nodes:
+                ParserNode(*node).debugLog(out, '  ', text)
 
     def debug_checkLines(self, out, data):
         """Debug test that all the lines were recognized by the parser. This is
@@ -574,3 +630,61 @@ class Parser:
                             repr(line), repr(piecedLine)))
                     break
                 k += remaining
+
+
+class LinesParser:
+    """Presents a sequence of lines through the Parser interface, without
+    parsing grammars. This is for documents that are too large to parse, e.g.
+    an app.line_store.MappedLines.
+    """
+
+    def __init__(self, lines):
+        self.lines = lines
+        self.emptyNode = ParserNode({}, None, None, 0)
+        self.fullyParsedToLine = len(lines)
+
+    def grammarIndexFromRowCol(self, row, col):
+        return 0
+
+    def grammarAt(self, row, col):
+        return self.emptyNode.grammar
+
+    def grammarAtIndex(self, row, col, index):
+        """See Parser.grammarAtIndex(). The whole row is one node."""
+        width = self.rowWidth(row)
+        if index or col >= width:
+            return self.emptyNode, 0, 0, True
+        return self.emptyNode, col, width - col, False
+
+    def parse(self, bgThread, appPrefs, data, grammar, beginRow, endRow):
+        """Only makes sure the rows of |data| (the lines) up to |endRow| are
+        available."""
+        self.lines = data
+        self.emptyNode = ParserNode(grammar, None, None, 0)
+        if endRow > len(self.lines) and not self.lines.isComplete():
+            self.lines.indexMore(endRow)
+        self.fullyParsedToLine = len(self.lines)
+
+    def rowCount(self):
+        return len(self.lines)
+
+    def rowText(self, row):
+        return self.lines[row]
+
+    def charAt(self, row, col):
+        if row >= len(self.lines):
+            return None
+        for ch in self.lines[row]:
+            if col <= 0:
+                return ch
+            if ch >= app.curses_util.MIN_DOUBLE_WIDE_CHARACTER:
+                col -= 1
+            col -= 1
+        return None
+
+    def rowTextAndWidth(self, row):
+        text = self.lines[row]
+        return text, len(text) + len(kReDoubleWide.findall(text))
+
+    def rowWidth(self, row):
+        return self.rowTextAndWidth(row)[1]
@@ -88,6 +88,9 @@ class ProgramWindow(app.window.ActiveWindow):
 
     def executeCommandList(self, cmdList):
         for cmd, eventInfo in cmdList:
+            if cmd == app.curses_util.FILES_CHANGED:
+                self.program.bufferManager.filesChanged(eventInfo)
+                continue
             self.doPreCommand()
             if cmd == curses.KEY_RESIZE:
                 self.handleScreenResize(self.focusedWindow)
@@ -96,6 +99,8 @@ class ProgramWindow(app.window.ActiveWindow):
             if cmd == curses.KEY_MOUSE:
                 self.handleMouse(eventInfo)
             self.focusedWindow.controller.onChange()
+        # Files may have been opened, closed, or saved under a new name.
+        self.program.bufferManager.updateWatchedFiles()
 
     def findCommonRoot(self, first, second):
         """Find the Window that is the parent of both |first| and |second|. If
@@ -159,6 +164,9 @@ class ProgramWindow(app.window.ActiveWindow):
         while win is not None and win is not self:
             finished = finished and win.longTimeSlice()
             win = win.parent
+        if finished:
+            # Idle, so save the recovery journals.
+            self.program.bufferManager.flushJournals()
         return finished
 
     def shortTimeSlice(self):
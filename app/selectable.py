@@ -164,12 +164,12 @@ class Selectable(BaseLineBuffer):
             assert isinstance(lowerCol, int)
             assert upperRow <= lowerRow
             assert upperRow != lowerRow or upperCol <= lowerCol
-        if self.upperChangedRow > upperRow:
-            self.upperChangedRow = upperRow
         if self.selectionMode == kSelectionBlock:
             for i in range(upperRow, lowerRow + 1):
                 line = self.lines[i]
                 self.lines[i] = line[:upperCol] + line[lowerCol:]
+            self.noteLinesChanged(upperRow, lowerRow + 1 - upperRow,
+                                  lowerRow + 1 - upperRow)
         elif (self.selectionMode == kSelectionNone or
               self.selectionMode == kSelectionAll or
               self.selectionMode == kSelectionCharacter or
@@ -180,6 +180,7 @@ class Selectable(BaseLineBuffer):
             self.lines[upperRow] = upperLine[:upperCol] + lowerLine[lowerCol:]
             if upperRow != lowerRow:
                 del self.lines[upperRow + 1:lowerRow + 1]
+            self.noteLinesChanged(upperRow, lowerRow + 1 - upperRow, 1)
 
     def insertLines(self, lines):
         if app.config.strict_debug:
@@ -195,31 +196,38 @@ class Selectable(BaseLineBuffer):
         if len(lines) == 0:
             return
         lines = list(lines)
-        if self.upperChangedRow > row:
-            self.upperChangedRow = row
         if selectionMode == kSelectionBlock:
             for i, line in enumerate(lines):
                 self.lines[row + i] = (self.lines[row + i][:col] + line +
                                        self.lines[row + i][col:])
                 self.lines.insert(row, line)
+            self.noteLinesChanged(row, len(lines), 2 * len(lines))
         elif (selectionMode == kSelectionNone or
               selectionMode == kSelectionAll or
               selectionMode == kSelectionCharacter or
               selectionMode == kSelectionLine or
               selectionMode == kSelectionWord):
-            lines.reverse()
             firstLine = self.lines[row]
             if len(lines) == 1:
                 self.lines[row] = (firstLine[:col] + lines[0] + firstLine[col:])
             else:
-                self.lines[row] = (firstLine[:col] + lines[-1])
-                currentRow = row + 1
-                self.lines.insert(currentRow, lines[0] + firstLine[col:])
-                for line in lines[1:-1]:
-                    self.lines.insert(currentRow, line)
+                # One slice assignment, rather than inserting the rows one at a
+                # time (each of which moves all of the rows after it).
+                lines[0] = firstLine[:col] + lines[0]
+                lines[-1] += firstLine[col:]
+                self.lines[row:row + 1] = lines
+            self.noteLinesChanged(row, 1, len(lines))
         else:
             app.log.info('selection mode not recognized', selectionMode)
 
+    def noteLinesChanged(self, row, removedCount, addedCount):
+        """Called after lines change. The |removedCount| lines starting at
+        |row| were replaced by |addedCount| lines (a modified line counts as
+        one removed and one added).
+        """
+        if self.upperChangedRow > row:
+            self.upperChangedRow = row
+
     def __extendWords(self, upperRow, upperCol, lowerRow, lowerCol):
         """Extends and existing selection to the nearest word boundaries. The
         pen and marker will be extended away from each other. The extension may
@@ -16,11 +16,13 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
+import bisect
 import curses
 import re
 import sys
 
 import app.actions
+import app.columns
 import app.curses_util
 import app.regex
 import app.log
@@ -120,13 +122,22 @@ class TextBuffer(app.actions.Actions):
             window.addStr(i, 0, ' ' * cols, color)
 
     def drawTextArea(self, window, top, left, rows, cols, colorDelta):
+        self.columnsDrawn = None
+        if (self.columnIndex is not None and
+                self.selectionMode == app.selectable.kSelectionNone):
+            window, shift = self.drawColumns(window, top, left, rows, cols,
+                                             colorDelta)
+            # Draw from further left, for the text that's moved right.
+            left -= shift
+            cols += shift
         startRow = self.view.scrollRow + top
         endRow = startRow + rows
         startCol = self.view.scrollCol + left
         endCol = startCol + cols
         appPrefs = self.view.program.prefs
         defaultColor = appPrefs.color['default']
-        spellChecking = appPrefs.editor.get('spellChecking', True)
+        spellChecking = (appPrefs.editor.get('spellChecking', True) and
+                         self.performanceTier < app.actions.kTierNoOverlays)
         colorPrefs = self.view.program.color
         spelling = self.program.dictionary
         spelling.setUpWordsForPath(self.fullPath)
@@ -195,12 +206,71 @@ class TextBuffer(app.actions.Actions):
                 window.addStr(top + i, left, line + ' ' * (cols - len(line)),
                               colorPrefs.get(u'default', colorDelta))
         self.drawOverlays(window, top, left, rows, cols, colorDelta)
+        self.drawExtraCursors(window, top, left, rows, cols, colorDelta)
         if 0:  # Experiment: draw our own cursor.
             if (startRow <= self.penRow < endRow and
                     startCol <= self.penCol < endCol):
                 window.addStr(self.penRow - startRow, self.penCol - startCol,
                               u'X', 200)
 
+    def drawColumns(self, window, top, left, rows, cols, colorDelta):
+        """Set up the rows in view to be drawn with their fields lined up in
+        columns (see app.columns). The columns fit the rows in view. The
+        cursor's row is left as it is, so that the cursor is where it would
+        be.
+
+        Returns:
+            An (app.columns.AlignedWindow, shift) tuple. The text of the rows
+            is drawn to the AlignedWindow as it would be drawn to |window|,
+            though from |shift| columns further left.
+        """
+        startRow = self.view.scrollRow + top
+        startCol = self.view.scrollCol + left
+        rowLimit = min(max(self.parser.rowCount() - startRow, 0), rows,
+                       max(len(self.lines) - startRow, 0))
+        index = self.columnIndex
+        # The rows with cursors are also left as they are.
+        cursorRows = set(row for row, _ in self.__extraCursorsIn(
+            startRow, startRow + rowLimit))
+        cursorRows.add(self.penRow)
+        viewRows = [
+            row for row in range(startRow, startRow + rowLimit)
+            if row not in cursorRows
+        ]
+        columnStarts = index.layout(self, viewRows)
+        alignedWindow = app.columns.AlignedWindow(window, left, left + cols,
+                                                  self.view.scrollCol)
+        color = self.view.program.color.get(u'default', colorDelta)
+        shift = 0
+        for row in viewRows:
+            fields = index.fields(self, row)
+            alignedWindow.alignRow(top + row - startRow, index, fields,
+                                   columnStarts)
+            # The space between the fields.
+            window.addStr(top + row - startRow, left, u' ' * cols, color)
+            shift = max(shift, startCol - index.unalignedColumn(
+                fields, columnStarts, startCol))
+        self.columnsDrawn = (columnStarts, set(viewRows))
+        return alignedWindow, shift
+
+    def drawExtraCursors(self, window, top, left, rows, cols, colorDelta):
+        """Draw the extra cursors (see Actions.cursorsActive()) in view."""
+        startRow = self.view.scrollRow + top
+        startCol = self.view.scrollCol + left
+        color = self.view.program.color.get(u'selected', colorDelta)
+        for row, col in self.__extraCursorsIn(startRow, startRow + rows):
+            if startCol <= col < startCol + cols:
+                window.addStr(top + row - startRow, left + col - startCol,
+                              self.lines[row][col:col + 1] or u' ', color)
+
+    def __extraCursorsIn(self, beginRow, endRow):
+        """Get the extra cursors on the rows from |beginRow| up to |endRow|."""
+        if not self.cursorsActive():
+            return []
+        cursors = self.extraCursors
+        return cursors[bisect.bisect_left(cursors, (beginRow,)):
+                       bisect.bisect_left(cursors, (endRow,))]
+
     def drawOverlays(self, window, top, left, maxRow, maxCol, colorDelta):
         startRow = self.view.scrollRow + top
         endRow = self.view.scrollRow + top + maxRow
@@ -208,7 +278,8 @@ class TextBuffer(app.actions.Actions):
         endCol = self.view.scrollCol + left + maxCol
         rowLimit = min(max(self.parser.rowCount() - startRow, 0), maxRow)
         colorPrefs = self.view.program.color
-        if 1:
+        overlays = self.performanceTier < app.actions.kTierNoOverlays
+        if overlays:
             # Highlight brackets.
             # Highlight numbers.
             # Highlight space ending lines.
@@ -226,7 +297,7 @@ class TextBuffer(app.actions.Actions):
                         highlightTrailingWhitespace):
                     window.addStr(top + i, column - self.view.scrollCol, s,
                                   colors[index])
-        if 1:
+        if overlays:
             # Match brackets.
             if (self.parser.rowCount() > self.penRow and
                     len(self.parser.rowText(self.penRow)) > self.penCol):
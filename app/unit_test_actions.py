@@ -16,10 +16,24 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
+import io
 import os
+import pickle
+import re
+import shutil
+import tempfile
 import unittest
 
+import app.actions
+import app.bookmark
+import app.history
+import app.line_filter
+import app.line_store
 import app.log
+import app.mutator
+import app.packed_payload
+import app.parser
+import app.selectable
 import app.text_buffer
 
 
@@ -216,6 +230,16 @@ class TextIndentTestCases(unittest.TestCase):
         checkRow(self, tb, 1, '  b:')
         checkRow(self, tb, 2, '    c:')
 
+    def test_vertical_insert(self):
+        tb = self.textBuffer
+        tb.fileFilter(u'a\nb\nc')
+        tb.parseDocument()
+        tb.verticalInsert(0, 1, 0, u'  ')
+        self.assertEqual(tb.lines, [u'  a', u'  b', u'c'])
+        self.assertEqual(tb.changesSince(tb.changeVersion - 1), [(0, 2, 2)])
+        tb.editUndo()
+        self.assertEqual(tb.lines, [u'a', u'b', u'c'])
+
 
 class TextInsertTestCases(unittest.TestCase):
 
@@ -280,6 +304,1081 @@ class TextInsertTestCases(unittest.TestCase):
         insert(ord('('), None)
         checkRow(self, tb, 0, '(o')
 
+    def test_parser_follows_edits(self):
+        tb = self.textBuffer
+        tb.rootGrammar = tb.program.prefs.grammars[u'cpp']
+        tb.insertLines(
+            tuple(u'line %d\x0109tab "%d"' % (i, i) if i % 7 else u'/* %d */' %
+                  (i,) for i in range(50)))
+        tb.parseDocument()
+
+        def check():
+            tb.parseDocument()
+            self.assertEqual(tb.parser.fullyParsedToLine, len(tb.lines))
+            self.assertEqual(tb.parser.rowCount(), len(tb.lines))
+            for row in (0, 20, len(tb.lines) - 1):
+                self.assertEqual(tb.parser.rowText(row),
+                                 tb.doLinesToData((tb.lines[row],)))
+            # The same as parsing the whole document again.
+            parser = app.parser.Parser()
+            parser.parse(None, tb.program.prefs, list(tb.lines),
+                         tb.rootGrammar, 0, len(tb.lines))
+            self.assertEqual(len(tb.parser.rows), len(parser.rows))
+            for nodes, expected in zip(tb.parser.rows, parser.rows):
+                self.assertEqual(len(nodes), len(expected))
+                for node, expectedNode in zip(nodes, expected):
+                    self.assertTrue(app.parser.isSameNode(node, expectedNode))
+
+        check()
+        tb.cursorMoveTo(30, 2)
+        tb.insert(u'abc')
+        check()
+        tb.carriageReturn()
+        check()
+        tb.backspace()
+        tb.backspace()
+        check()
+        tb.cursorMoveTo(10, 0)
+        tb.joinLines()
+        check()
+        tb.editUndo()
+        check()
+        tb.cursorMoveTo(49, 3)
+        tb.insert(u'\u3000\u3000')
+        check()
+        # Several changes between parses, only the changed rows are joined.
+        tb.cursorMoveTo(40, 1)
+        tb.carriageReturn()
+        tb.cursorMoveTo(12, 1)
+        tb.insert(u'x')
+        tb.joinLines()
+        tb.cursorMoveTo(25, 0)
+        tb.editPasteLines((u'one', u'two', u''))
+        check()
+        tb.editUndo()
+        tb.editUndo()
+        check()
+        # Changes to the last row.
+        tb.cursorMoveTo(len(tb.lines) - 2, 0)
+        tb.joinLines()
+        check()
+        tb.cursorMoveTo(len(tb.lines) - 1, 0)
+        tb.carriageReturn()
+        check()
+        tb.cursorMoveTo(len(tb.lines) - 1, 0)
+        tb.backspace()
+        check()
+        # A block comment changes the rows below it, up to its end.
+        tb.cursorMoveTo(2, 0)
+        tb.insert(u'/*')
+        check()
+        self.assertEqual(tb.parser.grammarAt(5, 0)[u'name'],
+                         u'cpp_block_comment')
+        # An edit within a row leaves the other rows as they were parsed.
+        kept = tb.parser.rows[30]
+        tb.cursorMoveTo(20, 2)
+        tb.insert(u'abc')
+        check()
+        self.assertIs(tb.parser.rows[30], kept)
+
+    def test_change_journal(self):
+        tb = self.textBuffer
+        tb.fileFilter(u'\n'.join(u'line %d' % (i,) for i in range(10)))
+        tb.parseDocument()
+        version = tb.changeVersion
+        self.assertFalse(tb.isDirty())
+        self.assertEqual(tb.changesSince(version), [])
+        tb.cursorMoveTo(3, 2)
+        tb.insert(u'abc')
+        self.assertEqual(tb.changesSince(version), [(3, 1, 1)])
+        self.assertTrue(tb.isRowModified(3))
+        self.assertFalse(tb.isRowModified(2))
+        self.assertFalse(tb.isRowModified(4))
+        tb.carriageReturn()
+        self.assertEqual(tb.changesSince(version), [(3, 1, 1), (3, 1, 2)])
+        self.assertTrue(tb.isRowModified(4))
+        self.assertFalse(tb.isRowModified(5))
+        self.assertEqual(len(tb.lineVersions), len(tb.lines))
+        # A consumer may follow along from the last version it saw.
+        version = tb.changeVersion
+        tb.cursorMoveTo(8, 0)
+        tb.joinLines()
+        self.assertEqual(tb.changesSince(version), [(8, 2, 1)])
+        self.assertEqual(len(tb.lineVersions), len(tb.lines))
+        for _ in range(4):
+            tb.editUndo()
+        self.assertEqual(len(tb.lineVersions), len(tb.lines))
+        self.assertFalse(tb.isDirty())
+        self.assertFalse(tb.isRowModified(3))
+        # Versions that have been trimmed from the journal give None.
+        for _ in range(2 * app.mutator.kChangeJournalLimit + 1):
+            tb.insert(u'x')
+        self.assertEqual(tb.changesSince(version), None)
+        self.assertEqual(len(tb.changesSince(tb.changeVersion - 5)), 5)
+
+    def test_undo_limit(self):
+        tb = self.textBuffer
+        tb.redoChainLimit = 16
+        tb.parseDocument()
+        for i in range(40):
+            tb.insert(u'a')
+            tb.carriageReturn()
+            tb.compoundChangePush()
+            tb.parseDocument()
+        self.assertLessEqual(len(tb.redoChain), 16 + 16 // 8)
+        self.assertEqual(tb.redoIndex, len(tb.redoChain))
+        self.assertEqual(tb.savedAtRedoIndex, -1)
+        self.assertTrue(tb.isDirty())
+        # Undo stops at the oldest remaining change.
+        kept = len(tb.redoChain)
+        for i in range(40):
+            tb.editUndo()
+        self.assertEqual(tb.redoIndex, 0)
+        self.assertEqual(len(tb.lines), 41 - kept)
+        for i in range(40):
+            tb.editRedo()
+        self.assertEqual(tb.lines, [u'a'] * 40 + [u''])
+
+    def test_paste_rows(self):
+        tb = self.textBuffer
+        tb.insertLines((u'before after', u'last'))
+        tb.cursorMoveTo(0, 7)
+        tb.editPasteData(u'one\ntwo\nthree ')
+        self.assertEqual(tb.lines,
+                         [u'before one', u'two', u'three after', u'last'])
+        self.assertEqual((tb.penRow, tb.penCol), (2, 6))
+        tb.editUndo()
+        self.assertEqual(tb.lines, [u'before after', u'last'])
+
+    def test_background_filter(self):
+        tb = self.textBuffer
+        self.prg.prefs.editor = dict(self.prg.prefs.editor, useBgThread=True)
+        rows = app.actions.kBackgroundFilterRows + 10
+        original = [u'%05d' % (i,) for i in range(rows, 0, -1)]
+        tb.insertLines(tuple(original))
+        tb.selectionAll()
+        tb.filterStart(
+            app.line_filter.SortFilter(list(tb.getSelectedText())))
+        self.assertEqual(tb.lines, original)
+        self.assertEqual(tb.filterProgress(), 0.0)
+        tb.cursorMoveTo(5, 0)
+        while not tb.filterMore():
+            self.assertLess(0.0, tb.filterProgress())
+        # The selection the filter started with is replaced, as one change.
+        self.assertEqual(tb.lines, sorted(original))
+        self.assertIsNone(tb.filterProgress())
+        tb.editUndo()
+        self.assertEqual(tb.lines, original)
+        # An edit cancels the filter.
+        tb.selectionAll()
+        tb.filterStart(
+            app.line_filter.SortFilter(list(tb.getSelectedText())))
+        self.assertFalse(tb.filterMore())
+        tb.selectionNone()
+        tb.cursorMoveTo(0, 0)
+        tb.insert(u'x')
+        self.assertTrue(tb.filterMore())
+        self.assertEqual(tb.message[0],
+                         u'The document changed, so the filter was cancelled')
+        self.assertEqual(tb.lines[1:], original[1:])
+        self.assertIsNone(tb.lineFilter)
+        tb.selectionAll()
+        tb.filterStart(
+            app.line_filter.SortFilter(list(tb.getSelectedText())))
+        self.assertTrue(tb.filterCancel())
+        self.assertFalse(tb.filterCancel())
+        self.assertTrue(tb.filterMore())
+
+    def test_multiple_cursors(self):
+        tb = self.textBuffer
+        tb.insertLines(tuple(u'row %d' % (i,) for i in range(1000)))
+        tb.parseDocument()
+        tb.cursorMoveTo(10, 3)
+        self.assertEqual(tb.cursorsOnSelectedRows(), 0)
+        tb.selectionCharacter()
+        tb.cursorMoveTo(999, 3)
+        self.assertEqual(tb.cursorsOnSelectedRows(), 990)
+        self.assertTrue(tb.cursorsActive())
+        self.assertEqual(tb.selectionMode, app.selectable.kSelectionNone)
+        version = tb.changeVersion
+        tb.insertPrintable(ord(u'_'), None)
+        tb.compoundChangePush()
+        # One change, noted once and undone as one.
+        self.assertEqual(tb.changeVersion, version + 1)
+        tb.editUndo()
+        tb.compoundChangePush()
+        self.assertEqual(tb.lines[10:], [u'row %d' % (i,)
+                                         for i in range(10, 1000)])
+        self.assertEqual((tb.penRow, tb.penCol), (999, 3))
+        tb.editRedo()
+        tb.compoundChangePush()
+        version += 2
+        self.assertEqual(tb.changesSince(version), [(10, 990, 990)])
+        self.assertEqual(tb.upperChangedRow, 10)
+        self.assertEqual(tb.lines[9], u'row 9')
+        self.assertEqual(tb.lines[10], u'row_ 10')
+        self.assertEqual(tb.lines[999], u'row_ 999')
+        self.assertEqual((tb.penRow, tb.penCol), (999, 4))
+        self.assertEqual(tb.extraCursors[:2], [(10, 4), (11, 4)])
+        # Only the rows with cursors are stamped as changed.
+        self.assertEqual(tb.lineVersion(10), tb.changeVersion)
+        self.assertLess(tb.lineVersion(9), version)
+        tb.editPasteData(u'ab')
+        tb.compoundChangePush()
+        tb.backspace()
+        tb.compoundChangePush()
+        self.assertEqual(tb.lines[10], u'row_a 10')
+        tb.delete()
+        tb.compoundChangePush()
+        self.assertEqual(tb.lines[10], u'row_a10')
+        self.assertEqual(tb.lines[999], u'row_a999')
+        self.assertEqual(tb.extraCursors[0], (10, 5))
+        self.assertEqual((tb.penRow, tb.penCol), (999, 5))
+        tb.editUndo()
+        tb.compoundChangePush()
+        tb.editUndo()
+        tb.compoundChangePush()
+        self.assertEqual(tb.lines[10], u'row_ab 10')
+        self.assertEqual(tb.extraCursors[0], (10, 6))
+        self.assertEqual((tb.penRow, tb.penCol), (999, 6))
+        tb.editRedo()
+        tb.compoundChangePush()
+        self.assertEqual(tb.lines[10], u'row_a 10')
+        self.assertEqual(tb.extraCursors[0], (10, 5))
+        self.assertEqual((tb.penRow, tb.penCol), (999, 5))
+        # Two cursors on a row.
+        tb.cursorsClear()
+        self.assertFalse(tb.cursorsActive())
+        tb.findRe = re.compile(u'a')
+        self.assertEqual(tb.cursorsOnFinds(), 990)
+        tb.findRe = re.compile(u'[0-9]')
+        self.assertEqual(tb.cursorsOnFinds(), 2890)
+        self.assertEqual((tb.penRow, tb.penCol), (0, 4))
+        tb.insert(u'<')
+        tb.compoundChangePush()
+        self.assertEqual(tb.lines[0], u'row <0')
+        self.assertEqual(tb.lines[10], u'row_a <1<0')
+        self.assertEqual(tb.extraCursors[9:11], [(10, 7), (10, 9)])
+        tb.editUndo()
+        tb.compoundChangePush()
+        self.assertEqual(tb.lines[10], u'row_a 10')
+        # Undo puts back the cursors of the change.
+        tb.editUndo()
+        tb.compoundChangePush()
+        self.assertEqual(tb.lines[10], u'row_ab 10')
+        self.assertEqual(tb.extraCursors[0], (10, 6))
+        # Another change drops the cursors.
+        tb.cursorMoveTo(3, 0)
+        tb.carriageReturn()
+        tb.compoundChangePush()
+        self.assertFalse(tb.cursorsActive())
+        tb.insert(u'x')
+        self.assertEqual(tb.lines[4], u'xrow 3')
+        self.assertEqual(tb.lines[11], u'row_ab 10')
+
+    def test_packed_undo_payloads(self):
+        tb = self.textBuffer
+        tb.parseDocument()
+        clip = tuple(u'pasted line %d' % (i,) for i in range(1000))
+        tb.editPasteLines(clip)
+        tb.compoundChangePush()
+        change = tb.redoChain[-1][0]
+        self.assertEqual(change[0], u'v')
+        self.assertIsInstance(change[1], app.packed_payload.PackedPayload)
+        self.assertEqual(app.packed_payload.unpack(change[1]), clip)
+        # Enough later changes will spill the payload to disk.
+        for i in range(app.mutator.kSpillAfterChangeCount):
+            tb.insert(u'a')
+            tb.compoundChangePush()
+            tb.parseDocument()
+            tb.carriageReturn()
+            tb.compoundChangePush()
+        self.assertTrue(change[1].isSpilled())
+        # The file history holds the data itself, not the spill location.
+        restored = pickle.loads(pickle.dumps(tb.redoChain))
+        self.assertEqual(app.packed_payload.unpack(restored[0][0][1]), clip)
+        while tb.redoIndex:
+            tb.parseDocument()
+            tb.editUndo()
+        self.assertEqual(tb.lines, [u''])
+        tb.editRedo()
+        self.assertEqual(tuple(tb.lines), clip)
+
+    def test_spill_file_compaction(self):
+        savedMinSize = app.packed_payload.kCompactMinSize
+        app.packed_payload.kCompactMinSize = 1
+        try:
+            clip = tuple(u'spilled line %d' % (i,) for i in range(1000))
+            payloads = [app.packed_payload.pack(clip) for _ in range(4)]
+            for i in range(len(payloads)):
+                payloads[i].spill()
+            size = app.packed_payload.spillFileSize()
+            # Dropping most of the payloads frees their part of the file.
+            del payloads[1:]
+            kept = app.packed_payload.pack(clip[:-1])
+            kept.spill()
+            self.assertLess(app.packed_payload.spillFileSize(), size)
+            self.assertEqual(payloads[0].value(), clip)
+            self.assertEqual(kept.value(), clip[:-1])
+            # With nothing spilled, the file is emptied.
+            del payloads[:]
+            del kept
+            last = app.packed_payload.pack(clip)
+            last.spill()
+            self.assertEqual(last.value(), clip)
+            self.assertLess(app.packed_payload.spillFileSize(), size // 3)
+        finally:
+            app.packed_payload.kCompactMinSize = savedMinSize
+
+    def test_find_replace(self):
+        tb = self.textBuffer
+        text = u'\n'.join(u'line %d foo' % (i,) if i % 3 else u'bar'
+                          for i in range(100))
+        tests = [
+            (u'/foo/baz/', u'Replaced 66 matches'),
+            (u'/o\\nb/X/', u'Replaced 33 matches'),
+            (u'/(\\w+) (\\d+)/\\2 \\1/', u'Replaced 66 matches'),
+            (u'/^b/B/', u'Replaced 34 matches'),
+            (u'/zzz/q/', u'No matches found'),
+        ]
+        for cmd, message in tests:
+            tb.fileFilter(text)
+            tb.parseDocument()
+            _, find, replace, flags = cmd.split(u'/')
+            expected = tb.doDataToLines(
+                tb.findReplaceText(find, replace, flags, text))
+            tb.findReplace(cmd)
+            self.assertEqual(tb.message[0], message)
+            self.assertEqual(tb.lines, expected)
+            tb.parseDocument()
+            self.assertEqual(tb.parser.rowText(len(expected) - 1),
+                             expected[-1])
+            tb.editUndo()
+            self.assertEqual(tb.doLinesToData(tb.lines), text)
+
+    def test_undo_to_index(self):
+        tb = self.textBuffer
+        tb.fileFilter(u'one\ntwo\nthree')
+        tb.restoreUserHistory()
+        tb.parseDocument()
+        states = {tb.redoIndex: list(tb.lines)}
+        for i in range(3 * app.mutator.kCheckpointInterval):
+            if i % 2:
+                tb.carriageReturn()
+            else:
+                tb.insert(u'%d' % (i,))
+            tb.compoundChangePush()
+            tb.parseDocument()
+            states[tb.redoIndex] = list(tb.lines)
+        self.assertGreater(len(tb.checkpoints), 2)
+        for index in (len(tb.redoChain) - 3, 5, 250, 420, len(tb.redoChain),
+                      0):
+            tb.undoToIndex(index)
+            self.assertEqual(tb.redoIndex, index)
+            self.assertEqual(tb.lines, states[index])
+            tb.parseDocument()
+        tb.undoToIndex(len(tb.redoChain))
+        self.assertTrue(tb.isDirty())
+        # Restoring a checkpoint only replaces the rows changed since it.
+        version = tb.lineVersion(len(tb.lines) - 1)
+        self.assertTrue(tb.editRevertToSaved())
+        self.assertFalse(tb.isDirty())
+        self.assertEqual(tb.lines, [u'one', u'two', u'three'])
+        self.assertEqual(tb.lineVersion(2), version)
+        # Only rows edited after the revert are modified.
+        tb.parseDocument()
+        tb.cursorMoveTo(1, 0)
+        tb.insert(u'2')
+        tb.compoundChangePush()
+        self.assertEqual(tb.lines, [u'one', u'2two', u'three'])
+        self.assertEqual([tb.isRowModified(i) for i in range(3)],
+                         [False, True, False])
+        self.assertEqual(list(tb.modifiedRows()), [1])
+
+    def test_packed_checkpoints(self):
+        tb = self.textBuffer
+        expected = [u'row %d' % (i,) for i in range(1000)]
+        tb.fileFilter(u'\n'.join(expected))
+        tb.lines = app.line_store.PackedLines(tb.lines)
+        tb.restoreUserHistory()
+        tb.parseDocument()
+        for i in range(2 * app.mutator.kCheckpointInterval):
+            tb.cursorMoveTo(i * 7 % 1000, 0)
+            tb.insert(u'x')
+            tb.compoundChangePush()
+        self.assertGreater(len(tb.checkpoints), 1)
+        for state in tb.checkpoints.values():
+            self.assertIsInstance(state[1], app.line_store.PackedLines)
+        edited = list(tb.lines)
+        tb.undoToIndex(0)
+        self.assertEqual(list(tb.lines), expected)
+        self.assertFalse(tb.isDirty())
+        tb.undoToIndex(len(tb.redoChain))
+        self.assertEqual(list(tb.lines), edited)
+
+    def test_performance_tiers(self):
+        tb = self.textBuffer
+        self.prg.prefs.editor = dict(
+            self.prg.prefs.editor,
+            performanceTiers=[
+                {u'fileSize': 100, u'lineLength': 20},
+                {u'fileSize': 200, u'lineLength': 40},
+                {u'fileSize': 300, u'lineLength': 60},
+            ])
+        tests = [
+            (u'short\n' * 10, app.actions.kTierNormal),
+            (u'short\n' * 10 + u'x' * 30, app.actions.kTierNoOverlays),
+            (u'short\n' * 40, app.actions.kTierNoHistory),
+            (u'x' * 50, app.actions.kTierNoHistory),
+            (u'short\n' * 60, app.actions.kTierCoarseUndo),
+        ]
+        for text, tier in tests:
+            tb.fileFilter(text)
+            tb.setPerformanceTier()
+            self.assertEqual(tb.performanceTier, tier)
+            self.assertEqual(tb.coarseUndo,
+                             tier == app.actions.kTierCoarseUndo)
+        self.assertIsInstance(tb.lines, app.line_store.PackedLines)
+        tempDir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tempDir, u'tier.txt')
+            with io.open(path, 'w') as f:
+                f.write(u'short\n' * 60)
+            tb.setFilePath(path)
+            tb.fileLoad()
+            self.assertEqual(tb.performanceTier, app.actions.kTierCoarseUndo)
+            self.assertIsInstance(tb.lines, app.line_store.PackedLines)
+        finally:
+            shutil.rmtree(tempDir)
+        # Coarse undo groups edits into fewer steps, without checkpoints.
+        tb.restoreUserHistory()
+        self.assertIsNone(tb.lastChecksum)
+        self.assertEqual(tb.checkpoints, {})
+        tb.parseDocument()
+        for i in range(100):
+            if i % 2:
+                tb.carriageReturn()
+            else:
+                tb.insert(u'%d' % (i,))
+            tb.compoundChangePush()
+            tb.parseDocument()
+        self.assertEqual(len(tb.redoChain), 2)
+        self.assertEqual(tb.checkpoints, {})
+        tb.editUndo()
+        tb.parseDocument()
+        tb.editUndo()
+        self.assertEqual(tb.lines, [u'short'] * 60 + [u''])
+        self.assertFalse(tb.isDirty())
+
+
+    def test_mapped_view(self):
+        tb = self.textBuffer
+        tempDir = tempfile.mkdtemp()
+        try:
+            self.prg.prefs.editor = dict(self.prg.prefs.editor,
+                                         mappedFileSize=0)
+            self.prg.prefs.userData = dict(self.prg.prefs.userData,
+                                           homePath=tempDir)
+            path = os.path.join(tempDir, u'big.log')
+            text = u'\n'.join(u'log entry %d' % (i,) for i in range(1000))
+            with io.open(path, 'w') as f:
+                f.write(text)
+            tb.setFilePath(path)
+            tb.fileLoad()
+            self.assertTrue(tb.isViewOnly)
+            self.assertEqual(tb.performanceTier, app.actions.kTierMapped)
+            self.assertIsNotNone(tb.loadProgress())
+            self.assertEqual(tb.parser.rowText(3), u'log entry 3')
+            # Edits are refused.
+            tb.cursorMoveTo(3, 4)
+            tb.insert(u'abc')
+            tb.carriageReturn()
+            self.assertEqual(tb.lines[3], u'log entry 3')
+            self.assertFalse(tb.isDirty())
+            # Once the file is indexed, find searches all of it.
+            while not tb.loadMore():
+                pass
+            self.assertIsNone(tb.loadProgress())
+            tb.find(u'entry 998')
+            self.assertEqual((tb.penRow, tb.markerRow), (998, 998))
+            tb.parseDocument()
+            self.assertEqual(tb.parser.rowCount(), 1000)
+            self.assertEqual(tb.parser.rowTextAndWidth(999),
+                             (u'log entry 999', 13))
+            tb.lines.close()
+            self.assertFalse(tb.hasMappedDecodeErrors())
+            # Bytes after the start (where the encoding is judged) that can't
+            # be decoded are replaced.
+            with io.open(path, 'ab') as f:
+                f.write(b'\n' * app.line_store.kSniffSize + b'\xff\n')
+            tb = app.text_buffer.TextBuffer(self.prg)
+            tb.setFilePath(path)
+            tb.fileLoad()
+            self.assertEqual(tb.fileEncoding, u'utf-8')
+            while not tb.loadMore():
+                pass
+            self.assertEqual(tb.lines[-2], u'\ufffd')
+            self.assertTrue(tb.hasMappedDecodeErrors())
+            tb.lines.close()
+            # A binary file is shown as hex rows.
+            with io.open(path, 'wb') as f:
+                f.write(b'\0' * 64)
+            tb = app.text_buffer.TextBuffer(self.prg)
+            tb.setFilePath(path)
+            tb.fileLoad()
+            self.assertTrue(tb.isBinary)
+            self.assertIsInstance(tb.lines, app.line_store.HexLines)
+            self.assertEqual(tb.lines[0], u'0' * 32)
+        finally:
+            shutil.rmtree(tempDir)
+
+    def test_progressive_load(self):
+        tb = self.textBuffer
+        tempDir = tempfile.mkdtemp()
+        try:
+            self.prg.prefs.editor = dict(self.prg.prefs.editor,
+                                         progressiveLoadSize=0,
+                                         useBgThread=True)
+            path = os.path.join(tempDir, u'load.txt')
+            expected = [u'row %d\tend' % (i,) for i in range(40000)]
+            with io.open(path, 'w', newline=u'\r\n') as f:
+                f.write(u'\n'.join(expected))
+            expected = [row.expandtabs(8) for row in expected]
+            tb.setFilePath(path)
+            tb.fileLoad()
+            self.assertTrue(tb.isLoading)
+            self.assertLess(0, tb.loadProgress())
+            self.assertLess(tb.loadProgress(), 1.0)
+            self.assertLess(len(tb.lines), len(expected))
+            self.assertEqual(tb.lines[:-1], expected[:len(tb.lines) - 1])
+            tb.parseDocument()
+            # Rows that are loaded may be edited (after a warning), the last
+            # row may not.
+            tb.insert(u'new ')
+            self.assertEqual(tb.lines[0], expected[0])
+            self.assertTrue(tb.message[0].startswith(
+                u'The file is still loading'))
+            tb.insert(u'new ')
+            expected[0] = u'new ' + expected[0]
+            tb.cursorMoveTo(len(tb.lines) - 1, 0)
+            tb.insert(u'refused ')
+            self.assertEqual(tb.message[0],
+                             u'That part of the file is still loading')
+            while not tb.loadMore():
+                tb.parseDocument()
+            self.assertFalse(tb.isLoading)
+            self.assertIsNone(tb.loadProgress())
+            self.assertEqual(tb.lines, expected)
+            # The file was hashed as it was read.
+            self.assertEqual((tb.lastChecksum, tb.lastFileSize),
+                             app.history.getFileInfo(path))
+            tb.parseDocument()
+            self.assertEqual(tb.parser.rowCount(), len(expected))
+            self.assertEqual(tb.parser.rowText(0), expected[0])
+            self.assertTrue(tb.isDirty())
+            self.assertTrue(tb.isRowModified(0))
+            self.assertFalse(tb.isRowModified(30000))
+            tb.editUndo()
+            self.assertFalse(tb.isDirty())
+            self.assertEqual(tb.lines[0], u'row 0   end')
+        finally:
+            shutil.rmtree(tempDir)
+
+    def test_stream_load(self):
+        for isPager in (False, True):
+            tb = app.text_buffer.TextBuffer(self.prg)
+            tb.setView(FakeView())
+            self.prg.prefs.editor = dict(self.prg.prefs.editor,
+                                         useBgThread=True)
+            readFd, writeFd = os.pipe()
+            try:
+                tb.fileStream(readFd, isPager)
+                self.assertTrue(tb.isLoading)
+                self.assertFalse(tb.loadMore())
+                self.assertEqual(tb.lines, [u''])
+                os.write(writeFd, b'one\ntwo\nthr')
+                self.assertFalse(tb.loadMore())
+                self.assertEqual(tb.lines, [u'one', u'two', u'thr'])
+                self.assertIsNone(tb.loadProgress())
+                tb.parseDocument()
+                # The view stays at the start until the pen is on the last row.
+                self.assertEqual((tb.penRow, tb.penCol), (0, 0))
+                tb.cursorMoveTo(2, 1)
+                os.write(writeFd,
+                         b'ee\n' + b''.join(b'%d\n' % (i,) for i in range(20)))
+                self.assertFalse(tb.loadMore())
+                tb.parseDocument()
+                self.assertEqual(tb.lines[2:4], [u'three', u'0'])
+                self.assertEqual(tb.parser.rowText(22), u'19')
+                self.assertEqual((tb.penRow, tb.penCol), (23, 0))
+                self.assertEqual(tb.view.scrollRow, 14)
+                tb.cursorMoveTo(0, 0)
+                tb.insert(u'new ')
+                os.close(writeFd)
+                writeFd = None
+                self.assertTrue(tb.loadMore())
+                self.assertFalse(tb.isLoading)
+                self.assertEqual(len(tb.lines), 24)
+                self.assertIsNone(tb.lastChecksum)
+                if isPager:
+                    self.assertEqual(tb.message[0],
+                                     u'This is a read only view of the file')
+                    self.assertEqual(tb.lines[0], u'one')
+                    self.assertFalse(tb.isDirty())
+                else:
+                    self.assertEqual(tb.lines[0], u'new one')
+                    self.assertTrue(tb.isDirty())
+            finally:
+                if writeFd is not None:
+                    os.close(writeFd)
+
+    def test_follow(self):
+        tb = self.textBuffer
+        tempDir = tempfile.mkdtemp()
+        try:
+            self.prg.prefs.editor = dict(self.prg.prefs.editor,
+                                         useBgThread=True)
+            path = os.path.join(tempDir, u'follow.log')
+
+            def append(data):
+                with io.open(path, 'ab') as f:
+                    f.write(data)
+
+            append(b'one\ntwo\nthr')
+            tb.setFilePath(path)
+            tb.fileLoad()
+            tb.parseDocument()
+            self.assertTrue(tb.fileFollow())
+            self.assertTrue(tb.isViewOnly)
+            self.assertFalse(tb.loadMore())
+            self.assertEqual(tb.lines, [u'one', u'two', u'thr'])
+            append(b'ee\nfour\n')
+            self.assertFalse(tb.loadMore())
+            tb.parseDocument()
+            self.assertEqual(tb.lines, [u'one', u'two', u'three', u'four', u''])
+            self.assertEqual(tb.parser.rowText(3), u'four')
+            self.assertEqual((tb.penRow, tb.penCol), (0, 0))
+            tb.insert(u'refused ')
+            self.assertEqual(tb.lines[0], u'one')
+            tb.cursorMoveTo(4, 0)
+            append(b'five\n')
+            self.assertFalse(tb.loadMore())
+            self.assertEqual(tb.lines[4:], [u'five', u''])
+            self.assertEqual(tb.penRow, 5)
+            # Rotated.
+            os.rename(path, path + u'.1')
+            append(b'new\nfile')
+            self.assertFalse(tb.loadMore())
+            self.assertEqual(tb.message[0],
+                             u'The file was replaced, reading it again')
+            self.assertFalse(tb.loadMore())
+            tb.parseDocument()
+            self.assertEqual(tb.lines, [u'new', u'file'])
+            self.assertEqual(tb.penRow, 1)
+            self.assertFalse(tb.isDirty())
+            # Truncated.
+            with io.open(path, 'wb') as f:
+                f.write(b'x')
+            self.assertFalse(tb.loadMore())
+            self.assertFalse(tb.loadMore())
+            self.assertEqual(tb.lines, [u'x'])
+            self.assertFalse(tb.fileFollow(False))
+            self.assertFalse(tb.isLoading)
+            self.assertFalse(tb.isViewOnly)
+            self.assertTrue(tb.isFileUnchanged())
+            self.assertEqual(tb.lastFileSize, 1)
+            # Following again picks up where the document ends.
+            append(b'yz\n')
+            self.assertTrue(tb.fileFollow())
+            self.assertFalse(tb.loadMore())
+            self.assertEqual(tb.lines, [u'xyz', u''])
+            tb.fileFollow(False)
+        finally:
+            shutil.rmtree(tempDir)
+
+    def test_file_refresh(self):
+        tb = self.textBuffer
+        tempDir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tempDir, u'refresh.txt')
+
+            def write(data):
+                with io.open(path, 'wb') as f:
+                    f.write(data)
+                # The modification time may not differ within a test.
+                fileStat = os.stat(path)
+                os.utime(path, (fileStat.st_atime, fileStat.st_mtime + 10))
+
+            write(b'one\ntwo\nthree\nfour')
+            tb.setFilePath(path)
+            tb.fileLoad()
+            tb.parseDocument()
+            self.assertFalse(tb.fileRefresh())
+            tb.cursorMoveTo(2, 3)
+            tb.bookmarks.append(app.bookmark.Bookmark(2, 2, {}))
+            write(b'zero\none\nthree\nfour!')
+            self.assertTrue(tb.fileRefresh())
+            self.assertEqual(tb.lines, [u'zero', u'one', u'three', u'four!'])
+            self.assertEqual((tb.penRow, tb.penCol), (2, 3))
+            self.assertEqual(tb.bookmarks[0].range, (2, 2))
+            self.assertFalse(tb.isDirty())
+            self.assertTrue(tb.isFileUnchanged())
+            self.assertFalse(tb.fileRefresh())
+            tb.parseDocument()
+            self.assertEqual(tb.parser.rowText(3), u'four!')
+            # The update is one undo step.
+            tb.undo()
+            self.assertEqual(tb.lines, [u'one', u'two', u'three', u'four'])
+            self.assertTrue(tb.isDirty())
+            tb.redo()
+            self.assertFalse(tb.isDirty())
+            # Unsaved changes are not replaced.
+            tb.insert(u'new ')
+            write(b'other')
+            self.assertFalse(tb.fileRefresh())
+            self.assertEqual(tb.message[0],
+                             u'The file was changed by another program')
+            self.assertEqual(tb.lines[2], u'thrnew ee')
+            os.remove(path)
+            self.assertFalse(tb.fileRefresh())
+            self.assertEqual(tb.message[0],
+                             u'The file was removed by another program')
+        finally:
+            shutil.rmtree(tempDir)
+
+    def test_recovery_journal(self):
+        tb = self.textBuffer
+        tempDir = tempfile.mkdtemp()
+        compactMinSize = app.actions.kJournalCompactMinSize
+        try:
+            self.prg.dirBackups = tempDir
+            path = os.path.join(tempDir, u'journaled.txt')
+            with io.open(path, 'wb') as f:
+                f.write(b'one\ntwo\nthree')
+            tb.setFilePath(path)
+            tb.fileLoad()
+            tb.parseDocument()
+            tb.journalFlush()
+            self.assertIsNone(tb.journal.read())
+            tb.cursorMoveTo(1, 3)
+            tb.insert(u' and a half')
+            tb.carriageReturn()
+            tb.insert(u'new')
+            tb.journalFlush()
+            journalPath = tb.journal.journalPath
+            self.assertTrue(os.path.isfile(journalPath))
+            tb.cursorMoveTo(0, 0)
+            tb.insert(u'zero ')
+            tb.journalFlush()
+            lines = list(tb.lines)
+            # As if the program was stopped without saving.
+            tb2 = app.text_buffer.TextBuffer(self.prg)
+            tb2.setView(FakeView())
+            tb2.setFilePath(path)
+            tb2.fileLoad()
+            self.assertEqual(tb2.lines, lines)
+            self.assertEqual(tb2.message[0],
+                             u'Recovered unsaved changes, undo to discard them')
+            self.assertTrue(tb2.isDirty())
+            tb2.journalFlush()
+            self.assertEqual(tb2.journal.read()[1], tb.journal.read()[1])
+            tb2.undo()
+            self.assertEqual(tb2.lines, [u'one', u'two', u'three'])
+            self.assertFalse(tb2.isDirty())
+            tb2.journalFlush()
+            self.assertFalse(os.path.isfile(journalPath))
+            tb2.redo()
+            # The journal is compacted as it grows.
+            app.actions.kJournalCompactMinSize = 0
+            for i in range(200):
+                tb2.insert(u'x')
+                tb2.journalFlush()
+                self.assertLess(tb2.journal.size, 2000)
+            lines = list(tb2.lines)
+            tb3 = app.text_buffer.TextBuffer(self.prg)
+            tb3.setFilePath(path)
+            tb3.fileLoad()
+            self.assertEqual(tb3.lines, lines)
+            # Saving ends the journal.
+            tb3.fileWrite()
+            tb3.journalFlush()
+            self.assertFalse(os.path.isfile(journalPath))
+            # A journal for a file that was changed since isn't replayed.
+            tb3.insert(u'y')
+            tb3.journalFlush()
+            with io.open(path, 'ab') as f:
+                f.write(b'!')
+            tb4 = app.text_buffer.TextBuffer(self.prg)
+            tb4.setFilePath(path)
+            tb4.fileLoad()
+            self.assertFalse(tb4.isDirty())
+            self.assertTrue(tb4.message[0].startswith(
+                u'The unsaved changes found for the file are out of date'))
+            self.assertTrue(os.path.isfile(journalPath + u'.old'))
+            self.assertFalse(os.path.isfile(journalPath))
+            # Closing without saving drops the journal.
+            self.prg.bufferManager.buffers.append(tb3)
+            self.prg.bufferManager.closeTextBuffer(tb3)
+            self.assertFalse(os.path.isfile(journalPath))
+        finally:
+            app.actions.kJournalCompactMinSize = compactMinSize
+            shutil.rmtree(tempDir)
+
+    def test_file_write(self):
+        tb = self.textBuffer
+        tempDir = tempfile.mkdtemp()
+        chunkRows = app.actions.kSaveChunkRows
+        try:
+            app.actions.kSaveChunkRows = 3
+            path = os.path.join(tempDir, u'save.txt')
+            with io.open(path, 'wb') as f:
+                f.write(b'old')
+            tb.setFilePath(path)
+            tb.fileLoad()
+            tb.parseDocument()
+            tb.selectionAll()
+            tb.editPasteLines(tuple(
+                u'row %d \x01%02x' % (i, i % 32) for i in range(10)))
+            lines = tb.lines
+            tb.fileWrite()
+            self.assertEqual(tb.message[0], u'File saved')
+            self.assertFalse(tb.isDirty())
+            # The lines are saved as they are, not rebuilt from the file.
+            self.assertIs(tb.lines, lines)
+            with io.open(path, 'rb') as f:
+                self.assertEqual(
+                    f.read(),
+                    u'\n'.join(u'row %d %s' % (i, chr(i % 32))
+                               for i in range(10)).encode(u'utf-8'))
+            self.assertEqual((tb.lastChecksum, tb.lastFileSize),
+                             app.history.getFileInfo(path))
+            self.assertEqual(os.listdir(tempDir), [u'save.txt'])
+        finally:
+            app.actions.kSaveChunkRows = chunkRows
+            shutil.rmtree(tempDir)
+
+    def test_strip_trailing_spaces(self):
+        tb = self.textBuffer
+        tempDir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tempDir, u'spaces.txt')
+            with io.open(path, 'w') as f:
+                f.write(u'\n'.join(u'row %d  ' % (i,) for i in range(20)))
+            tb.setFilePath(path)
+            tb.fileLoad()
+            tb.parseDocument()
+            self.assertEqual(tb.modifiedRows(), [])
+            tb.cursorMoveTo(15, 0)
+            tb.editPasteLines((u'new  ', u'rows  ', u''))
+            tb.cursorMoveTo(3, 0)
+            tb.insert(u'x')
+            tb.cursorMoveTo(5, 0)
+            tb.insert(u'y')
+            tb.cursorMoveTo(5, 1)
+            tb.backspace()
+            tb.cursorMoveTo(10, 0)
+            tb.editPasteLines((u'',))
+            tb.cursorMoveTo(0, 0)
+            tb.editPasteLines((u'', u''))
+            self.assertEqual(tb.modifiedRows(), [0, 1, 4, 6, 11, 16, 17, 18])
+            tb.compoundChangePush()
+            tb.fileWrite()
+            self.assertFalse(tb.isDirty())
+            self.assertEqual(tb.modifiedRows(), [])
+            self.assertEqual(
+                [i for i, line in enumerate(tb.lines) if line.endswith(u' ')],
+                [i for i in range(23) if i not in (0, 1, 4, 6, 11, 16, 17, 18)])
+            # Stripping is a single undo step.
+            tb.editUndo()
+            self.assertEqual(tb.lines[16], u'new  ')
+            self.assertEqual(tb.lines[4], u'xrow 3  ')
+        finally:
+            shutil.rmtree(tempDir)
+
+    def test_binary_file(self):
+        tb = self.textBuffer
+        tempDir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tempDir, u'binary.dat')
+            data = bytes(bytearray(range(256))) * 4
+            with io.open(path, 'wb') as f:
+                f.write(data)
+            tb.setFilePath(path)
+            tb.fileLoad()
+            self.assertTrue(tb.isBinary)
+            self.assertIsInstance(tb.lines, app.line_store.HexLines)
+            self.assertEqual(len(tb.lines), 65)
+            self.assertEqual(tb.lines[1], u'101112131415161718191a1b1c1d1e1f')
+            tb.parseDocument()
+            # Change a byte (the file is patched in place).
+            tb.cursorMoveTo(1, 0)
+            tb.insert(u'ff')
+            tb.cursorMoveTo(1, 2)
+            tb.delete()
+            tb.delete()
+            tb.compoundChangePush()
+            self.assertIsNotNone(tb.lines.patches())
+            tb.fileWrite()
+            self.assertEqual(tb.message[0], u'File saved')
+            data = data[:16] + b'\xff' + data[17:]
+            with io.open(path, 'rb') as f:
+                self.assertEqual(f.read(), data)
+            self.assertEqual((tb.lastChecksum, tb.lastFileSize),
+                             app.history.getFileInfo(path))
+            # Add bytes (the whole file is written).
+            tb.parseDocument()
+            tb.cursorMoveTo(64, 0)
+            tb.insert(u'0a0b')
+            tb.compoundChangePush()
+            self.assertIsNone(tb.lines.patches())
+            tb.fileWrite()
+            data += b'\x0a\x0b'
+            with io.open(path, 'rb') as f:
+                self.assertEqual(f.read(), data)
+            # The rows aren't as the file would be shown (there's no empty last
+            # row), so the next save also writes the whole file.
+            self.assertIsNone(tb.lines.patches())
+            tb.editUndo()
+            self.assertEqual(tb.lines[64], u'')
+            tb.editUndo()
+            self.assertEqual(tb.lines[1], u'101112131415161718191a1b1c1d1e1f')
+            # Add a row, so the file size is a multiple of the row size.
+            tb.compoundChangePush()
+            tb.parseDocument()
+            tb.cursorMoveTo(1, 0)
+            tb.insert(u'ee' * 16)
+            tb.carriageReturn()
+            tb.compoundChangePush()
+            tb.fileWrite()
+            self.assertEqual(tb.message[0], u'File saved')
+            self.assertFalse(tb.isDirty())
+            data = bytes(bytearray(range(256))) * 4
+            data = data[:16] + b'\xee' * 16 + data[16:]
+            with io.open(path, 'rb') as f:
+                self.assertEqual(f.read(), data)
+            self.assertEqual(tb.lastFileSize, 1040)
+            # The rows are mapped from the saved file again.
+            self.assertEqual(tb.lines.patches(), [])
+        finally:
+            shutil.rmtree(tempDir)
+
+    def test_decode_errors(self):
+        tb = self.textBuffer
+        tempDir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tempDir, u'mixed.txt')
+            # The bad byte is past the sample the encoding is judged from.
+            rows = [u'row %d \u00e9' % (i,) for i in range(10000)]
+            with io.open(path, 'wb') as f:
+                f.write(u'\n'.join(rows).encode(u'utf-8') + b'\n\xff end')
+            self.prg.prefs.editor = dict(self.prg.prefs.editor,
+                                         decodeErrors=u'replace')
+            tb.setFilePath(path)
+            tb.fileLoad()
+            self.assertFalse(tb.isBinary)
+            self.assertEqual(tb.fileEncoding, u'utf-8')
+            self.assertEqual(tb.lines, rows + [u'\ufffd end'])
+            self.assertTrue(tb.isViewOnly)
+            self.prg.prefs.editor = dict(self.prg.prefs.editor,
+                                         decodeErrors=u'binary')
+            tb = app.text_buffer.TextBuffer(self.prg)
+            tb.setFilePath(path)
+            tb.fileLoad()
+            self.assertTrue(tb.isBinary)
+            self.assertFalse(tb.isViewOnly)
+            # A progressive load finds the bad byte after the start is shown.
+            self.prg.prefs.editor = dict(self.prg.prefs.editor,
+                                         progressiveLoadSize=0,
+                                         useBgThread=True)
+            for decodeErrors, isEdited in ((u'binary', False),
+                                           (u'binary', True),
+                                           (u'replace', True)):
+                self.prg.prefs.editor[u'decodeErrors'] = decodeErrors
+                tb = app.text_buffer.TextBuffer(self.prg)
+                tb.setFilePath(path)
+                tb.fileLoad()
+                self.assertTrue(tb.isLoading)
+                self.assertFalse(tb.isBinary)
+                if isEdited:
+                    tb.parseDocument()
+                    tb.insert(u'new ')
+                    tb.insert(u'new ')
+                    tb.compoundChangePush()
+                while not tb.loadMore():
+                    pass
+                isBinary = decodeErrors == u'binary' and not isEdited
+                self.assertEqual(tb.isBinary, isBinary)
+                self.assertEqual(tb.isViewOnly, not isBinary)
+                if isBinary:
+                    self.assertIsInstance(tb.lines, app.line_store.HexLines)
+                else:
+                    self.assertEqual(tb.lines[0], u'new ' + rows[0])
+                    self.assertEqual(tb.lines[-1], u'\ufffd end')
+        finally:
+            shutil.rmtree(tempDir)
+
+    def test_partial_write(self):
+        tb = self.textBuffer
+        tempDir = tempfile.mkdtemp()
+        chunkSizeLimit = app.actions.kLoadChunkSizeLimit
+        chunkRows = app.actions.kSaveChunkRows
+        try:
+            app.actions.kLoadChunkSizeLimit = 64
+            app.actions.kSaveChunkRows = 3
+            self.prg.prefs.editor = dict(self.prg.prefs.editor,
+                                         partialWriteSize=0)
+            path = os.path.join(tempDir, u'partial.txt')
+            expected = [u'row %d \u00e9' % (i,) for i in range(100)]
+            with io.open(path, 'wb') as f:
+                f.write(u'\n'.join(expected).encode(u'utf-8'))
+            tb.setFilePath(path)
+            tb.fileLoad()
+            tb.parseDocument()
+
+            def save():
+                tb.fileWrite()
+                self.assertEqual(tb.message[0], u'File saved')
+                with io.open(path, 'rb') as f:
+                    self.assertEqual(f.read().decode(u'utf-8'),
+                                     u'\n'.join(expected))
+                self.assertEqual((tb.lastChecksum, tb.lastFileSize),
+                                 app.history.getFileInfo(path))
+
+            # An edit near the end rewrites only the end.
+            tb.cursorMoveTo(90, 0)
+            tb.insert(u'new ')
+            expected[90] = u'new ' + expected[90]
+            self.assertIsNotNone(tb.partialWriteIndex())
+            save()
+            tb.cursorMoveTo(99, 0)
+            tb.editPasteLines((u'', u'added'))
+            expected[99:] = [u'', u'added' + expected[99]]
+            self.assertIsNotNone(tb.partialWriteIndex())
+            save()
+            tb.parseDocument()
+            tb.cursorMoveTo(100, 0)
+            tb.backspace()
+            expected[99:] = [expected[100]]
+            save()
+            # An edit near the start writes the whole file.
+            tb.cursorMoveTo(1, 0)
+            tb.insert(u'new ')
+            expected[1] = u'new ' + expected[1]
+            self.assertIsNone(tb.partialWriteIndex())
+            save()
+            # As does a file changed by another program.
+            tb.cursorMoveTo(95, 0)
+            tb.insert(u'new ')
+            expected[95] = u'new ' + expected[95]
+            self.assertIsNotNone(tb.partialWriteIndex())
+            os.utime(path, (0, 0))
+            self.assertIsNone(tb.partialWriteIndex())
+            save()
+        finally:
+            app.actions.kLoadChunkSizeLimit = chunkSizeLimit
+            app.actions.kSaveChunkRows = chunkRows
+            shutil.rmtree(tempDir)
+
 class GrammarDeterminationTestCases(unittest.TestCase):
 
     def setUp(self):
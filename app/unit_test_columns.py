@@ -0,0 +1,227 @@
+# Copyright 2019 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import io
+import os
+import re
+import shutil
+import tempfile
+import unittest
+
+import app.ci_program
+import app.columns
+import app.log
+import app.text_buffer
+
+
+class FakeColors:
+
+    def get(self, colorType, delta=0):
+        return 1 if colorType == u'found_find' else 0
+
+
+class FakeView:
+
+    def __init__(self, program):
+        self.program = program
+        self.rows = 10
+        self.cols = 40
+        self.scrollRow = 0
+        self.scrollCol = 0
+
+
+class FakeWindow:
+    """Records the text drawn on each row."""
+
+    def __init__(self):
+        self.rows = {}
+        self.colors = {}
+
+    def addStr(self, row, col, text, color):
+        line = self.rows.get(row, u'')
+        line += u' ' * (col - len(line))
+        self.rows[row] = line[:col] + text + line[col + len(text):]
+        colors = self.colors.setdefault(row, [])
+        colors += [0] * (col + len(text) - len(colors))
+        colors[col:col + len(text)] = [color] * len(text)
+
+
+class ColumnsTestCases(unittest.TestCase):
+
+    def setUp(self):
+        app.log.shouldWritePrintLog = False
+        self.prg = app.ci_program.CiProgram()
+        self.prg.color = FakeColors()
+        self.textBuffer = app.text_buffer.TextBuffer(self.prg)
+        self.textBuffer.setView(FakeView(self.prg))
+
+    def test_field_starts(self):
+        tests = [
+            (u'', [0]),
+            (u'a', [0]),
+            (u'a,bc,,d', [0, 2, 5, 6]),
+            (u'a,', [0, 2]),
+            (u'"x,y",z', [0, 6]),
+            (u'"say ""hi"", then",2,"', [0, 19, 21]),
+            (u'1,"unclosed, quote', [0, 2]),
+        ]
+        for line, expected in tests:
+            self.assertEqual(app.columns.fieldStarts(line, u','), expected,
+                             line)
+            self.assertEqual(app.columns.fieldStarts(line, u',', 2),
+                             expected[:2], line)
+        self.assertEqual(app.columns.fieldStarts(u'a;b,c;d', u';'), [0, 2, 6])
+        line = u'"a ""b""",c'
+        starts = app.columns.fieldStarts(line, u',')
+        self.assertEqual(
+            app.columns.fieldValue(app.columns.fieldText(line, starts, 0)),
+            u'a "b"')
+        self.assertEqual(app.columns.fieldText(line, starts, 1), u'c')
+        self.assertIsNone(app.columns.fieldText(line, starts, 2))
+
+    def test_field_sort_key(self):
+        lines = [
+            u'b,10,x',
+            u'a,9',
+            u'c',
+            u'd,"1,5"',
+            u'e,-2.5e1',
+            u'f,apple',
+        ]
+        self.assertEqual(
+            sorted(lines, key=app.columns.fieldSortKey(u',', 1)), [
+                u'e,-2.5e1',
+                u'a,9',
+                u'b,10,x',
+                u'd,"1,5"',
+                u'f,apple',
+                u'c',
+            ])
+        self.assertEqual(sorted(lines, key=app.columns.fieldSortKey(u',', 0)),
+                         sorted(lines))
+
+    def test_layout(self):
+        tb = self.textBuffer
+        tb.insertLines((u'id,name,size', u'1,\u4e00wide,5', u'22,b,"6,0"'))
+        index = app.columns.ColumnIndex(u',')
+        self.assertEqual(index.fields(tb, 1), ([0, 2, 8], [1, 6, 1]))
+        columnStarts = index.layout(tb, range(3))
+        self.assertEqual(columnStarts, [0, 3, 10, 16])
+        # Row 2 is shown as u'22,b     ,"6,0"'.
+        fields = index.fields(tb, 2)
+        tests = [(0, 0), (2, 2), (3, 3), (4, 9), (5, 10), (9, 14), (12, 17)]
+        for col, alignedCol in tests:
+            self.assertEqual(index.alignedColumn(fields, columnStarts, col),
+                             alignedCol)
+            self.assertEqual(
+                index.unalignedColumn(fields, columnStarts, alignedCol), col)
+        # The space after a field is at its end.
+        self.assertEqual(index.unalignedColumn(fields, columnStarts, 6), 4)
+        # Row 1 is shown as u'1 ,\u4e00wide,5'.
+        self.assertEqual(
+            index.alignedColumn(index.fields(tb, 1), columnStarts, 2), 3)
+        self.assertEqual(index.fieldIndex(tb, u'size'), 2)
+        self.assertIsNone(index.fieldIndex(tb, u'color'))
+        self.assertEqual(index.fieldAtColumn(tb, 2, 4), 1)
+        self.assertEqual(index.fieldAtColumn(tb, 2, 5), 2)
+        # Changed rows are found again.
+        tb.cursorMoveTo(2, 0)
+        tb.insert(u'333')
+        self.assertEqual(index.fields(tb, 2)[1], [5, 1, 5])
+        tb.cursorMoveTo(0, 0)
+        tb.insert(u'x,')
+        tb.carriageReturn()
+        self.assertEqual(index.fields(tb, 1), ([0, 3, 8], [2, 4, 4]))
+        self.assertEqual(index.fields(tb, 3)[1], [5, 1, 5])
+
+    def test_column_mode(self):
+        tb = self.textBuffer
+        tb.insertLines((u'id,name', u'1,one', u'22,two', u'333,three'))
+        tb.setColumnMode(u',')
+        tb.cursorMoveTo(2, 1)
+        self.assertTrue(tb.cursorMoveToField(1))
+        self.assertEqual((tb.penRow, tb.penCol), (2, 3))
+        self.assertFalse(tb.cursorMoveToField(2))
+        tb.parseDocument()
+        window = FakeWindow()
+        tb.drawTextArea(window, 0, 0, 4, 20, 0)
+        # The cursor's row is as it is, the others are lined up.
+        self.assertEqual(window.rows[0].rstrip(), u'id ,name')
+        self.assertEqual(window.rows[1].rstrip(), u'1  ,one')
+        self.assertEqual(window.rows[2].rstrip(), u'22,two')
+        self.assertEqual(window.rows[3].rstrip(), u'333,three')
+        # Highlights move with the text.
+        tb.findRe = re.compile(u'one')
+        window = FakeWindow()
+        tb.drawTextArea(window, 0, 0, 4, 20, 0)
+        self.assertEqual(window.rows[1].rstrip(), u'1  ,one')
+        self.assertEqual(window.colors[1][:7], [0, 0, 0, 0, 1, 1, 1])
+        # Scrolled to the right, the text comes from further left in the row.
+        tb.view.scrollCol = 2
+        window = FakeWindow()
+        tb.drawTextArea(window, 0, 0, 4, 20, 0)
+        self.assertEqual(window.rows[1].rstrip(), u' ,one')
+        self.assertEqual(window.colors[1][:5], [0, 0, 1, 1, 1])
+        tb.view.scrollCol = 0
+        tb.drawTextArea(FakeWindow(), 0, 0, 4, 20, 0)
+        # A click is at the column of the row that is shown there.
+        tb.mouseClick(1, 5, False, False, False)
+        self.assertEqual((tb.penRow, tb.penCol), (1, 3))
+        tb.setColumnMode(None)
+        window = FakeWindow()
+        tb.drawTextArea(window, 0, 0, 4, 20, 0)
+        self.assertEqual(window.rows[0].rstrip(), u'id,name')
+
+    def test_tsv_file(self):
+        tb = self.textBuffer
+        tempDir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tempDir, u'values.tsv')
+            data = b'id\tname\tnote\n1\tone\t\n22\ttwo\tx\n'
+            with io.open(path, 'wb') as f:
+                f.write(data)
+            tb.setFilePath(path)
+            tb.fileLoad()
+            # The tabs are kept, they separate the fields.
+            self.assertEqual(tb.columnIndex.delimiter, u'\t')
+            self.assertEqual(tb.lines[1], u'1\tone\t')
+            tb.parseDocument()
+            tb.cursorMoveTo(3, 0)
+            window = FakeWindow()
+            tb.drawTextArea(window, 0, 0, 3, 20, 0)
+            self.assertEqual(window.rows[0].rstrip(u' '), u'id\tname\tnote')
+            self.assertEqual(window.rows[1].rstrip(u' '), u'1 \tone \t')
+            self.assertEqual(window.rows[2].rstrip(u' '), u'22\ttwo \tx')
+            # Tab types a delimiter, and one that ends a row is kept.
+            tb.cursorMoveTo(1, 0)
+            tb.insert(u'0')
+            tb.cursorMoveTo(2, 6)
+            tb.indent()
+            self.assertEqual(tb.lines[1], u'01\tone\t')
+            self.assertEqual(tb.lines[2], u'22\ttwo\t\tx')
+            tb.fileWrite()
+            self.assertEqual(tb.message[0], u'File saved')
+            with io.open(path, 'rb') as f:
+                self.assertEqual(
+                    f.read(), b'id\tname\tnote\n01\tone\t\n22\ttwo\t\tx\n')
+        finally:
+            shutil.rmtree(tempDir)
+
+
+if __name__ == '__main__':
+    unittest.main()
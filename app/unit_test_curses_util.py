@@ -19,6 +19,7 @@ from __future__ import division
 from __future__ import print_function
 
 import curses
+import os
 import unittest
 
 import app.curses_util
@@ -126,6 +127,39 @@ class CursesUtilTestCases(unittest.TestCase):
         self.assertEqual(5, app.curses_util.fitToRenderedWidth(11, u"こんにちは"))
         self.assertEqual(5, app.curses_util.fitToRenderedWidth(12, u"こんにちは"))
 
+    def test_read_bracketed_paste(self):
+
+        class FakeWindow:
+
+            def __init__(self, data):
+                self.data = list(bytearray(data))
+
+            def getch(self):
+                return self.data.pop(0) if self.data else curses.ERR
+
+        readBracketedPaste = app.curses_util.readBracketedPaste
+        # All from curses.
+        self.assertEqual(
+            readBracketedPaste(FakeWindow(b'ab\x1b[201~'), -1),
+            (u'ab', b''))
+        readFd, writeFd = os.pipe()
+        readSize = app.curses_util.kPasteReadSize
+        try:
+            # The rest in bulk, once curses has nothing buffered.
+            os.write(writeFd, b' world \xc3\xa9\n\x1b[201~\x1b[A')
+            self.assertEqual(
+                readBracketedPaste(FakeWindow(b'hello'), readFd),
+                (u'hello world \u00e9\n', b'\x1b[A'))
+            # The end is found across reads.
+            app.curses_util.kPasteReadSize = 4
+            os.write(writeFd, b'12345\x1b[201~')
+            self.assertEqual(readBracketedPaste(FakeWindow(b''), readFd),
+                             (u'12345', b''))
+        finally:
+            app.curses_util.kPasteReadSize = readSize
+            os.close(readFd)
+            os.close(writeFd)
+
     def test_rendered_sub_str(self):
         self.assertEqual(u"test", app.curses_util.renderedSubStr(u"test", 0))
         self.assertEqual(u"test", app.curses_util.renderedSubStr(u"test", 0, 4))
@@ -55,3 +55,15 @@ class ExecutePromptTestCases(app.fake_curses_testing.FakeCursesTestCase):
                 u"           "
             ]), CTRL_Q, u"n"
         ])
+
+    def test_column_sort(self):
+        #self.setMovieMode(True)
+        self.runWithFakeInputs([
+            self.writeText(u"b,2\nlong,10\nc,1"), CTRL_E,
+            self.writeText(u'columns'), CTRL_J,
+            self.displayCheck(2, 7, [u"b   ,2  ", u"long,10  ", u"c,1  "]),
+            CTRL_A, CTRL_E,
+            self.writeText(u'sort 2'), CTRL_J,
+            self.displayCheck(2, 7, [u"c,1  ", u"b,2  ", u"long,10  "]),
+            CTRL_Q, u"n"
+        ])
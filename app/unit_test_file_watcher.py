@@ -0,0 +1,88 @@
+# Copyright 2019 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import io
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+import app.file_watcher
+
+
+class FileWatcherTestCases(unittest.TestCase):
+
+    def setUp(self):
+        self.tempDir = tempfile.mkdtemp()
+        self.pollMinSeconds = app.file_watcher.kPollMinSeconds
+        app.file_watcher.kPollMinSeconds = 0.05
+
+    def tearDown(self):
+        app.file_watcher.kPollMinSeconds = self.pollMinSeconds
+        shutil.rmtree(self.tempDir)
+
+    def waitForChanges(self, watcher):
+        changed = set()
+        deadline = time.time() + 5.0
+        while time.time() < deadline:
+            changed.update(watcher.changedPaths())
+            if changed:
+                # Collect any others that arrive together.
+                time.sleep(0.1)
+                changed.update(watcher.changedPaths())
+                break
+            time.sleep(0.02)
+        return changed
+
+    def checkWatcher(self, useInotify):
+        watched = os.path.join(self.tempDir, u'watched.txt')
+        other = os.path.join(self.tempDir, u'other.txt')
+        for path in (watched, other):
+            with io.open(path, 'wb') as f:
+                f.write(b'one')
+        watcher = app.file_watcher.FileWatcher(useInotify)
+        try:
+            watcher.setPaths([watched])
+            self.assertEqual(watcher.changedPaths(), set())
+            time.sleep(0.1)
+            with io.open(other, 'ab') as f:
+                f.write(b' two')
+            with io.open(watched, 'ab') as f:
+                f.write(b' two')
+            self.assertEqual(self.waitForChanges(watcher), set([watched]))
+            # Replaced by a rename, as many programs save.
+            with io.open(other, 'wb') as f:
+                f.write(b'three')
+            os.rename(other, watched)
+            self.assertEqual(self.waitForChanges(watcher), set([watched]))
+            watcher.setPaths([])
+            with io.open(watched, 'ab') as f:
+                f.write(b' four')
+            time.sleep(0.3)
+            self.assertEqual(watcher.changedPaths(), set())
+        finally:
+            watcher.close()
+
+    def test_inotify(self):
+        if app.file_watcher._loadInotify() is None:
+            self.skipTest(u'inotify is not available')
+        self.checkWatcher(True)
+
+    def test_polling(self):
+        self.checkWatcher(False)
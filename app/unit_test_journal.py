@@ -0,0 +1,77 @@
+# Copyright 2019 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import io
+import os
+import shutil
+import tempfile
+import unittest
+
+import app.journal
+
+
+class JournalTestCases(unittest.TestCase):
+
+    def setUp(self):
+        self.tempDir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tempDir)
+
+    def test_replay(self):
+        lines = [u'one', u'two', u'three']
+        app.journal.replay(lines, [(u'r', 1, 1, [u'2', u'2.5']),
+                                   (u'r', 3, 1, [])])
+        self.assertEqual(lines, [u'one', u'2', u'2.5'])
+        app.journal.replay(lines, [(u's', [u'a', u'b']),
+                                   (u'r', 0, 0, [u'z'])])
+        self.assertEqual(lines, [u'z', u'a', u'b'])
+        with self.assertRaises(ValueError):
+            app.journal.replay(lines, [(u'r', 2, 5, [])])
+
+    def test_read_write(self):
+        path = os.path.join(self.tempDir, u'file.txt')
+        journal = app.journal.Journal(self.tempDir, path)
+        self.assertIsNone(journal.read())
+        journal.start((3, 1.5))
+        journal.append([(u'r', 0, 1, [u'x'])])
+        # Only the user may read the changes.
+        self.assertEqual(os.stat(journal.journalPath).st_mode & 0o777, 0o600)
+        journal.append([(u'r', 1, 0, [u'y']), (u'r', 0, 1, [u'w'])])
+        self.assertEqual(journal.read(),
+                         ((3, 1.5), [(u'r', 0, 1, [u'x']),
+                                     (u'r', 1, 0, [u'y']),
+                                     (u'r', 0, 1, [u'w'])]))
+        # A record cut short by a crash is dropped.
+        with io.open(journal.journalPath, 'r+b') as f:
+            f.truncate(journal.size - 3)
+        self.assertEqual(journal.read()[1], [(u'r', 0, 1, [u'x']),
+                                             (u'r', 1, 0, [u'y'])])
+        # Another file's journal (with the same name) isn't used.
+        other = app.journal.Journal(self.tempDir, path + u'.other')
+        other.journalPath = journal.journalPath
+        self.assertIsNone(other.read())
+        journal.start(None, [u'a', u'b'])
+        self.assertEqual(journal.read(), (None, [(u's', [u'a', u'b'])]))
+        self.assertEqual(journal.snapshotSize, journal.size)
+        oldPath = journal.setAside()
+        self.assertTrue(os.path.isfile(oldPath))
+        self.assertIsNone(journal.read())
+        journal.start(None)
+        journal.remove()
+        self.assertEqual(os.listdir(self.tempDir), [os.path.basename(oldPath)])
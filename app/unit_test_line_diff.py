@@ -0,0 +1,85 @@
+# Copyright 2019 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import random
+import unittest
+
+import app.line_diff
+
+
+def applyLineDiff(lines, diff):
+    """Apply |diff| the way the 'ld' redo does."""
+    result = []
+    index = 0
+    for i in diff:
+        if type(i) is int:
+            result.extend(lines[index:index + i])
+            index += i
+        elif i[0] == u'+':
+            result.append(i[2:])
+        elif i[0] == u'-':
+            index += 1
+    assert index == len(lines), (index, len(lines))
+    return result
+
+
+class LineDiffTestCases(unittest.TestCase):
+
+    def test_simple(self):
+        diffLines = app.line_diff.diffLines
+        self.assertEqual(diffLines([], []), [])
+        self.assertEqual(diffLines([u'a', u'b'], [u'a', u'b']), [2])
+        self.assertEqual(diffLines([], [u'a']), [u'+ a'])
+        self.assertEqual(diffLines([u'a'], []), [u'- a'])
+        self.assertEqual(
+            diffLines([u'a', u'b', u'c'], [u'a', u'x', u'c']),
+            [1, u'- b', u'+ x', 1])
+        self.assertEqual(
+            diffLines([u'a', u'b', u'c', u'd'], [u'a', u'c', u'd', u'e']),
+            [1, u'- b', 2, u'+ e'])
+
+    def test_repeated_lines(self):
+        # Regions with no unique lines use a Myers diff.
+        a = [u'x', u'y'] * 5
+        b = [u'y', u'x'] * 5
+        diff = app.line_diff.diffLines(a, b)
+        self.assertEqual(applyLineDiff(a, diff), b)
+        self.assertEqual(len([i for i in diff if type(i) is not int]), 2)
+
+    def test_map_row(self):
+        mapRow = app.line_diff.mapRow
+        diff = [1, u'- b', u'- c', u'+ x', 1, u'+ y', 2]
+        self.assertEqual([mapRow(diff, row) for row in range(6)],
+                         [0, 1, 1, 2, 4, 5])
+        self.assertEqual(mapRow([], 0), 0)
+
+    def test_random_edits(self):
+        rand = random.Random(7)
+        for _ in range(500):
+            a = [rand.choice(u'abcde') for _ in range(rand.randint(0, 30))]
+            b = list(a)
+            for _ in range(rand.randint(0, 6)):
+                op = rand.random()
+                if op < 0.3 and b:
+                    del b[rand.randrange(len(b))]
+                elif op < 0.6:
+                    b.insert(rand.randint(0, len(b)), rand.choice(u'abcdefg'))
+                elif b:
+                    b[rand.randrange(len(b))] = rand.choice(u'xyz')
+            diff = app.line_diff.diffLines(a, b)
+            self.assertEqual(applyLineDiff(a, diff), b)
@@ -0,0 +1,85 @@
+# Copyright 2019 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import random
+import unittest
+
+import app.line_filter
+
+
+class LineFilterTestCases(unittest.TestCase):
+
+    def test_line_filter(self):
+        lines = [u'%d' % i for i in range(10)]
+        calls = []
+
+        def function(rows, start):
+            calls.append((len(rows), start))
+            return [row + u'!' for row in rows]
+
+        lineFilter = app.line_filter.LineFilter(lines, function, chunkRows=4)
+        self.assertEqual(lineFilter.progress(), 0.0)
+        self.assertFalse(lineFilter.step())
+        self.assertEqual(lineFilter.progress(), 0.4)
+        self.assertEqual(lineFilter.run(), [row + u'!' for row in lines])
+        self.assertTrue(lineFilter.isDone)
+        self.assertEqual(lineFilter.progress(), 1.0)
+        self.assertEqual(calls, [(4, 0), (4, 4), (2, 8)])
+        # All of the rows at once.
+        calls = []
+        lineFilter = app.line_filter.LineFilter(lines, function, chunkRows=None)
+        self.assertTrue(lineFilter.step())
+        self.assertEqual(calls, [(10, 0)])
+        # Nothing to filter.
+        lineFilter = app.line_filter.LineFilter([], function)
+        self.assertEqual(lineFilter.run(), [])
+        self.assertEqual(lineFilter.progress(), 1.0)
+
+    def test_sort_filter(self):
+        rand = random.Random(7)
+        lines = [u'%d' % rand.randint(0, 500) for _ in range(1000)]
+        sortFilter = app.line_filter.SortFilter(lines, runRows=64)
+        steps = 0
+        while not sortFilter.step():
+            steps += 1
+            self.assertTrue(0.0 < sortFilter.progress() < 1.0)
+        # A step per run, then the merge.
+        self.assertEqual(steps, 16)
+        self.assertEqual(sortFilter.output, sorted(lines))
+        self.assertEqual(sortFilter.progress(), 1.0)
+
+    def test_sort_filter_key(self):
+        # Rows with equal keys keep their order.
+        lines = [u'%d %d' % (i % 7, i) for i in range(300)]
+        key = lambda line: int(line.split()[0])
+        expected = sorted(lines, key=key)
+        sortFilter = app.line_filter.SortFilter(lines, key=key, runRows=32)
+        self.assertEqual(sortFilter.run(), expected)
+
+    def test_sort_filter_close(self):
+        lines = [u'%d' % (i % 13) for i in range(100)]
+        sortFilter = app.line_filter.SortFilter(lines, runRows=10)
+        self.assertFalse(sortFilter.step())
+        sortFilter.close()
+        self.assertTrue(sortFilter.isDone)
+        self.assertTrue(sortFilter.step())
+        self.assertEqual(sortFilter.output, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,526 @@
+# Copyright 2019 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import binascii
+import codecs
+import copy
+import hashlib
+import io
+import os
+import random
+import shutil
+import tempfile
+import unittest
+
+import app.line_store
+
+
+class LineReaderTestCases(unittest.TestCase):
+
+    def setUp(self):
+        self.tempDir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tempDir)
+
+    def test_read(self):
+        path = os.path.join(self.tempDir, u'read.txt')
+        tests = [
+            u'',
+            u'one line',
+            u'ends with a new line\n',
+            u'crlf\r\nand\ttab\r\nlone\rcr\r\r\nand \x07bell\n\u3000wide\r',
+            u'\n'.join(u'row %d\t\u00e9' % (i,) for i in range(500)),
+        ]
+        for text in tests:
+            data = text.encode(u'utf-8')
+            with io.open(path, 'wb') as f:
+                f.write(data)
+            expected = app.line_store.textToLines(text, 8)
+            checksum = hashlib.sha512(data).hexdigest() if data else None
+            # Small chunks split rows, '\r\n' pairs, and utf-8 sequences.
+            for size in (-1, 1, 2, 3, 7, 4096):
+                reader = app.line_store.LineReader(path, u'utf-8', 8)
+                self.assertEqual(reader.size, len(data))
+                lines = [u'']
+                while not reader.isDone:
+                    lines[-1:] = reader.read(size)
+                reader.close()
+                self.assertEqual(lines, expected)
+                self.assertEqual(reader.checksum(), checksum)
+
+    def test_read_stream(self):
+        readFd, writeFd = os.pipe()
+        reader = app.line_store.LineReader(readFd, u'utf-8', 8)
+        try:
+            self.assertTrue(reader.isStream)
+            self.assertIsNone(reader.progress())
+            lines = [u'']
+            # Nothing has arrived yet.
+            self.assertEqual(reader.read(4096, 0), [])
+            self.assertFalse(reader.isDone)
+            os.write(writeFd, u'one\ntw\u00e9'.encode(u'utf-8')[:-1])
+            lines[-1:] = reader.read(4096, 0)
+            self.assertEqual(lines, [u'one', u'tw'])
+            os.write(writeFd, u'\u00e9\nthree'.encode(u'utf-8')[1:])
+            lines[-1:] = reader.read(4096, 0)
+            self.assertEqual(lines, [u'one', u'tw\u00e9', u'three'])
+            self.assertFalse(reader.isDone)
+            os.close(writeFd)
+            writeFd = None
+            lines[-1:] = reader.read(4096, 0)
+            self.assertTrue(reader.isDone)
+            self.assertEqual(lines, [u'one', u'tw\u00e9', u'three'])
+            self.assertEqual(
+                reader.checksum(),
+                hashlib.sha512(u'one\ntw\u00e9\nthree'.encode(u'utf-8'))
+                .hexdigest())
+        finally:
+            reader.close()
+            if writeFd is not None:
+                os.close(writeFd)
+
+    def test_follow(self):
+        path = os.path.join(self.tempDir, u'follow.log')
+
+        def append(data):
+            with io.open(path, 'ab') as f:
+                f.write(data)
+
+        append(b'one\r\ntw')
+        offset = app.line_store.rowStartOffset(path, 7)
+        self.assertEqual(offset, 5)
+        reader = app.line_store.LineReader(path, u'utf-8', 8, offset, True)
+        self.assertEqual(reader.read(4096), [u'tw'])
+        self.assertEqual(reader.read(4096), [])
+        append(b'o\r')
+        self.assertEqual(reader.read(4096), [u'two'])
+        append(b'\nthree')
+        self.assertEqual(reader.read(4096), [u'two', u'three'])
+        self.assertFalse(reader.isDone)
+        self.assertIsNone(reader.checksum())
+        self.assertFalse(reader.isReplaced())
+        reader.close()
+        # A '\r\n' pair split by the offset.
+        with io.open(path, 'wb') as f:
+            f.write(b'one\r')
+        offset = app.line_store.rowStartOffset(path, 4)
+        self.assertEqual(offset, 4)
+        reader = app.line_store.LineReader(path, u'utf-8', 8, offset, True)
+        append(b'\ntwo\n')
+        self.assertEqual(reader.read(4096), [u'two', u''])
+        # Truncated.
+        with io.open(path, 'wb') as f:
+            f.write(b'x')
+        self.assertTrue(reader.isReplaced())
+        reader.close()
+        # Replaced.
+        reader = app.line_store.LineReader(path, u'utf-8', 8, 0, True)
+        self.assertFalse(reader.isReplaced())
+        os.rename(path, path + u'.1')
+        self.assertFalse(reader.isReplaced())
+        append(b'new')
+        self.assertTrue(reader.isReplaced())
+        reader.close()
+
+    def test_row_offsets(self):
+        path = os.path.join(self.tempDir, u'offsets.txt')
+        text = u'\n'.join(u'row %d \u00e9\x07' % (i,) for i in range(100))
+        data = text.encode(u'utf-8')
+        with io.open(path, 'wb') as f:
+            f.write(data)
+        reader = app.line_store.LineReader(path, u'utf-8', 8)
+        lines = [u'']
+        while not reader.isDone:
+            lines[-1:] = reader.read(50)
+        reader.close()
+        self.assertGreater(len(reader.rowOffsets), 10)
+        for row, offset in reader.rowOffsets:
+            self.assertEqual(data[:offset],
+                             u''.join(u'row %d \u00e9\x07\n' % (i,)
+                                      for i in range(row)).encode(u'utf-8'))
+        # Saving the rows would not reproduce these files.
+        for text in (u'a\tb\nc', u'a\r\nb', u'a\nb\rc'):
+            with io.open(path, 'wb') as f:
+                f.write(text.encode(u'utf-8'))
+            reader = app.line_store.LineReader(path, u'utf-8', 8)
+            while not reader.isDone:
+                reader.read(2)
+            reader.close()
+            self.assertIsNone(reader.rowOffsets)
+        reader = app.line_store.LineReader(path, u'utf-16', 8)
+        self.assertIsNone(reader.rowOffsets)
+        reader.close()
+
+    def test_decode_error(self):
+        path = os.path.join(self.tempDir, u'binary.dat')
+        with io.open(path, 'wb') as f:
+            f.write(b'text\n\xff\xfe')
+        reader = app.line_store.LineReader(path, u'utf-8', 8)
+        with self.assertRaises(UnicodeDecodeError):
+            while not reader.isDone:
+                reader.read(2)
+        reader.close()
+        # Replaced, even when the bad bytes are split across reads.
+        with io.open(path, 'wb') as f:
+            f.write(b'text\n\xe2\x82 \xe2\x82\xac')
+        for size in (-1, 1, 2, 3):
+            reader = app.line_store.LineReader(path, u'utf-8', 8,
+                                               errors=u'replace')
+            lines = [u'']
+            while not reader.isDone:
+                lines[-1:] = reader.read(size)
+            reader.close()
+            self.assertEqual(lines, [u'text', u'\ufffd \u20ac'])
+            self.assertTrue(reader.hasDecodeErrors)
+            self.assertIsNone(reader.rowOffsets)
+
+    def test_sniff_encoding(self):
+        path = os.path.join(self.tempDir, u'sniff.dat')
+        tests = [
+            (b'', u'utf-8'),
+            (b'plain text\n', u'utf-8'),
+            (u'caf\u00e9\n'.encode(u'utf-8'), u'utf-8'),
+            (codecs.BOM_UTF8 + b'text', u'utf-8'),
+            (u'\ufefftext'.encode(u'utf-16-le'), u'utf-16-le'),
+            (u'\ufefftext'.encode(u'utf-16-be'), u'utf-16-be'),
+            (u'\ufefftext'.encode(u'utf-32-le'), u'utf-32-le'),
+            (b'\x7fELF\x02\x01\x01\0\0\0\0\0\0\0\0\0', None),
+            (b'caf\xe9\n', None),
+            # The sample is cut part way through a character.
+            (b'a' * (app.line_store.kSniffSize - 1) + b'\xe2\x82\xac',
+             u'utf-8'),
+            # Past the sample, a bad byte is left to the reader.
+            (b'a' * app.line_store.kSniffSize + b'\xff', u'utf-8'),
+        ]
+        for data, expected in tests:
+            with io.open(path, 'wb') as f:
+                f.write(data)
+            self.assertEqual(app.line_store.sniffEncoding(path, u'ascii'),
+                             expected, data[:16])
+        with io.open(path, 'wb') as f:
+            f.write(b'caf\xe9\n')
+        self.assertEqual(app.line_store.sniffEncoding(path, u'iso8859-1'),
+                         u'iso8859-1')
+        # A file read with the sniffed encoding keeps its byte order mark.
+        data = u'\ufeffone\ntwo'.encode(u'utf-16-le')
+        with io.open(path, 'wb') as f:
+            f.write(data)
+        reader = app.line_store.LineReader(
+            path, app.line_store.sniffEncoding(path), 8)
+        self.assertEqual(reader.read(), [u'\ufeffone', u'two'])
+        reader.close()
+
+
+class WriteFileTestCases(unittest.TestCase):
+
+    def setUp(self):
+        self.tempDir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tempDir, u'write.txt')
+        with io.open(self.path, 'wb') as f:
+            f.write(b'original')
+        os.chmod(self.path, 0o640)
+
+    def tearDown(self):
+        shutil.rmtree(self.tempDir)
+
+    def read(self, path):
+        with io.open(path, 'rb') as f:
+            return f.read()
+
+    def test_replace(self):
+        for sync in (u'none', u'file', u'all'):
+            chunks = [b'one\n', b'', b'two']
+            self.assertEqual(
+                app.line_store.writeFile(self.path, iter(chunks), sync),
+                (hashlib.sha512(b'one\ntwo').hexdigest(), 7))
+            self.assertEqual(self.read(self.path), b'one\ntwo')
+            self.assertEqual(os.stat(self.path).st_mode & 0o777, 0o640)
+            self.assertEqual(os.listdir(self.tempDir), [u'write.txt'])
+        self.assertEqual(app.line_store.writeFile(self.path, []), (None, 0))
+        newPath = os.path.join(self.tempDir, u'new.txt')
+        app.line_store.writeFile(newPath, [b'new'])
+        self.assertEqual(self.read(newPath), b'new')
+
+    def test_failed_write(self):
+
+        def chunks():
+            yield b'partial'
+            raise ValueError(u'encoding failed')
+
+        with self.assertRaises(ValueError):
+            app.line_store.writeFile(self.path, chunks())
+        self.assertEqual(self.read(self.path), b'original')
+        self.assertEqual(os.listdir(self.tempDir), [u'write.txt'])
+
+    def test_rewrite(self):
+        self.assertEqual(
+            app.line_store.rewriteFile(self.path, 4, [b'n', b'al']),
+            (hashlib.sha512(b'orignal').hexdigest(), 7))
+        self.assertEqual(self.read(self.path), b'orignal')
+        self.assertEqual(
+            app.line_store.rewriteFile(self.path, 2, [b'0123456789'], u'none',
+                                       False), (None, 12))
+        self.assertEqual(self.read(self.path), b'or0123456789')
+
+    def test_links(self):
+        link = os.path.join(self.tempDir, u'link.txt')
+        os.symlink(self.path, link)
+        app.line_store.writeFile(link, [b'through the link'])
+        self.assertTrue(os.path.islink(link))
+        self.assertEqual(self.read(self.path), b'through the link')
+        hardLink = os.path.join(self.tempDir, u'hard.txt')
+        os.link(self.path, hardLink)
+        app.line_store.writeFile(self.path, [b'in place'])
+        self.assertEqual(self.read(hardLink), b'in place')
+
+
+class MappedLinesTestCases(unittest.TestCase):
+
+    def setUp(self):
+        self.tempDir = tempfile.mkdtemp()
+        self.indexDir = os.path.join(self.tempDir, u'index')
+
+    def tearDown(self):
+        shutil.rmtree(self.tempDir)
+
+    def mapText(self, text):
+        path = os.path.join(self.tempDir, u'mapped.txt')
+        with io.open(path, 'wb') as f:
+            f.write(text.encode(u'utf-8'))
+        return app.line_store.MappedLines(path, u'utf-8', 8, self.indexDir)
+
+    def test_lines(self):
+        blockRows = app.line_store.kBlockRows
+        tests = [
+            u'',
+            u'one line',
+            u'ends with a new line\n',
+            u'crlf\r\nand\ttab\r\nand \x07bell\n\u3000wide',
+            u''.join(u'row %d\n' % (i,) for i in range(blockRows)),
+            u'\n'.join(u'row %d' % (i,) for i in range(5 * blockRows + 3)),
+        ]
+        for text in tests:
+            lines = self.mapText(text)
+            lines.indexMore(2 * blockRows + 1)
+            self.assertGreaterEqual(len(lines), min(2 * blockRows + 1,
+                                                    text.count(u'\n') + 1))
+            while not lines.indexMore():
+                pass
+            self.assertTrue(lines.isComplete())
+            self.assertEqual(lines.progress(), 1.0)
+            expected = text.replace(u'\r\n', u'\n').expandtabs(8).replace(
+                u'\x07', u'\x0107').split(u'\n')
+            self.assertEqual(list(lines), expected)
+            self.assertEqual(lines[-1], expected[-1])
+            self.assertEqual(lines[3:5], expected[3:5])
+            lines.close()
+
+    def test_index_reused(self):
+        text = u'\n'.join(u'row %d' % (i,) for i in range(1000))
+        lines = self.mapText(text)
+        self.assertFalse(lines.isComplete())
+        self.assertEqual(len(lines), app.line_store.kBlockRows)
+        self.assertEqual(lines[10], u'row 10')
+        while not lines.indexMore():
+            pass
+        lines.close()
+        self.assertEqual(len(os.listdir(self.indexDir)), 1)
+        # The (unchanged) file opens with a complete index.
+        path = os.path.join(self.tempDir, u'mapped.txt')
+        lines = app.line_store.MappedLines(path, u'utf-8', 8, self.indexDir)
+        self.assertTrue(lines.isComplete())
+        self.assertEqual(len(lines), 1000)
+        self.assertEqual(lines[999], u'row 999')
+        lines.close()
+        # A changed file is indexed again.
+        lines = self.mapText(text + u'\nmore')
+        self.assertFalse(lines.isComplete())
+        while not lines.indexMore():
+            pass
+        self.assertEqual(len(lines), 1001)
+        lines.close()
+
+    def test_decode_errors(self):
+        path = os.path.join(self.tempDir, u'mapped.txt')
+        with io.open(path, 'wb') as f:
+            f.write(b'text\nbad \xff byte\n')
+        lines = app.line_store.MappedLines(path, u'utf-8', 8)
+        self.assertFalse(lines.hasDecodeErrors)
+        self.assertEqual(lines[1], u'bad \ufffd byte')
+        self.assertTrue(lines.hasDecodeErrors)
+        lines.close()
+        # The rows of UTF-16 text aren't found by their b'\n' bytes.
+        with self.assertRaises(ValueError):
+            app.line_store.MappedLines(path, u'utf-16-le', 8)
+
+
+class PackedLinesTestCases(unittest.TestCase):
+
+    def test_list_interface(self):
+        blockRows = app.line_store.kBlockRows
+        random.seed(5)
+        for _ in range(50):
+            expected = [
+                u'row %d%s' % (i, u' \u00e9\u3000' if i % 7 == 0 else u'')
+                for i in range(random.randrange(5 * blockRows))
+            ]
+            lines = app.line_store.PackedLines(expected)
+            self.assertEqual(lines, expected)
+            for change in range(30):
+                count = len(expected)
+                begin = random.randrange(count + 1)
+                end = random.randrange(begin, count + 1)
+                rows = [
+                    u'new %d %d' % (change, i)
+                    for i in range(random.choice((0, 1, 3, 3 * blockRows)))
+                ]
+                choice = random.randrange(5)
+                if choice == 0 and count:
+                    expected[begin % count] = rows and rows[0] or u''
+                    lines[begin % count] = rows and rows[0] or u''
+                elif choice == 1:
+                    expected[begin:end] = rows
+                    lines[begin:end] = rows
+                elif choice == 2:
+                    del expected[begin:end]
+                    del lines[begin:end]
+                elif choice == 3:
+                    expected.insert(begin, u'inserted')
+                    lines.insert(begin, u'inserted')
+                elif count:
+                    del expected[begin % count]
+                    del lines[begin % count]
+                self.assertEqual(len(lines), len(expected))
+                self.assertEqual(lines[begin:end], expected[begin:end])
+                if expected:
+                    self.assertEqual(lines[-1], expected[-1])
+            self.assertEqual(list(lines), expected)
+            # A copy is independent of the original.
+            other = copy.copy(lines)
+            other.insert(0, u'only in the copy')
+            self.assertEqual(lines, expected)
+            self.assertNotEqual(other, expected)
+
+    def test_edits_keep_blocks(self):
+        blockRows = app.line_store.kBlockRows
+        expected = [u'row %d' % (i,) for i in range(10 * blockRows)]
+        lines = app.line_store.PackedLines(expected)
+        blocks = repr(lines).split()[-2]
+        # Splitting a row, or deleting rows of two blocks, only changes the
+        # row counts of the blocks.
+        expected[5:6] = lines[5:6] = [u'ro', u'w 5']
+        del expected[blockRows - 1:2 * blockRows + 1]
+        del lines[blockRows - 1:2 * blockRows + 1]
+        self.assertEqual(repr(lines).split()[-2], blocks)
+        self.assertEqual(lines, expected)
+        self.assertEqual(lines[blockRows:blockRows + 3],
+                         expected[blockRows:blockRows + 3])
+        # Adding many rows in one place adds blocks.
+        for i in range(3 * blockRows):
+            expected.insert(blockRows, u'new %d' % (i,))
+            lines.insert(blockRows, u'new %d' % (i,))
+        self.assertNotEqual(repr(lines).split()[-2], blocks)
+        self.assertEqual(lines, expected)
+        self.assertEqual([lines[i] for i in range(len(expected))], expected)
+
+
+class HexLinesTestCases(unittest.TestCase):
+
+    def setUp(self):
+        self.tempDir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tempDir, u'binary.dat')
+
+    def tearDown(self):
+        shutil.rmtree(self.tempDir)
+
+    def hexLines(self, data):
+        with io.open(self.path, 'wb') as f:
+            f.write(data)
+        text = binascii.hexlify(data).decode(u'ascii')
+        rows = [text[i:i + 32] for i in range(0, len(text), 32)] + [u'']
+        return app.line_store.HexLines(self.path), rows
+
+    def test_list_interface(self):
+        random.seed(5)
+        for size in (0, 1, 16, 17, 1000):
+            lines, expected = self.hexLines(
+                bytes(bytearray(random.randrange(256) for _ in range(size))))
+            self.assertEqual(lines, expected)
+            for change in range(30):
+                count = len(expected)
+                begin = random.randrange(count + 1)
+                end = random.randrange(begin, count + 1)
+                rows = [u'%02x' % (change,)] * random.choice((0, 1, 3))
+                choice = random.randrange(4)
+                if choice == 0:
+                    expected[begin % count] = u'ab' + expected[begin % count]
+                    lines[begin % count] = u'ab' + lines[begin % count]
+                elif choice == 1 and (rows or end - begin < count):
+                    expected[begin:end] = rows
+                    lines[begin:end] = rows
+                elif choice == 2:
+                    expected.insert(begin, u'cd')
+                    lines.insert(begin, u'cd')
+                elif end - begin < count:
+                    del expected[begin:end]
+                    del lines[begin:end]
+                self.assertEqual(len(lines), len(expected))
+                self.assertEqual(lines[begin:end], expected[begin:end])
+                self.assertEqual(lines[-1], expected[-1])
+            self.assertEqual(list(lines), expected)
+            other = copy.copy(lines)
+            other.insert(0, u'only in the copy')
+            self.assertEqual(lines, expected)
+            self.assertNotEqual(other, expected)
+
+    def test_bytes(self):
+        data = bytes(bytearray(range(256))) * 3
+        lines, expected = self.hexLines(data)
+        self.assertEqual(b''.join(lines.byteChunks()), data)
+        self.assertEqual(lines.patches(), [])
+        # Changing bytes in place.
+        lines[1] = u'ff' + lines[1][2:]
+        lines[47] = u'ee' * 15 + u'dd'
+        # Whole rows are written.
+        self.assertEqual(lines.patches(), [(16, b'\xff' + data[17:32]),
+                                           (752, b'\xee' * 15 + b'\xdd')])
+        changed = data[:16] + b'\xff' + data[17:752] + b'\xee' * 15 + b'\xdd'
+        self.assertEqual(b''.join(lines.byteChunks()), changed)
+        # Changing the size means writing the whole file.
+        lines.insert(2, u'0 1 2')
+        self.assertIsNone(lines.patches())
+        self.assertRaises(ValueError, lambda: list(lines.byteChunks()))
+        lines[2] = u'01 02'
+        changed = changed[:32] + b'\x01\x02' + changed[32:]
+        self.assertEqual(b''.join(lines.byteChunks()), changed)
+
+    def test_rebase(self):
+        data = b'0123456789abcdefXYZ'
+        lines, expected = self.hexLines(data)
+        lines[1] = u'58595a5b'
+        app.line_store.writeFile(self.path, lines.byteChunks())
+        lines.rebase(self.path)
+        self.assertEqual(repr(lines), u'<HexLines 3 rows in 2 pieces>')
+        self.assertEqual(lines.patches(), [])
+        # Rows that would be shown differently from the file are kept.
+        lines.insert(1, u'4142')
+        app.line_store.writeFile(self.path, lines.byteChunks())
+        lines.rebase(self.path)
+        self.assertEqual(lines, [expected[0], u'4142', u'58595a5b', u''])
+        self.assertIsNone(lines.patches())
@@ -86,10 +86,11 @@ void blah();
                 self.assertEqual(self.parser.rowText(i), line)
                 self.assertEqual(
                     self.parser.rowTextAndWidth(i), (line, len(line)))
-            for node in self.parser.parserNodes:
-                # These tests have no double wide characters.
-                self.assertEqual(node[app.parser.kBegin],
-                                 node[app.parser.kVisual])
+            for nodes in self.parser.rows:
+                for node in nodes:
+                    # These tests have no double wide characters.
+                    self.assertEqual(node[app.parser.kBegin],
+                                     node[app.parser.kVisual])
             self.parser.debug_checkLines(None, test)
 
     def test_parse_cpp_literal(self):
@@ -17,9 +17,16 @@ from __future__ import division
 from __future__ import print_function
 
 from timeit import timeit
+import io
+import os
+import shutil
+import tempfile
 import unittest
 
+import app.ci_program
+import app.mutator
 import app.parser
+import app.text_buffer
 
 
 class PerformanceTestCases(unittest.TestCase):
@@ -45,6 +52,81 @@ class PerformanceTestCases(unittest.TestCase):
         self.assertGreater(c, a * 2)
         self.assertGreater(d, a * 2)
 
+    def test_line_diff_vs_ndiff(self):
+        # app.line_diff is expected to be much faster than difflib.ndiff (which
+        # it replaced) for typical find/replace changes.
+        setup = '''import difflib\n'''
+        setup += '''import app.line_diff\n'''
+        setup += '''a = ['line %d foo' % i for i in range(2000)]\n'''
+        setup += '''b = [i.replace('foo', 'bar') if i.endswith('7 foo') else i\n'''
+        setup += '''     for i in a]\n'''
+        a = timeit('''list(difflib.ndiff(a, b))\n''', setup=setup, number=1)
+        b = timeit('''app.line_diff.diffLines(a, b)\n''', setup=setup, number=1)
+        #print("\n%s %s | %s" % (a, b, a / b))
+        self.assertGreater(a, b * 5)
+
+    def test_partial_write(self):
+        # Saving a large file after an edit near its end rewrites only the
+        # end, so it should be much faster than after an edit near the start.
+        tempDir = tempfile.mkdtemp()
+        try:
+            prg = app.ci_program.CiProgram()
+            # As for files large enough to have no history (whose checksum
+            # would mean reading the start of the file).
+            prg.prefs.editor = dict(prg.prefs.editor, partialWriteSize=0,
+                                    onSaveStripTrailingSpaces=False,
+                                    performanceTiers=[{u'fileSize': 0,
+                                                       u'lineLength': 0}] * 2,
+                                    saveSync=u'none', useBgThread=False)
+            path = os.path.join(tempDir, u'large.txt')
+            rowCount = 200000
+            with io.open(path, 'w') as f:
+                f.write(u''.join(u'row %d of the large file\n' % (i,)
+                                 for i in range(rowCount)))
+            tb = app.text_buffer.TextBuffer(prg)
+            tb.setFilePath(path)
+            tb.fileLoad()
+
+            def save(row):
+                tb.cursorMoveTo(row, 0)
+                tb.insert(u'x')
+                return timeit(tb.fileWrite, number=1)
+
+            save(rowCount - 10)
+            times = [(row, save(row)) for row in (
+                0, rowCount // 4, rowCount // 2, rowCount - rowCount // 4,
+                rowCount - 10)]
+            #print('\n' + '\n'.join('%8d: %.4f' % i for i in times))
+            self.assertGreater(times[0][1], times[-1][1] * 3)
+        finally:
+            shutil.rmtree(tempDir)
+
+    def test_long_undo_history(self):
+        # The cost of adding a change should not depend on how many changes
+        # came before it (i.e. the redoChain must not be copied).
+        def edits(historyLength):
+            mutator = app.mutator.Mutator()
+            mutator.redoChain = [(('f',),)] * historyLength
+            mutator.redoIndex = mutator.oldRedoIndex = historyLength
+
+            def run():
+                for _ in range(100):
+                    mutator.redoAddChange(('i', u'a'))
+                    mutator.redo()
+                    mutator.compoundChangePush()
+                    mutator.redoAddChange(('n', 1, ('m', (1, -1, 0, 0, 0))))
+                    mutator.redo()
+                    mutator.compoundChangePush()
+
+            # Measure the steady state (after any one time catch up work).
+            run()
+            return timeit(run, number=5)
+
+        a = edits(0)
+        b = edits(200000)
+        #print("\n%s %s | %s" % (a, b, b / a))
+        self.assertLess(b, a * 3)
+
     def test_slice_vs_startswith(self):
         if 0:
             setup = '''x = 'a' * 100\n'''
@@ -27,6 +27,7 @@ import sys
 import types
 import curses
 
+import app.actions
 import app.config
 import app.controller
 import app.cu_editor
@@ -78,6 +79,9 @@ class ViewWindow:
         if app.config.strict_debug:
             app.log.check_le(row, self.rows)
             app.log.check_le(col, self.cols)
+        if u'\t' in text:
+            # A tab kept in a row (see Actions.rowTabSize()) takes one column.
+            text = text.replace(u'\t', u' ')
         self.program.frame.addStr(self.top + row, self.left + col,
                                   text.encode('utf-8'), colorPair)
 
@@ -434,11 +438,16 @@ class Window(ActiveWindow):
         """returns whether work is finished (no need to call again)."""
         finished = True
         tb = self.textBuffer
+        if tb is not None and not tb.loadMore():
+            finished = False
+        if tb is not None and not tb.filterMore():
+            finished = False
         if tb is not None and tb.parser.fullyParsedToLine < len(tb.lines):
             tb.parseDocument()
             # If a user event came in while parsing, the parsing will be paused
             # (to be resumed after handling the event).
-            finished = tb.parser.fullyParsedToLine >= len(tb.lines)
+            finished = (finished and
+                        tb.parser.fullyParsedToLine >= len(tb.lines))
         for child in self.zOrder:
             finished = finished and child.longTimeSlice()
         return finished
@@ -613,6 +622,13 @@ class LineNumbers(ViewWindow):
                 if currentRow + 1 > currentBookmark.end:
                     currentBookmarkIndex += 1
             self.addStr(i, 0, u' %5d ' % (currentRow + 1), color)
+        # Draw indicators for rows modified since the file was saved.
+        textBuffer = self.host.textBuffer
+        if textBuffer.isDirty():
+            color = colorPrefs.get(u'line_modified')
+            for i in range(limit):
+                if textBuffer.isRowModified(self.host.scrollRow + i):
+                    self.addStr(i, 0, u' ', color)
         # Draw indicators for text off of the left edge.
         if self.host.scrollCol > 0:
             color = colorPrefs.get(u'line_overflow')
@@ -931,6 +947,21 @@ class StatusLine(ViewWindow):
         rightSide = u''
         if len(statusLine):
             rightSide += u' |'
+        if tb.performanceTier:
+            rightSide += u' %s |' % (
+                app.actions.kTierNames[tb.performanceTier],)
+        if tb.hasMappedDecodeErrors():
+            rightSide += u' bytes replaced |'
+        loadProgress = tb.loadProgress()
+        filterProgress = tb.filterProgress()
+        if filterProgress is not None:
+            rightSide += u' filtering %3d%% |' % (filterProgress * 100,)
+        if loadProgress is not None:
+            rightSide += u' loading %3d%% |' % (loadProgress * 100,)
+        elif tb.isFollowing:
+            rightSide += u' following |'
+        elif tb.isLoading:
+            rightSide += u' reading |'
         if self.program.prefs.startup.get('showLogWindow'):
             rightSide += u' %s | %s |' % (tb.cursorGrammarName(),
                                           tb.selectionModeName())
@@ -44,12 +44,18 @@ import app.unit_test_application
 import app.unit_test_automatic_column_adjustment
 import app.unit_test_bookmarks
 import app.unit_test_brace_matching
+import app.unit_test_columns
 import app.unit_test_copy_paste
 import app.unit_test_curses_util
 import app.unit_test_execute_prompt
 import app.unit_test_file_manager
+import app.unit_test_file_watcher
 import app.unit_test_find_window
 import app.unit_test_intention
+import app.unit_test_journal
+import app.unit_test_line_diff
+import app.unit_test_line_filter
+import app.unit_test_line_store
 import app.unit_test_misspellings
 import app.unit_test_parser
 import app.unit_test_performance
@@ -80,18 +86,38 @@ TESTS = {
     app.unit_test_bookmarks.BookmarkTestCases,
     'brace_matching':
     app.unit_test_brace_matching.BraceMatchingTestCases,
+    'columns':
+    app.unit_test_columns.ColumnsTestCases,
     'copy_paste':
     app.unit_test_copy_paste.CopyPasteTestCases,
     'curses_util':
     app.unit_test_curses_util.CursesUtilTestCases,
     'file_manager':
     app.unit_test_file_manager.FileManagerTestCases,
+    'file_watcher':
+    app.unit_test_file_watcher.FileWatcherTestCases,
     'find':
     app.unit_test_find_window.FindWindowTestCases,
     'execute':
     app.unit_test_execute_prompt.ExecutePromptTestCases,
     'intention':
     app.unit_test_intention.IntentionTestCases,
+    'journal':
+    app.unit_test_journal.JournalTestCases,
+    'line_diff':
+    app.unit_test_line_diff.LineDiffTestCases,
+    'line_filter':
+    app.unit_test_line_filter.LineFilterTestCases,
+    'line_store_reader':
+    app.unit_test_line_store.LineReaderTestCases,
+    'line_store_write':
+    app.unit_test_line_store.WriteFileTestCases,
+    'line_store_hex':
+    app.unit_test_line_store.HexLinesTestCases,
+    'line_store_mapped':
+    app.unit_test_line_store.MappedLinesTestCases,
+    'line_store_packed':
+    app.unit_test_line_store.PackedLinesTestCases,
     'misspellings':
     app.unit_test_misspellings.MisspellingsTestCases,
     'parser':